@@ -0,0 +1,138 @@
+import argparse
+import json
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+from copy import deepcopy
+from lxml import etree
+from pipeline.constants import NAMESPACES
+from pipeline.hocr_tools.hocr_helpers import build_ocr_carea_text, remove_element_from_hocr_tree
+from pipeline.tei_encoding.layout_extraction import get_body_and_appendix_tree
+
+"""
+Compares get_body_and_appendix_tree with the former implementation that deep-copies the document three times.
+Every variant runs in its own process, so that the peak RSS of the split can be measured on its own.
+Run from pipeline_code with: python -m benchmarks.benchmark_body_appendix_split
+"""
+
+
+XHTML = NAMESPACES['x']
+WORDS = ['Die', 'Ausbildung', 'dauert', 'drei', 'Jahre', 'Prüfung', 'Betrieb', 'Berufsschule']
+
+
+def deepcopy_get_body_and_appendix_tree(hocr_tree: etree.ElementTree):
+    """
+    The former implementation with three deep copies of the document
+    """
+    hocr_tree_copy = deepcopy(hocr_tree)
+    body_tree = deepcopy(hocr_tree)
+    appendix_tree = deepcopy(hocr_tree)
+
+    hocr_tree_copy_pages = hocr_tree_copy.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
+    body_pages = body_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
+    appendix_pages = appendix_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
+
+    split_author_pattern = re.compile(r'Der Bundesminis(f|t|l)er (.*?)')
+    split_authorin_pattern = re.compile(r'Die Bundesminis(f|t|l)erin (.*?)')
+
+    is_body = True
+    for page_idx in range(len(hocr_tree_copy_pages)):
+        page = hocr_tree_copy_pages[page_idx]
+        ocr_careas = page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+        if is_body:
+            remove_element_from_hocr_tree(appendix_pages[page_idx])
+        else:
+            remove_element_from_hocr_tree(body_pages[page_idx])
+        for carea in ocr_careas:
+            carea_lines = " ".join(build_ocr_carea_text(carea))
+            if split_author_pattern.match(carea_lines) or split_authorin_pattern.match(carea_lines):
+                is_body = False
+
+    return body_tree, appendix_tree
+
+
+def synthetic_document(n_pages: int, careas_per_page: int = 20, lines_per_carea: int = 4, words_per_line: int = 8,
+                       seed: int = 0) -> etree.ElementTree:
+    """
+    Creates an hOCR document in which the author signs the page at two thirds of the document
+    """
+    rnd = random.Random(seed)
+    html = etree.Element(f'{{{XHTML}}}html', nsmap={None: XHTML})
+    etree.SubElement(html, f'{{{XHTML}}}head')
+    body = etree.SubElement(html, f'{{{XHTML}}}body')
+    author_page_idx = 2 * n_pages // 3
+    for page_idx in range(n_pages):
+        page = etree.SubElement(body, f'{{{XHTML}}}div')
+        page.set('class', 'ocr_page')
+        page.set('title', f'image "page_{page_idx}.tif"; bbox 0 0 2480 3508; ppageno {page_idx}')
+        for carea_idx in range(careas_per_page):
+            y = 100 + carea_idx * 160
+            carea = etree.SubElement(page, f'{{{XHTML}}}div')
+            carea.set('class', 'ocr_carea')
+            carea.set('title', f'bbox 200 {y} 2200 {y + 150}')
+            par = etree.SubElement(carea, f'{{{XHTML}}}p')
+            par.set('class', 'ocr_par')
+            par.set('title', f'bbox 200 {y} 2200 {y + 150}')
+            for line_idx in range(lines_per_carea):
+                line_y = y + line_idx * 37
+                line = etree.SubElement(par, f'{{{XHTML}}}span')
+                line.set('class', 'ocr_line')
+                line.set('title', f'bbox 200 {line_y} 2200 {line_y + 30}; baseline 0 -5; x_size 30')
+                for word_idx in range(words_per_line):
+                    word = etree.SubElement(line, f'{{{XHTML}}}span')
+                    word.set('class', 'ocrx_word')
+                    word.set('title', f'bbox {200 + word_idx * 250} {line_y} {400 + word_idx * 250} {line_y + 30}; '
+                                      f'x_wconf 90')
+                    word.text = rnd.choice(WORDS)
+        if page_idx == author_page_idx:
+            page.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)[0].text = "Der Bundesminister"
+    return etree.ElementTree(html)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(variant: str, n_pages: int) -> dict:
+    """
+    Splits a synthetic document with one of the implementations in the current process
+    """
+    hocr_tree = synthetic_document(n_pages)
+    rss_before = peak_rss_mb()
+    start_time = time.perf_counter()
+    if variant == 'deepcopy':
+        body_tree, appendix_tree = deepcopy_get_body_and_appendix_tree(hocr_tree)
+    else:
+        body_tree, appendix_tree = get_body_and_appendix_tree(hocr_tree)
+    duration = time.perf_counter() - start_time
+    return {"time": duration,
+            "peak_rss_increase_mb": peak_rss_mb() - rss_before,
+            "body_pages": len(body_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES)),
+            "appendix_pages": len(appendix_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Body/appendix split benchmark")
+    parser.add_argument('--variant', choices=['deepcopy', 'move'])
+    parser.add_argument('--pages', type=int, nargs='+', default=[25, 50, 100, 200])
+    args = parser.parse_args()
+    if args.variant is not None:
+        print(json.dumps(run_variant(args.variant, args.pages[0])))
+        sys.exit(0)
+
+    print(f"{'pages':>6} {'variant':>9} {'time [s]':>9} {'peak RSS increase [MB]':>23}")
+    for n_pages in args.pages:
+        results = {}
+        for variant in ['deepcopy', 'move']:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.benchmark_body_appendix_split',
+                                     '--variant', variant, '--pages', str(n_pages)],
+                                    capture_output=True, text=True, check=True).stdout
+            results[variant] = json.loads(output.strip().splitlines()[-1])
+            print(f"{n_pages:>6} {variant:>9} {results[variant]['time']:>9.3f} "
+                  f"{results[variant]['peak_rss_increase_mb']:>23.1f}")
+        assert results['deepcopy']['body_pages'] == results['move']['body_pages']
+        assert results['deepcopy']['appendix_pages'] == results['move']['appendix_pages']
@@ -0,0 +1,116 @@
+from lxml import etree
+import copy
+import random
+import time
+import numpy as np
+from pipeline.constants import NAMESPACES
+from pipeline.hocr_tools.hocr_helpers import ocr_elements_overlap_horizontally, get_element_bbox, \
+    remove_element_from_hocr_tree
+from pipeline.hocr_tools.hocr_properties import carea_contins_only_empty_words
+from pipeline.resegmentation.paragraph_merging_x import merge_careas_on_x_axis_in_document_tree
+
+"""
+Compares merge_careas_on_x_axis_in_document_tree with the former pairwise implementation on synthetic pages with 50 to
+500 careas and checks that both produce the same tree.
+Run from pipeline_code with: python -m benchmarks.benchmark_carea_merging
+"""
+
+
+XHTML = NAMESPACES['x']
+
+
+def pairwise_merge_careas_on_x_axis_in_document_tree(hocr_tree: etree.ElementTree, max_area_dist: float = 50):
+    """
+    The former implementation that compares every pair of careas of a page
+    """
+    pages = hocr_tree.xpath("///x:div[@class='ocr_page']", namespaces=NAMESPACES)
+    merged_in_careas = []
+    for page_idx in range(len(pages)):
+        page = pages[page_idx]
+        careas = page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+        careas.sort(key=lambda x: get_element_bbox(x)[0])
+        for area in careas:
+            for other_area in careas[careas.index(area) + 1:]:
+                if ocr_elements_overlap_horizontally(area, other_area) and \
+                        not carea_contins_only_empty_words(area) and \
+                        not carea_contins_only_empty_words(other_area):
+                    a_x1, a_y1, a_x2, a_y2 = get_element_bbox(area)
+                    b_x1, b_y1, b_x2, b_y2 = get_element_bbox(other_area)
+                    if a_x2 <= b_x2:
+                        left_area = area
+                        right_area = other_area
+                    else:
+                        left_area = other_area
+                        right_area = area
+                    area_distance = min([np.abs(a_x1 - b_x2), np.abs(a_x2 - b_x1)])
+                    if area_distance < max_area_dist or a_x1 <= b_x1 <= a_x2 or b_x1 <= a_x1 <= b_x2 or \
+                            a_x1 <= b_x2 <= a_x2 or b_x1 <= a_x2 <= b_x2:
+                        right_bbox = get_element_bbox(right_area)
+                        x1 = min([a_x1, b_x1])
+                        y1 = right_bbox[1]
+                        x2 = max([a_x2, b_x2])
+                        y2 = right_bbox[3]
+                        right_area.set("title", f"bbox {x1} {y1} {x2} {y2}")
+                        merged_in_careas.append(left_area)
+    for area in merged_in_careas:
+        remove_element_from_hocr_tree(area)
+
+
+def synthetic_page_tree(n_careas: int, seed: int = 0, page_width: int = 2480, page_height: int = 3508,
+                        empty_share: float = 0.1) -> etree.ElementTree:
+    """
+    Creates a document with one page of n_careas careas in up to four columns. Each carea has one line with one word,
+    some words are empty
+    """
+    rnd = random.Random(seed)
+    html = etree.Element(f'{{{XHTML}}}html', nsmap={None: XHTML})
+    body = etree.SubElement(html, f'{{{XHTML}}}body')
+    page = etree.SubElement(body, f'{{{XHTML}}}div')
+    page.set('class', 'ocr_page')
+    page.set('title', f'image "page.tif"; bbox 0 0 {page_width} {page_height}; ppageno 0')
+    column_width = page_width // 4
+    for _ in range(n_careas):
+        column = rnd.randrange(4)
+        x1 = column * column_width + rnd.randint(0, column_width // 2)
+        x2 = min(page_width, x1 + rnd.randint(40, column_width))
+        y1 = rnd.randint(0, page_height - 100)
+        y2 = y1 + rnd.randint(20, 100)
+        bbox = f'bbox {x1} {y1} {x2} {y2}'
+        carea = etree.SubElement(page, f'{{{XHTML}}}div')
+        carea.set('class', 'ocr_carea')
+        carea.set('title', bbox)
+        par = etree.SubElement(carea, f'{{{XHTML}}}p')
+        par.set('class', 'ocr_par')
+        par.set('title', bbox)
+        line = etree.SubElement(par, f'{{{XHTML}}}span')
+        line.set('class', 'ocr_line')
+        line.set('title', f'{bbox}; baseline 0 0; x_size 30')
+        word = etree.SubElement(line, f'{{{XHTML}}}span')
+        word.set('class', 'ocrx_word')
+        word.set('title', f'{bbox}; x_wconf 90')
+        word.text = None if rnd.random() < empty_share else 'Wort'
+    return etree.ElementTree(html)
+
+
+def time_function(merge_function, hocr_tree: etree.ElementTree, repetitions: int):
+    """
+    Returns the best time of merge_function over repetitions runs on copies of hocr_tree and the merged tree
+    """
+    best_time = float('inf')
+    merged_tree = None
+    for _ in range(repetitions):
+        merged_tree = copy.deepcopy(hocr_tree)
+        start_time = time.perf_counter()
+        merge_function(merged_tree)
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time, merged_tree
+
+
+if __name__ == '__main__':
+    print(f"{'careas':>8} {'pairwise [s]':>14} {'sweep [s]':>12} {'speedup':>9}")
+    for n_careas in [50, 100, 200, 300, 500]:
+        tree = synthetic_page_tree(n_careas, seed=n_careas)
+        pairwise_time, pairwise_tree = time_function(pairwise_merge_careas_on_x_axis_in_document_tree, tree, 1)
+        sweep_time, sweep_tree = time_function(merge_careas_on_x_axis_in_document_tree, tree, 3)
+        assert etree.tostring(pairwise_tree) == etree.tostring(sweep_tree), f"Different results for {n_careas} careas"
+        print(f"{n_careas:>8} {pairwise_time:>14.4f} {sweep_time:>12.4f} {pairwise_time / sweep_time:>8.1f}x")
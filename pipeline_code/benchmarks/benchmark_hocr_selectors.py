@@ -0,0 +1,86 @@
+"""
+Compares the cost of collecting the careas, lines and words of every page with string XPath queries, with the
+compiled selectors of hocr_selectors and with a single group_by_class walk per page.
+Run from pipeline_code with: python -m benchmarks.benchmark_hocr_selectors
+"""
+import time
+from collections import defaultdict
+from typing import Dict, List
+from lxml import etree
+from pipeline.constants import NAMESPACES
+from pipeline.hocr_tools.hocr_selectors import BODY_PAGES, CAREAS, TEXT_AND_HEADER_LINES, WORDS
+from benchmarks.benchmark_body_appendix_split import synthetic_document
+
+
+def group_by_class(hocr_element: etree.ElementTree) -> Dict[str, List[etree.ElementTree]]:
+    """
+    Walks the subtree of hocr_element once and buckets all descendants by their class attribute. Other than the
+    selectors, the buckets do not check the tag of the elements, which is unique per class in hOCR
+    :param hocr_element: element or tree whose descendants are grouped, the element itself is not included
+    :return: lists of elements in document order per class
+    """
+    if isinstance(hocr_element, etree._ElementTree):
+        hocr_element = hocr_element.getroot()
+    elements_by_class = defaultdict(list)
+    for element in hocr_element.iterdescendants(tag=etree.Element):
+        hocr_class = element.get('class')
+        if hocr_class is not None:
+            elements_by_class[hocr_class].append(element)
+    return elements_by_class
+
+
+def traverse_with_strings(pages):
+    counts = [0, 0, 0]
+    for page in pages:
+        for carea in page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
+            counts[0] += 1
+            for line in carea.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']",
+                                    namespaces=NAMESPACES):
+                counts[1] += 1
+                counts[2] += len(line.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES))
+    return counts
+
+
+def traverse_with_selectors(pages):
+    counts = [0, 0, 0]
+    for page in pages:
+        for carea in CAREAS(page):
+            counts[0] += 1
+            for line in TEXT_AND_HEADER_LINES(carea):
+                counts[1] += 1
+                counts[2] += len(WORDS(line))
+    return counts
+
+
+def traverse_with_class_groups(pages):
+    counts = [0, 0, 0]
+    for page in pages:
+        elements_by_class = group_by_class(page)
+        counts[0] += len(elements_by_class['ocr_carea'])
+        counts[1] += sum(len(elements_by_class[line_class]) for line_class in ['ocr_line', 'ocr_textfloat', 'ocr_header'])
+        counts[2] += len(elements_by_class['ocrx_word'])
+    return counts
+
+
+def best_time(function, pages, repetitions: int = 5):
+    times = []
+    result = None
+    for _ in range(repetitions):
+        start_time = time.perf_counter()
+        result = function(pages)
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    pages = BODY_PAGES(synthetic_document(50))
+    print(f"{'variant':>14} {'ms per page':>12}")
+    reference = None
+    for name, function in [('xpath strings', traverse_with_strings),
+                           ('selectors', traverse_with_selectors),
+                           ('class groups', traverse_with_class_groups)]:
+        duration, counts = best_time(function, pages)
+        if reference is None:
+            reference = counts
+        assert counts == reference, f"{name} found {counts} instead of {reference} elements"
+        print(f"{name:>14} {1000 * duration / len(pages):>12.3f}")
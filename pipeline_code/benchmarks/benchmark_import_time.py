@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+"""
+Measures how long a fresh interpreter needs to import pipeline.text_encoding and checks that no plotting or clustering
+backend is imported on the way. Exits with a non-zero status if the import is slower than the budget or a heavy module
+is loaded, so it can be used as a regression check.
+Run from pipeline_code with: python -m benchmarks.benchmark_import_time
+"""
+
+
+PIPELINE_CODE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['matplotlib', 'sklearn', 'scipy', 'pytesseract', 'tesserocr']
+IMPORT_SCRIPT = """
+import json
+import sys
+import time
+start_time = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start_time
+print(json.dumps({{"import_time": import_time,
+                  "heavy_modules": [m for m in {heavy_modules!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str = 'pipeline.text_encoding') -> dict:
+    """
+    Imports module in a new interpreter
+    :param module: name of the module to import
+    :return: dictionary with the import time in seconds and the heavy modules that were imported
+    """
+    result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)],
+                            cwd=PIPELINE_CODE_DIRECTORY, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import time regression check")
+    parser.add_argument('--module', default='pipeline.text_encoding')
+    parser.add_argument('--budget', type=float, default=0.5, help="maximum import time in seconds")
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    measurements = [measure_import(args.module) for _ in range(args.repetitions)]
+    # The fastest run is the least affected by other processes
+    best_time = min(measurement["import_time"] for measurement in measurements)
+    heavy_modules = sorted(set(module for measurement in measurements for module in measurement["heavy_modules"]))
+    print(f"import {args.module}: {best_time:.3f} s (budget {args.budget:.3f} s)")
+    failed = False
+    if heavy_modules:
+        print(f"Heavy modules imported: {', '.join(heavy_modules)}")
+        failed = True
+    if best_time > args.budget:
+        print("Import time exceeds the budget")
+        failed = True
+    sys.exit(1 if failed else 0)
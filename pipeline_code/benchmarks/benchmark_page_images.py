@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+from pipeline.tei_encoding.page_images import PageImageProvider
+
+"""
+Compares the peak RSS of a list of opened PIL images with PageImageProvider while every page is whitened and cropped
+like in remove_empty_careas and encode_body_tree. Every variant runs in its own process.
+Run from pipeline_code with: python -m benchmarks.benchmark_page_images
+"""
+
+
+PAGE_SIZE = (2480, 3508)  # A4 at 300 dpi
+
+
+def write_page_images(directory: str, n_pages: int, seed: int = 0) -> list:
+    """
+    Writes n_pages grayscale TIFF pages with random dark text blocks
+    """
+    rng = np.random.default_rng(seed)
+    image_paths = []
+    for page_idx in range(n_pages):
+        pixels = np.full((PAGE_SIZE[1], PAGE_SIZE[0]), 255, dtype=np.uint8)
+        for _ in range(40):
+            x, y = rng.integers(0, PAGE_SIZE[0] - 400), rng.integers(0, PAGE_SIZE[1] - 60)
+            pixels[y:y + 40, x:x + 400] = rng.integers(0, 120, size=(40, 400), dtype=np.uint8)
+        image_path = os.path.join(directory, f"page_{page_idx:04d}.tif")
+        Image.fromarray(pixels).save(image_path, compression='tiff_lzw')
+        image_paths.append(image_path)
+    return image_paths
+
+
+def process_pages(images) -> int:
+    """
+    Whitens a strip of every page and crops some areas of it, returns a checksum over the crops
+    """
+    checksum = 0
+    white_image = Image.new('L', (600, 200), 255)
+    for page_idx in range(len(images)):
+        images[page_idx].paste(white_image, (100, 100, 700, 300))
+    for page_idx in range(len(images)):
+        page_image = images[page_idx]
+        for y in range(0, PAGE_SIZE[1] - 200, 400):
+            checksum += int(np.asarray(page_image.crop((200, y, 2200, y + 200))).sum()) % 1000003
+    return checksum
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(variant: str, image_paths: list) -> dict:
+    rss_before = peak_rss_mb()
+    start_time = time.perf_counter()
+    if variant == 'pil':
+        checksum = process_pages([Image.open(image_path) for image_path in image_paths])
+    else:
+        with PageImageProvider(image_paths) as images:
+            checksum = process_pages(images)
+    return {"time": time.perf_counter() - start_time,
+            "peak_rss_increase_mb": peak_rss_mb() - rss_before,
+            "checksum": checksum}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Page image memory benchmark")
+    parser.add_argument('--variant', choices=['pil', 'provider'])
+    parser.add_argument('--image-dir')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 30])
+    args = parser.parse_args()
+    if args.variant is not None:
+        paths = sorted(os.path.join(args.image_dir, name) for name in os.listdir(args.image_dir))
+        print(json.dumps(run_variant(args.variant, paths)))
+        sys.exit(0)
+
+    print(f"{'pages':>6} {'variant':>9} {'time [s]':>9} {'peak RSS increase [MB]':>23}")
+    for n_pages in args.pages:
+        with tempfile.TemporaryDirectory() as image_dir:
+            write_page_images(image_dir, n_pages)
+            results = {}
+            for variant in ['pil', 'provider']:
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.benchmark_page_images',
+                                         '--variant', variant, '--image-dir', image_dir],
+                                        capture_output=True, text=True, check=True).stdout
+                results[variant] = json.loads(output.strip().splitlines()[-1])
+                print(f"{n_pages:>6} {variant:>9} {results[variant]['time']:>9.3f} "
+                      f"{results[variant]['peak_rss_increase_mb']:>23.1f}")
+            assert results['pil']['checksum'] == results['provider']['checksum']
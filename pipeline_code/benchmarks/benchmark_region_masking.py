@@ -0,0 +1,70 @@
+import argparse
+import time
+import numpy as np
+from PIL import Image
+from pipeline.tei_encoding.page_images import MappedPageImage, mask_page_regions
+
+"""
+Compares whitening regions by pasting a new white image per region with mask_page_regions on a PIL page and on a
+MappedPageImage. The regions are thin separators like the column and table lines of older regulations.
+Run from pipeline_code with: python -m benchmarks.benchmark_region_masking
+"""
+
+
+PAGE_SIZE = (2480, 3508)  # A4 at 300 dpi
+
+
+def separator_boxes(n_boxes: int, seed: int = 0) -> list:
+    """
+    Creates n_boxes horizontal and vertical lines of 3 to 8 pixels thickness
+    """
+    rng = np.random.default_rng(seed)
+    boxes = []
+    for box_idx in range(n_boxes):
+        thickness = int(rng.integers(3, 9))
+        if box_idx % 2 == 0:
+            x1, y1 = int(rng.integers(0, 1200)), int(rng.integers(0, PAGE_SIZE[1]))
+            boxes.append((x1, y1, x1 + int(rng.integers(200, 1200)), y1 + thickness))
+        else:
+            x1, y1 = int(rng.integers(0, PAGE_SIZE[0])), int(rng.integers(0, 1700))
+            boxes.append((x1, y1, x1 + thickness, y1 + int(rng.integers(200, 1700))))
+    return boxes
+
+
+def paste_white_images(image: Image.Image, boxes: list):
+    """
+    The former implementation that pastes a new white image per region
+    """
+    for x1, y1, x2, y2 in boxes:
+        white_image = Image.new('RGB', (x2 - x1, y2 - y1), color='white')
+        image.paste(white_image, (x1, y1, x2, y2))
+
+
+def measure(function, repetitions: int) -> float:
+    durations = []
+    for _ in range(repetitions):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return min(durations)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Region masking benchmark")
+    parser.add_argument('--boxes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--mode', default='L', choices=['1', 'L', 'RGB'])
+    parser.add_argument('--repetitions', type=int, default=5)
+    args = parser.parse_args()
+
+    page = Image.fromarray(np.random.default_rng(0).integers(0, 256, (PAGE_SIZE[1], PAGE_SIZE[0]), dtype=np.uint8))
+    page = page.convert(args.mode)
+    print(f"{'boxes':>6} {'paste [ms]':>11} {'mask PIL [ms]':>14} {'mask mapped [ms]':>17}")
+    for n_boxes in args.boxes:
+        boxes = separator_boxes(n_boxes)
+        pasted_page, masked_page = page.copy(), page.copy()
+        mapped_page = MappedPageImage(np.array(page))
+        paste_time = measure(lambda: paste_white_images(pasted_page, boxes), args.repetitions)
+        mask_time = measure(lambda: mask_page_regions(masked_page, boxes), args.repetitions)
+        mapped_time = measure(lambda: mask_page_regions(mapped_page, boxes), args.repetitions)
+        assert pasted_page.tobytes() == masked_page.tobytes() == mapped_page.to_pil().tobytes()
+        print(f"{n_boxes:>6} {paste_time * 1000:>11.2f} {mask_time * 1000:>14.2f} {mapped_time * 1000:>17.2f}")
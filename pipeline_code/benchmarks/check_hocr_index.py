@@ -0,0 +1,133 @@
+"""
+Regression run for the changes of the tree through HocrIndex. Random remove, merge, split and set_bbox calls are
+applied to the pages of a synthetic regulation, and after each call the index is compared with a fresh HocrIndex of the
+changed page: the alive rows, their classes, bboxes, parents and texts, rows_of_class in document order, the
+descendants of every element and has_ancestor_of_class. Some lines are wrapped in elements without bbox, which are not
+indexed.
+Run from pipeline_code with: python -m benchmarks.check_hocr_index
+"""
+import argparse
+import random
+import sys
+from lxml import etree
+from pipeline.hocr_tools.hocr_index import HocrIndex, HOCR_CLASSES
+from pipeline.hocr_tools.hocr_selectors import PAGES, PARS
+from benchmarks.synthetic_regulation import generate_regulation
+
+
+def index_differences(hocr_index: HocrIndex) -> list:
+    """
+    Compares hocr_index with a fresh index of its root
+    :return: descriptions of all differences
+    """
+    fresh_index = HocrIndex(hocr_index.root)
+    differences = []
+    alive_elements = {hocr_index.element(row) for row in range(len(hocr_index)) if hocr_index.alive[row]}
+    fresh_elements = {fresh_index.element(row) for row in range(len(fresh_index))}
+    if alive_elements != fresh_elements:
+        differences.append(f"{len(alive_elements ^ fresh_elements)} elements are alive in only one index")
+        return differences
+
+    def parent_element(index, row):
+        return index.element(index.parents[row]) if index.parents[row] >= 0 else None
+
+    for fresh_row in range(len(fresh_index)):
+        element = fresh_index.element(fresh_row)
+        row = hocr_index.row(element)
+        for name, value, expected in [
+                ('class', hocr_index.classes[row], fresh_index.classes[fresh_row]),
+                ('bbox', list(hocr_index.bboxes[row]), list(fresh_index.bboxes[fresh_row])),
+                ('parent', parent_element(hocr_index, row), parent_element(fresh_index, fresh_row)),
+                ('text', hocr_index.element_text(row), fresh_index.element_text(fresh_row))]:
+            if value != expected:
+                differences.append(f"{name} of {element.get('title')}: {value} instead of {expected}")
+        descendants = {hocr_index.element(descendant_row) for descendant_row in hocr_index.descendant_rows(row)
+                       if hocr_index.alive[descendant_row]}
+        if descendants != set(fresh_index.elements(fresh_index.descendant_rows(fresh_row))):
+            differences.append(f"descendants of {element.get('title')}")
+    for hocr_class in HOCR_CLASSES:
+        if hocr_index.elements(hocr_index.rows_of_class(hocr_class)) != \
+                fresh_index.elements(fresh_index.rows_of_class(hocr_class)):
+            differences.append(f"rows_of_class('{hocr_class}')")
+        rows = hocr_index.rows_of_class(hocr_class)
+        fresh_rows = fresh_index.rows_of_class(hocr_class)
+        for ancestor_class in ['ocr_carea', 'ocr_par']:
+            if list(hocr_index.has_ancestor_of_class(rows, ancestor_class)) != \
+                    list(fresh_index.has_ancestor_of_class(fresh_rows, ancestor_class)):
+                differences.append(f"has_ancestor_of_class of {hocr_class} rows for {ancestor_class}")
+    for carea in fresh_index.elements(fresh_index.rows_of_class('ocr_carea')):
+        if hocr_index.elements(hocr_index.rows_of_class('ocr_line', within=carea)) != \
+                fresh_index.elements(fresh_index.rows_of_class('ocr_line', within=carea)):
+            differences.append(f"rows_of_class('ocr_line') within {carea.get('title')}")
+    return differences
+
+
+def wrap_lines_without_bbox(page: etree.ElementTree, rnd: random.Random):
+    """
+    Moves the lines of some paragraphs into a span without title
+    """
+    for par in PARS(page):
+        if len(par) > 1 and rnd.random() < 0.3:
+            wrapper = etree.Element(par[0].tag)
+            for line in list(par)[rnd.randrange(len(par)):]:
+                wrapper.append(line)
+            par.append(wrapper)
+
+
+def random_change(hocr_index: HocrIndex, rnd: random.Random) -> str:
+    """
+    Changes the tree through hocr_index at a random element
+    :return: description of the change
+    """
+    rows = [row for row in hocr_index.rows_of_class(['ocr_carea', 'ocr_par', 'ocr_line', 'ocrx_word'])]
+    element = hocr_index.element(rnd.choice(rows))
+    change = rnd.choice(['remove', 'merge', 'split', 'set_bbox'])
+    if change == 'remove' and element.get('class') != 'ocr_carea':
+        hocr_index.remove(element)
+    elif change == 'merge':
+        others = [hocr_index.element(row) for row in hocr_index.rows_of_class(element.get('class'))
+                  if hocr_index.element(row) is not element]
+        if not others:
+            return 'none'
+        # Any element of the same class, also one in front of element
+        hocr_index.merge(element, rnd.choice(others))
+    elif change == 'split' and len(element) > 1:
+        hocr_index.split(element, rnd.randrange(1, len(element)))
+    elif change == 'set_bbox':
+        hocr_index.set_bbox(element, [coordinate + rnd.randint(-20, 20) for coordinate in hocr_index.bbox(element)])
+    else:
+        return 'none'
+    return f"{change} {element.get('class')}"
+
+
+def check_hocr_index(n_paragraphs: int = 8, seed: int = 0, changes: int = 40) -> bool:
+    """
+    Applies changes random changes to every page and compares the index with a fresh index after each of them
+    :return: True if there was no difference
+    """
+    regulation = generate_regulation(n_paragraphs=n_paragraphs, n_appendix_pages=1, seed=seed, render_images=False)
+    rnd = random.Random(seed)
+    all_same = True
+    for page_idx, page in enumerate(PAGES(regulation.hocr_tree)):
+        wrap_lines_without_bbox(page, rnd)
+        hocr_index = HocrIndex(page)
+        applied = []
+        for _ in range(changes):
+            applied.append(random_change(hocr_index, rnd))
+            differences = index_differences(hocr_index)
+            if differences:
+                print(f"page {page_idx} after {', '.join(applied)}: {'; '.join(differences[:5])}")
+                all_same = False
+                break
+        else:
+            print(f"page {page_idx}: {len(applied) - applied.count('none')} changes, same")
+    return all_same
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HocrIndex compared with a fresh index after each change")
+    parser.add_argument('--paragraphs', type=int, default=8, help="number of § of the body")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--changes', type=int, default=40, help="number of changes per page")
+    args = parser.parse_args()
+    sys.exit(0 if check_hocr_index(args.paragraphs, args.seed, args.changes) else 1)
@@ -0,0 +1,84 @@
+import argparse
+import hashlib
+import logging
+import sys
+import tempfile
+from PIL import Image
+from lxml import etree
+from pipeline.hocr_tools.hocr_loader import load_hocr_document
+from pipeline.text_encoding import encode_hocr_tree_in_tei
+from pipeline.tei_encoding.ocr_cache import configure_ocr_cache
+from pipeline.tei_encoding.ocr_engine import configure_engine_class
+from benchmarks.synthetic_regulation import SyntheticOcrEngine, generate_regulation, write_regulation
+
+"""
+Regression run for the concurrent re-OCR on page images that are opened lazily with Image.open, like in
+examples/pipeline_call.py before PageImageProvider. A lazily opened image decodes its file on the first crop, which
+must not happen in several threads at once. A synthetic regulation is written as hOCR and TIFF files and encoded with
+fresh lazily opened images, once sequentially and once with each worker setting; all TEI outputs must be the same.
+The pages have no separators, so that the images are not already decoded by whitening the separators.
+Run from pipeline_code with: python -m benchmarks.check_lazy_page_images
+"""
+
+
+LOGGER = logging.getLogger('benchmarks.check_lazy_page_images')
+LOGGER.addHandler(logging.NullHandler())
+LOGGER.propagate = False
+
+
+def encode_with_lazy_images(hocr_paths, image_paths, **encoding_options) -> bytes:
+    """
+    Encodes the regulation with images that are opened, but not yet decoded
+    """
+    images = [Image.open(image_path) for image_path in image_paths]
+    # Every run starts with an empty OCR cache, so that every crop is recognized
+    configure_ocr_cache()
+    try:
+        tei_tree = encode_hocr_tree_in_tei(load_hocr_document(hocr_paths), images, logger=LOGGER, **encoding_options)
+    finally:
+        for image in images:
+            image.close()
+    return etree.tostring(tei_tree, encoding='utf-8')
+
+
+def check_lazy_page_images(n_paragraphs: int = 12, n_appendix_pages: int = 2, seed: int = 0, workers: int = 4,
+                           rounds: int = 3) -> bool:
+    """
+    Compares the sequential encoding with the encodings that use workers threads for the prefetching of the re-OCR
+    and for the pages
+    :return: True if all encodings are the same
+    """
+    configure_engine_class(SyntheticOcrEngine)
+    try:
+        regulation = generate_regulation(n_paragraphs=n_paragraphs, n_appendix_pages=n_appendix_pages, seed=seed,
+                                         separators=False)
+        with tempfile.TemporaryDirectory() as directory:
+            hocr_paths, image_paths = write_regulation(regulation, directory)
+            expected = encode_with_lazy_images(hocr_paths, image_paths)
+            print(f"sequential: {len(expected)} bytes, {hashlib.md5(expected).hexdigest()}")
+            all_same = True
+            for name, encoding_options in [("prefetch", {"ocr_prefetch_workers": workers}),
+                                           ("pages", {"page_workers": workers}),
+                                           ("prefetch+pages", {"ocr_prefetch_workers": workers,
+                                                               "page_workers": workers})]:
+                for round_idx in range(rounds):
+                    tei = encode_with_lazy_images(hocr_paths, image_paths, **encoding_options)
+                    same = tei == expected
+                    all_same = all_same and same
+                    print(f"{name} round {round_idx}: {len(tei)} bytes, {hashlib.md5(tei).hexdigest()} "
+                          f"{'same' if same else 'DIFFERENT'}")
+    finally:
+        configure_engine_class(None)
+    return all_same
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent re-OCR on lazily opened page images")
+    parser.add_argument('--paragraphs', type=int, default=12, help="number of § of the body")
+    parser.add_argument('--appendix-pages', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    sys.exit(0 if check_lazy_page_images(args.paragraphs, args.appendix_pages, args.seed, args.workers,
+                                         args.rounds) else 1)
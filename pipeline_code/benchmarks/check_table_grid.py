@@ -0,0 +1,110 @@
+"""
+Compares the overlap tests of TableGrid with rectangles_overlap of table_extraction. For random grids and boxes, the
+cells that cell_spans returns must be exactly the cells that rectangles_overlap finds for the box, also for boxes on the
+rules, outside of the grid and for grids without cells, and with a tolerance for the box shrunk by the tolerance. area
+must be the area of get_table_area_from_td_boxes. cells_over_rules must not flag any cell before the expansion and is
+counted for the appendix pages of synthetic regulations.
+Run from pipeline_code with: python -m benchmarks.check_table_grid
+"""
+import argparse
+import sys
+import numpy as np
+from pipeline.instrumentation import start_instrumentation, stop_instrumentation
+from pipeline.tei_encoding.ocr_engine import configure_engine_class
+from pipeline.tei_encoding.table_processing.table_extraction import TableGrid, cells_over_rules, \
+    extract_page_table_boxes, get_table_area_from_td_boxes, rectangles_overlap
+from benchmarks.run_benchmarks import appendix_pages
+from benchmarks.synthetic_regulation import SyntheticOcrEngine, generate_regulation
+
+
+def overlapped_cells(grid: TableGrid, box) -> set:
+    """
+    Cells that rectangles_overlap finds for box, one test per cell
+    """
+    return {(row_idx, column_idx) for row_idx, row in enumerate(grid.cell_boxes())
+            for column_idx, cell_box in enumerate(row) if rectangles_overlap(box, cell_box)}
+
+
+def spanned_cells(span) -> set:
+    first_row, first_column, last_row, last_column = span
+    return {(row_idx, column_idx) for row_idx in range(first_row, last_row + 1)
+            for column_idx in range(first_column, last_column + 1)}
+
+
+def shrink(box, tolerance: float):
+    """
+    Shrinks box by tolerance on every side, at most to its center
+    """
+    x1, y1, x2, y2 = box
+    center_x, center_y = (x1 + x2) / 2, (y1 + y2) / 2
+    return [min(x1 + tolerance, center_x), min(y1 + tolerance, center_y),
+            max(x2 - tolerance, center_x), max(y2 - tolerance, center_y)]
+
+
+def random_positions(rnd: np.random.Generator) -> np.ndarray:
+    return np.unique(rnd.integers(0, 1000, int(rnd.integers(0, 7)))).astype(np.float64)
+
+
+def random_box(rnd: np.random.Generator, grid: TableGrid):
+    """
+    A box whose coordinates are often exactly on the rules of grid
+    """
+    positions = np.concatenate([grid.x_positions, grid.y_positions, [-50, 1050]])
+    coordinates = [float(rnd.choice(positions)) if rnd.random() < 0.4 else float(rnd.integers(-50, 1050))
+                   for _ in range(4)]
+    x1, x2 = sorted(coordinates[0::2])
+    y1, y2 = sorted(coordinates[1::2])
+    return [x1, y1, x2, y2]
+
+
+def grid_errors(seed: int, n_grids: int, n_boxes: int) -> list:
+    rnd = np.random.default_rng(seed)
+    errors = []
+    for grid_idx in range(n_grids):
+        grid = TableGrid(random_positions(rnd), random_positions(rnd))
+        if grid.area() != get_table_area_from_td_boxes(grid.td_boxes()):
+            errors.append(f"grid {grid_idx}: area {grid.area()} instead of "
+                          f"{get_table_area_from_td_boxes(grid.td_boxes())}")
+        boxes = [random_box(rnd, grid) for _ in range(n_boxes)]
+        for tolerance in [0, 10]:
+            spans = grid.cell_spans(boxes, tolerance=tolerance)
+            for box, span in zip(boxes, spans):
+                expected = overlapped_cells(grid, shrink(box, tolerance))
+                if spanned_cells(span) != expected:
+                    errors.append(f"grid {grid_idx}, box {box}, tolerance {tolerance}: cells {sorted(spanned_cells(span))}"
+                                  f" instead of {sorted(expected)}")
+        if cells_over_rules(grid, grid.td_boxes()).any():
+            errors.append(f"grid {grid_idx}: cells over rules before the expansion")
+    return errors
+
+
+def count_cells_over_rules(seed: int):
+    """
+    Counts the cells over rules on the appendix pages of a synthetic regulation
+    """
+    configure_engine_class(SyntheticOcrEngine)
+    try:
+        pages, images = appendix_pages(generate_regulation(seed=seed, n_appendix_pages=3))
+        instrumentation = start_instrumentation()
+        for page, image in zip(pages, images):
+            extract_page_table_boxes(page, image)
+        stop_instrumentation()
+    finally:
+        configure_engine_class(None)
+    counters = instrumentation.counters
+    return counters.get("td_box_cells_over_rules", 0), counters.get("td_box_cells", 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Overlap tests of TableGrid compared with rectangles_overlap")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--grids', type=int, default=300)
+    parser.add_argument('--boxes', type=int, default=30, help="number of boxes per grid")
+    args = parser.parse_args()
+    grid_check_errors = grid_errors(args.seed, args.grids, args.boxes)
+    for error in grid_check_errors[:20]:
+        print(error)
+    print(f"{args.grids} grids with {args.boxes} boxes each: {'ok' if not grid_check_errors else 'ERRORS'}")
+    cells_over_rules_count, cells_count = count_cells_over_rules(args.seed)
+    print(f"synthetic appendix: {cells_over_rules_count} of {cells_count} cells reach over a rule after the expansion")
+    sys.exit(0 if not grid_check_errors else 1)
@@ -0,0 +1,148 @@
+"""
+Compares the exact 2-means split of two_means_labels_1d with a brute force search over all splits and with the k-Means
+of scikit-learn, which compute_maximum_linespace used before and keeps as reference. The split must have the minimal
+sum of squared distances (SSE), keep equal values in the same cluster, label the lower cluster 0 and never have a
+larger SSE than k-Means. The data are random line distances, data with ties, data where several splits have the same
+SSE, all-equal data, the line distances of synthetic regulations, and compute_maximum_linespace is called with fewer
+than two line distances.
+Run from pipeline_code with: python -m benchmarks.check_two_means
+"""
+import argparse
+import sys
+import warnings
+import numpy as np
+from pipeline.hocr_tools.hocr_properties import line_distances_per_ocr_carea
+from pipeline.resegmentation.paragraph_splitting_y import two_means_labels_1d, compute_maximum_linespace
+from benchmarks.synthetic_regulation import generate_regulation
+
+# The SSE of different splits is compared with this tolerance for rounding errors
+SSE_TOLERANCE = 1e-6
+
+
+def sse(values: np.ndarray, labels: np.ndarray) -> float:
+    """
+    Sum of squared distances of the values to the mean of their cluster
+    """
+    return sum(float(((values[labels == label] - values[labels == label].mean()) ** 2).sum())
+               for label in np.unique(labels))
+
+
+def brute_force_sse(values: np.ndarray) -> float:
+    """
+    Minimal SSE of all splits of the sorted values into a lower and an upper cluster, the SSE of one cluster if all
+    values are equal
+    """
+    sorted_values = np.sort(values)
+    best_sse = sse(sorted_values, np.zeros(len(sorted_values), dtype=np.int64))
+    for split_idx in range(1, len(sorted_values)):
+        labels = (np.arange(len(sorted_values)) >= split_idx).astype(np.int64)
+        best_sse = min(best_sse, sse(sorted_values, labels))
+    return best_sse
+
+
+def kmeans_labels(values: np.ndarray) -> np.ndarray:
+    from sklearn.cluster import KMeans
+    with warnings.catch_warnings():
+        # All-equal data only have one distinct cluster
+        warnings.simplefilter('ignore')
+        return KMeans(n_clusters=2, n_init='auto', random_state=0).fit_predict(values.reshape(-1, 1))
+
+
+def split_errors(values: np.ndarray, use_kmeans: bool) -> list:
+    """
+    Checks the split of two_means_labels_1d for values
+    :return: descriptions of all errors
+    """
+    labels = two_means_labels_1d(values.reshape(-1, 1))
+    errors = []
+    for value in np.unique(values):
+        if len(np.unique(labels[values == value])) > 1:
+            errors.append(f"value {value} is in both clusters")
+    if len(np.unique(labels)) == 2 and values[labels == 0].max() >= values[labels == 1].min():
+        errors.append("cluster 0 is not the lower cluster")
+    if len(np.unique(values)) < 2 and labels.any():
+        errors.append("equal values are split")
+    split_sse = sse(values, labels)
+    best_sse = brute_force_sse(values)
+    if split_sse > best_sse + SSE_TOLERANCE:
+        errors.append(f"SSE {split_sse} instead of {best_sse}")
+    # k-Means needs at least as many values as clusters
+    if use_kmeans and len(values) >= 2:
+        kmeans_sse = sse(values, kmeans_labels(values))
+        if split_sse > kmeans_sse + SSE_TOLERANCE:
+            errors.append(f"SSE {split_sse} larger than the SSE {kmeans_sse} of k-Means")
+    return errors
+
+
+def test_data(seed: int, n_random: int):
+    """
+    Yields name and values of the test data
+    """
+    rnd = np.random.default_rng(seed)
+    for data_idx in range(n_random):
+        n_values = int(rnd.integers(2, 60))
+        # Line distances of a page: many small distances within paragraphs, fewer large ones between them
+        within = rnd.normal(8, 2, n_values)
+        between = rnd.normal(30, 6, int(rnd.integers(0, n_values // 2 + 1)))
+        yield f"random {data_idx}", np.concatenate([within, between])
+        # Integer pixel distances, which have many ties
+        yield f"ties {data_idx}", np.round(rnd.normal(10, 4, n_values)).clip(0)
+    # Several splits with the same SSE
+    yield "symmetric", np.array([0., 0., 1., 1., 2., 2.])
+    yield "two equal splits", np.array([0., 1., 2., 3., 4., 5., 6.]) * 2
+    yield "two values", np.array([3., 7.])
+    yield "all equal", np.full(12, 9.)
+    yield "one value", np.array([9.])
+    for seed_idx in range(3):
+        regulation = generate_regulation(n_paragraphs=8, n_appendix_pages=0, seed=seed + seed_idx,
+                                         render_images=False)
+        yield f"synthetic regulation {seed + seed_idx}", \
+            line_distances_per_ocr_carea(regulation.hocr_tree).reshape(-1).astype(np.float64)
+
+
+class LineDistances:
+    """
+    Stands in for DocumentStats in compute_maximum_linespace
+    """
+    def __init__(self, line_distances: np.ndarray):
+        self.line_distances = line_distances.reshape(-1, 1)
+
+
+def check_two_means(seed: int = 0, n_random: int = 200) -> bool:
+    """
+    :return: True if there was no error
+    """
+    try:
+        import sklearn  # noqa: F401
+        use_kmeans = True
+    except ImportError:
+        print("scikit-learn is not installed, the splits are only compared with the brute force search")
+        use_kmeans = False
+    n_checked = 0
+    all_ok = True
+    for name, values in test_data(seed, n_random):
+        errors = split_errors(values, use_kmeans)
+        if errors:
+            print(f"{name}: {'; '.join(errors)}")
+            all_ok = False
+        n_checked += 1
+    for line_distances, expected in [(np.zeros(0), -1), (np.array([12.]), -1), (np.full(5, 12.), 12.)]:
+        for clustering_method in ['exact', 'kmeans'] if use_kmeans else ['exact']:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                max_line_dist = compute_maximum_linespace(None, clustering_method=clustering_method,
+                                                          document_stats=LineDistances(line_distances))
+            if max_line_dist != expected:
+                print(f"compute_maximum_linespace with {len(line_distances)} line distances and {clustering_method}: "
+                      f"{max_line_dist} instead of {expected}")
+                all_ok = False
+    print(f"{n_checked} data sets checked, {'ok' if all_ok else 'ERRORS'}")
+    return all_ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exact 2-means split compared with brute force and k-Means")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--random', type=int, default=200, help="number of random data sets")
+    args = parser.parse_args()
+    sys.exit(0 if check_two_means(args.seed, args.random) else 1)
@@ -0,0 +1,224 @@
+import argparse
+import json
+import logging
+import platform
+import statistics
+import time
+from collections import OrderedDict
+from pipeline.constants import NAMESPACES
+from pipeline.text_encoding import PIPELINE_STAGES, encode_hocr_tree_in_tei, create_page_pool
+from pipeline.tei_encoding.ocr_cache import configure_ocr_cache
+from pipeline.tei_encoding.ocr_engine import configure_engine_class
+from pipeline.tei_encoding.table_processing.table_extraction import extract_page_table_boxes
+from pipeline.tei_encoding.table_processing.table_encoding import encode_table
+from benchmarks.synthetic_regulation import SyntheticOcrEngine, generate_regulation
+
+"""
+Benchmark suite of the encoding pipeline on synthetic regulations (see benchmarks/synthetic_regulation.py), so that
+changes to the resegmentation, the layout extraction, the table extraction and the TEI encoding can be measured on the
+same documents without real scans and without Tesseract: the OCR is answered by SyntheticOcrEngine.
+Every benchmark measures one function on fresh copies of its input, which are prepared by the earlier pipeline stages
+outside the measured time. The results can be saved as JSON and compared with a saved baseline, e.g., before and after
+a change:
+python -m benchmarks.run_benchmarks --save baseline.json
+python -m benchmarks.run_benchmarks --compare baseline.json
+Run from pipeline_code.
+"""
+
+
+# Name -> function that takes the regulation, prepares a fresh input and returns the function to measure
+BENCHMARKS = OrderedDict()
+# The stages log every step, which is not part of what is measured
+SILENT_LOGGER = logging.getLogger('benchmarks.run_benchmarks')
+SILENT_LOGGER.addHandler(logging.NullHandler())
+SILENT_LOGGER.propagate = False
+
+
+def benchmark(name: str):
+    """
+    Registers a setup function as benchmark name
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+# Pool for the page-local work of the measured functions (see pipeline/page_pool.py), None to run it sequentially
+PAGE_POOL = None
+# relayout_mode, table_ocr_mode and table_line_detection of encode_hocr_tree_in_tei
+RELAYOUT_MODE = 'selective'
+TABLE_OCR_MODE = 'cell'
+TABLE_LINE_DETECTION = 'hocr'
+
+
+def prepare_state(regulation, stage_count: int) -> dict:
+    """
+    Runs the first stage_count pipeline stages on a copy of the regulation
+    :return: state of the pipeline after these stages
+    """
+    regulation = regulation.copy()
+    state = {"hocr_tree": regulation.hocr_tree, "images": regulation.images}
+    options = {"max_area_dist": 50, "ocr_prefetch_workers": 0, "page_pool": None, "relayout_mode": RELAYOUT_MODE,
+               "table_ocr_mode": TABLE_OCR_MODE, "table_line_detection": TABLE_LINE_DETECTION}
+    for _, run_stage, _ in PIPELINE_STAGES[:stage_count]:
+        run_stage(state, SILENT_LOGGER, options)
+    return state
+
+
+def register_stage_benchmark(stage_idx: int):
+    stage_name, run_stage, _ = PIPELINE_STAGES[stage_idx]
+
+    @benchmark(f"stages/{stage_name}")
+    def setup(regulation):
+        state = prepare_state(regulation, stage_idx)
+        options = {"max_area_dist": 50, "ocr_prefetch_workers": 0, "page_pool": PAGE_POOL,
+                   "relayout_mode": RELAYOUT_MODE, "table_ocr_mode": TABLE_OCR_MODE,
+                   "table_line_detection": TABLE_LINE_DETECTION}
+        return lambda: run_stage(state, SILENT_LOGGER, options)
+
+
+for _stage_idx in range(len(PIPELINE_STAGES)):
+    register_stage_benchmark(_stage_idx)
+
+
+def appendix_pages(regulation):
+    """
+    Returns the pages and images of the appendix like encode_appendix_tree gets them
+    """
+    state = prepare_state(regulation, [stage_name for stage_name, _, _ in PIPELINE_STAGES].index("encode_tei_header"))
+    pages = state["appendix_tree"].xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES)
+    return pages, state["images"][state["appendix_page_start_idx"]:]
+
+
+@benchmark("tables/extract_page_table_boxes")
+def extract_page_table_boxes_setup(regulation):
+    pages, images = appendix_pages(regulation)
+    return lambda: [extract_page_table_boxes(page, image, line_detection=TABLE_LINE_DETECTION)
+                    for page, image in zip(pages, images)]
+
+
+@benchmark("tables/encode_table")
+def encode_table_setup(regulation):
+    pages, images = appendix_pages(regulation)
+    return lambda: [encode_table(page, image, table_ocr_mode=TABLE_OCR_MODE, line_detection=TABLE_LINE_DETECTION)
+                    for page, image in zip(pages, images)]
+
+
+@benchmark("pipeline/encode_hocr_tree_in_tei")
+def encode_hocr_tree_in_tei_setup(regulation):
+    regulation = regulation.copy()
+    return lambda: encode_hocr_tree_in_tei(regulation.hocr_tree, regulation.images, logger=SILENT_LOGGER,
+                                           page_workers=PAGE_POOL.max_workers if PAGE_POOL is not None else 0,
+                                           relayout_mode=RELAYOUT_MODE, table_ocr_mode=TABLE_OCR_MODE,
+                                           table_line_detection=TABLE_LINE_DETECTION)
+
+
+def run_benchmark(setup, regulation, rounds: int, warmup_rounds: int = 1) -> dict:
+    """
+    Measures a benchmark in rounds after warmup_rounds that are not measured
+    :return: statistics of the durations in seconds
+    """
+    durations = []
+    for round_idx in range(warmup_rounds + rounds):
+        function = setup(regulation)
+        # Every round starts with an empty OCR cache like a new worker process
+        configure_ocr_cache()
+        start_time = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start_time
+        if round_idx >= warmup_rounds:
+            durations.append(duration)
+    return {"rounds": rounds,
+            "min": min(durations),
+            "median": statistics.median(durations),
+            "mean": statistics.mean(durations),
+            "stddev": statistics.stdev(durations) if len(durations) > 1 else 0.0}
+
+
+def run_benchmarks(name_filter: str = None, rounds: int = 5, regulation_options: dict = None,
+                   page_workers: int = 0) -> dict:
+    """
+    Runs all benchmarks whose name contains name_filter on a generated regulation
+    :param name_filter: part of the benchmark names to run, all if None
+    :param rounds: number of measured rounds per benchmark
+    :param regulation_options: keyword arguments of generate_regulation
+    :param page_workers: number of threads for the page-local work
+    :return: benchmark name -> statistics
+    """
+    global PAGE_POOL
+    regulation_options = regulation_options if regulation_options is not None else {}
+    configure_engine_class(SyntheticOcrEngine)
+    PAGE_POOL = create_page_pool(page_workers) if page_workers > 1 else None
+    try:
+        regulation = generate_regulation(**regulation_options)
+        results = OrderedDict()
+        for name, setup in BENCHMARKS.items():
+            if name_filter is None or name_filter in name:
+                results[name] = run_benchmark(setup, regulation, rounds)
+                print_result(name, results[name])
+    finally:
+        if PAGE_POOL is not None:
+            PAGE_POOL.shutdown()
+            PAGE_POOL = None
+        configure_engine_class(None)
+    return results
+
+
+def print_result(name: str, result: dict, baseline: dict = None):
+    line = f"{name:<45} {result['min'] * 1000:>12.1f} {result['median'] * 1000:>12.1f} " \
+           f"{result['mean'] * 1000:>12.1f} {result['stddev'] * 1000:>12.1f}"
+    if baseline is not None and name in baseline:
+        line += f" {result['median'] / baseline[name]['median']:>9.2f}x"
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks on synthetic regulations")
+    parser.add_argument('--filter', default=None, help="only run benchmarks whose name contains this text")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--paragraphs', type=int, default=12, help="number of § of the body")
+    parser.add_argument('--appendix-pages', type=int, default=2)
+    parser.add_argument('--columns', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--page-workers', type=int, default=0, help="threads for the page-local work")
+    parser.add_argument('--ocr-latency', type=float, default=0.0,
+                        help="seconds each OCR call of the stub waits outside the GIL, like a Tesseract call")
+    parser.add_argument('--relayout-mode', default='selective', choices=['selective', 'full'],
+                        help="how the body is analyzed again after empty careas were removed")
+    parser.add_argument('--table-ocr-mode', default='cell', choices=['cell', 'region'],
+                        help="how the table cells of the appendix are recognized")
+    parser.add_argument('--table-line-detection', default='hocr', choices=['hocr', 'image'],
+                        help="where the table lines of the appendix are found")
+    parser.add_argument('--save', default=None, help="path of a JSON file for the results")
+    parser.add_argument('--compare', default=None, help="path of a JSON file with baseline results")
+    parser.add_argument('--list', action='store_true', help="only list the benchmarks")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+    else:
+        baseline_results = None
+        if args.compare is not None:
+            with open(args.compare, encoding='utf-8') as baseline_file:
+                baseline_results = json.load(baseline_file)["results"]
+        SyntheticOcrEngine.latency = args.ocr_latency
+        RELAYOUT_MODE = args.relayout_mode
+        TABLE_OCR_MODE = args.table_ocr_mode
+        TABLE_LINE_DETECTION = args.table_line_detection
+        options = {"n_paragraphs": args.paragraphs, "n_appendix_pages": args.appendix_pages, "columns": args.columns,
+                   "seed": args.seed}
+        print(f"{'benchmark':<45} {'min [ms]':>12} {'median [ms]':>12} {'mean [ms]':>12} {'stddev [ms]':>12}")
+        benchmark_results = run_benchmarks(name_filter=args.filter, rounds=args.rounds, regulation_options=options,
+                                           page_workers=args.page_workers)
+        if baseline_results is not None:
+            print("\nCompared with the median of the baseline:")
+            for benchmark_name, benchmark_result in benchmark_results.items():
+                print_result(benchmark_name, benchmark_result, baseline=baseline_results)
+        if args.save is not None:
+            with open(args.save, 'w', encoding='utf-8') as results_file:
+                json.dump({"options": options, "page_workers": args.page_workers, "ocr_latency": args.ocr_latency,
+                           "relayout_mode": args.relayout_mode, "table_ocr_mode": args.table_ocr_mode,
+                           "table_line_detection": args.table_line_detection,
+                           "python": platform.python_version(), "results": benchmark_results},
+                          results_file, indent=2)
@@ -0,0 +1,563 @@
+import itertools
+import os
+import random
+import time
+from copy import deepcopy
+from typing import List, Tuple
+import numpy as np
+from lxml import etree
+from PIL import Image, ImageDraw
+from pipeline.constants import NAMESPACES
+from pipeline.hocr_tools.hocr_selectors import CAREAS, SEPARATORS, WORDS
+from pipeline.tei_encoding.ocr_engine import OcrEngine, HOCR_DOCUMENT_TEMPLATE
+
+"""
+Generator for synthetic regulations that look like the scanned training regulations of the corpus: hOCR with pages,
+page headers, separators, careas, lines and words, a title, § / Abschnitt / Teil headings, numbered segments,
+enumerations, footnotes, the signature of the author, and appendix pages with tables. The matching page images are
+rendered with a block per character, so that the images have realistic ink and layout, but no real glyphs.
+Instead, every rendered line carries a small marker in its top pixel row that encodes an id of its text. The
+SyntheticOcrEngine reads these markers from the images it gets, so the re-OCR in the pipeline returns the text of the
+lines in a crop, and the page segmentation of a whole page returns the hOCR of that page. This way, the whole pipeline
+can run offline and repeatably without Tesseract.
+Usage: configure_engine_class(SyntheticOcrEngine), then encode generate_regulation().hocr_tree and .images
+"""
+
+
+XHTML = NAMESPACES['x']
+PAGE_SIZE = (2480, 3508)  # A4 at 300 dpi
+PAGE_MARGINS = (250, 260, 2230, 3300)  # x1, y1, x2, y2 of the text area below the page header
+COLUMN_GAP = 100
+CHAR_WIDTH = 22
+SPACE_WIDTH = 22
+LINE_HEIGHT = 38
+LINE_PITCH = 50
+CAREA_GAP = 40
+
+# Marker: START_BITS, then ID_BITS bits of the id and a parity bit, drawn in one pixel row with MARKER_CELL pixels per
+# cell. The id and parity bits are Manchester encoded (1 -> 10, 0 -> 01), so three dark cells in a row only occur in
+# the start pattern and a marker that is cut by a crop is not misread
+MARKER_CELL = 2
+START_BITS = (1, 1, 1, 0, 1)
+ID_BITS = 20
+MARKER_CELLS = len(START_BITS) + 2 * (ID_BITS + 1)
+MARKER_WIDTH = MARKER_CELL * MARKER_CELLS
+
+# Every marker id refers to the text of a line or to the hOCR of a page. Ids are unique within a process
+_MARKER_IDS = itertools.count(1)
+_LINE_TEXTS = {}
+_PAGE_HOCR = {}
+
+OCCUPATIONS = ["Koch", "Fachkraft im Gastgewerbe", "Industriemechaniker", "Bürokaufmann", "Elektroniker",
+               "Tischler", "Gärtner", "Verkäufer"]
+MINISTRIES = ["für Wirtschaft", "für Bildung und Wissenschaft", "für Ernährung, Landwirtschaft und Forsten",
+              "für Arbeit und Sozialordnung"]
+PARAGRAPH_TITLES = ["Staatliche Anerkennung des Ausbildungsberufes", "Ausbildungsdauer", "Ausbildungsberufsbild",
+                    "Ausbildungsrahmenplan", "Ausbildungsplan", "Berichtsheft", "Zwischenprüfung",
+                    "Abschlußprüfung", "Übergangsregelung", "Berlin-Klausel", "Inkrafttreten"]
+ABSCHNITT_TITLES = ["Gegenstand, Dauer und Gliederung der Berufsausbildung", "Prüfungen", "Schlußvorschriften"]
+WORDS_POOL = ["die", "der", "das", "Ausbildung", "dauert", "drei", "Jahre", "Prüfung", "ist", "im", "Betrieb", "und",
+              "in", "Berufsschule", "durchzuführen", "Kenntnisse", "Fertigkeiten", "sollen", "vermittelt", "werden",
+              "nach", "dem", "Ausbildungsrahmenplan", "Prüfling", "hat", "nachzuweisen", "daß", "er", "erforderlichen",
+              "beherrscht", "Zwischenprüfung", "Berufsbildungsgesetzes", "Anlage", "sachlich", "zeitlich",
+              "gegliedert", "Stunden", "schriftlich", "praktisch", "Aufgaben", "insbesondere", "Gebieten"]
+TABLE_HEADINGS = ["Lfd. Nr.", "Teil des Ausbildungsberufsbildes", "Zu vermittelnde Fertigkeiten und Kenntnisse",
+                  "Zeitliche Richtwerte in Wochen"]
+MONTHS = ["Januar", "Februar", "März", "April", "Mai", "Juni", "Juli", "August", "September", "Oktober", "November",
+          "Dezember"]
+
+
+class SyntheticRegulation:
+    """
+    A generated regulation: the hOCR tree of all pages, the page images (None if they were not rendered) and the
+    number of body and appendix pages
+    """
+    def __init__(self, hocr_tree: etree.ElementTree, images, n_body_pages: int, n_appendix_pages: int):
+        self.hocr_tree = hocr_tree
+        self.images = images
+        self.n_body_pages = n_body_pages
+        self.n_appendix_pages = n_appendix_pages
+
+    def copy(self) -> 'SyntheticRegulation':
+        """
+        Copies the hOCR tree and the images, e.g., because the pipeline changes both in place
+        """
+        images = [image.copy() for image in self.images] if self.images is not None else None
+        return SyntheticRegulation(deepcopy(self.hocr_tree), images, self.n_body_pages, self.n_appendix_pages)
+
+
+class Block:
+    """
+    Lines of text that become one carea
+    """
+    def __init__(self, lines: List[str], align: str = 'left', line_class: str = 'ocr_line', full_width: bool = False):
+        self.lines = lines
+        self.align = align
+        self.line_class = line_class
+        self.full_width = full_width
+
+
+def text_width(text: str) -> int:
+    return max(len(text) * CHAR_WIDTH, MARKER_WIDTH)
+
+
+def wrap_text(text: str, width: int) -> List[str]:
+    """
+    Breaks text into lines that are at most width pixels wide
+    """
+    lines = []
+    current_line = ""
+    for word in text.split(" "):
+        candidate = f"{current_line} {word}" if current_line else word
+        if current_line and text_width(candidate) > width:
+            lines.append(current_line)
+            current_line = word
+        else:
+            current_line = candidate
+    if current_line:
+        lines.append(current_line)
+    return lines
+
+
+def sentence(rnd: random.Random, min_words: int = 6, max_words: int = 16) -> str:
+    words = [rnd.choice(WORDS_POOL) for _ in range(rnd.randint(min_words, max_words))]
+    return " ".join([words[0][0].upper() + words[0][1:]] + words[1:]) + "."
+
+
+def body_blocks(rnd: random.Random, n_paragraphs: int, column_width: int, enumeration_rate: float = 0.4):
+    """
+    Creates the blocks of the body: title, date, preamble, the sections with their paragraphs and the signature
+    """
+    full_width = PAGE_MARGINS[2] - PAGE_MARGINS[0]
+    occupation = rnd.choice(OCCUPATIONS)
+    day, month, year = rnd.randint(1, 28), rnd.choice(MONTHS), rnd.randint(1970, 2005)
+    blocks = [Block(["Verordnung", "über die Berufsausbildung", f"zum {occupation}"], align='center',
+                    line_class='ocr_header', full_width=True),
+              Block([f"Vom {day}. {month} {year}"], align='center', full_width=True),
+              Block(wrap_text("Auf Grund des § 25 des Berufsbildungsgesetzes vom 14. August 1969 wird im "
+                              "Einvernehmen mit dem Bundesminister für Bildung und Wissenschaft verordnet:", full_width),
+                    full_width=True)]
+    abschnitt_starts = sorted(rnd.sample(range(1, max(n_paragraphs, 2)), min(2, max(n_paragraphs - 1, 0))))
+    abschnitt_idx = 0
+    for paragraph_idx in range(n_paragraphs):
+        if paragraph_idx == 0 or paragraph_idx in abschnitt_starts:
+            if abschnitt_idx == 0 and rnd.random() < 0.5:
+                blocks.append(Block(["Erster Teil"], align='center', line_class='ocr_header'))
+            abschnitt_idx += 1
+            blocks.append(Block([f"Abschnitt {abschnitt_idx}"], align='center', line_class='ocr_header'))
+            blocks.append(Block([ABSCHNITT_TITLES[(abschnitt_idx - 1) % len(ABSCHNITT_TITLES)]], align='center',
+                                line_class='ocr_header'))
+        blocks.append(Block([f"§ {paragraph_idx + 1}"], align='center', line_class='ocr_header'))
+        blocks.append(Block([PARAGRAPH_TITLES[paragraph_idx % len(PARAGRAPH_TITLES)]], align='center',
+                            line_class='ocr_header'))
+        for segment_idx in range(rnd.randint(1, 3)):
+            blocks.append(Block(wrap_text(f"({segment_idx + 1}) {sentence(rnd)}", column_width)))
+            if rnd.random() < enumeration_rate:
+                for item_idx in range(rnd.randint(2, 4)):
+                    blocks.append(Block(wrap_text(f"{item_idx + 1}. {sentence(rnd, 3, 9)}", column_width)))
+                    if rnd.random() < 0.3:
+                        for sub_item_idx in range(rnd.randint(1, 3)):
+                            letter = "abcdefg"[sub_item_idx]
+                            blocks.append(Block(wrap_text(f"{letter}) {sentence(rnd, 3, 8)}", column_width)))
+    city = rnd.choice(["Bonn", "Berlin"])
+    ministry = rnd.choice(MINISTRIES)
+    blocks.append(Block([f"{city}, den {day}. {month} {year}"], full_width=True))
+    blocks.append(Block(wrap_text(f"Der Bundesminister {ministry}", full_width // 2) + ["In Vertretung", "Dr. Schmidt"],
+                        full_width=True))
+    return blocks
+
+
+class DocumentBuilder:
+    """
+    Lays out blocks on pages, creates the hOCR elements and renders the page images
+    """
+    def __init__(self, rnd: random.Random, columns: int, render_images: bool, separators: bool, image_dir: str):
+        self.rnd = rnd
+        self.columns = columns
+        self.render_images = render_images
+        self.separators = separators
+        self.image_dir = image_dir
+        self.html = etree.Element(f'{{{XHTML}}}html', nsmap={None: XHTML})
+        head = etree.SubElement(self.html, f'{{{XHTML}}}head')
+        etree.SubElement(head, f'{{{XHTML}}}title')
+        self.body = etree.SubElement(self.html, f'{{{XHTML}}}body')
+        self.pages = []
+        self.images = []
+        self.page = None
+        self.draw = None
+        self.column_ys = []
+        self.column_top = 0
+        self.column_idx = 0
+
+    # -- Pages ---------------------------------------------------------------------------------------------------------
+    def new_page(self):
+        self.finish_page()
+        page_idx = len(self.pages)
+        self.page = etree.SubElement(self.body, f'{{{XHTML}}}div')
+        self.page.set('class', 'ocr_page')
+        self.page.set('title', f'image "{self.image_dir}/page_{page_idx:04d}.tif"; bbox 0 0 {PAGE_SIZE[0]} '
+                               f'{PAGE_SIZE[1]}; ppageno {page_idx}')
+        self.pages.append(self.page)
+        if self.render_images:
+            image = Image.new('L', PAGE_SIZE, 255)
+            self.images.append(image)
+            self.draw = ImageDraw.Draw(image)
+        # Page header: page number and the name of the gazette at the same height
+        page_number = str(1000 + page_idx)
+        left = page_idx % 2 == 0
+        number_x = PAGE_MARGINS[0] if left else PAGE_MARGINS[2] - text_width(page_number)
+        self.add_carea([page_number], number_x, 130, line_class='ocr_line')
+        gazette = f"Bundesgesetzblatt, Jahrgang {1970 + page_idx % 30}, Teil I"
+        self.add_carea([gazette], (PAGE_SIZE[0] - text_width(gazette)) // 2, 130)
+        if self.separators:
+            self.add_rule('ocr_separator', (PAGE_MARGINS[0], 200, PAGE_MARGINS[2], 204))
+        self.column_top = PAGE_MARGINS[1]
+        self.column_ys = [PAGE_MARGINS[1]] * self.columns
+        self.column_idx = 0
+
+    def finish_page(self):
+        """
+        Adds the line between the text columns and registers the page for the page segmentation of the OCR stub
+        """
+        if self.page is None:
+            return
+        if self.columns > 1 and max(self.column_ys) > self.column_top:
+            self.add_column_separators(self.column_top, max(self.column_ys))
+        if self.render_images:
+            page_id = next(_MARKER_IDS)
+            self.draw_marker(40, 40, page_id)
+            _PAGE_HOCR[page_id] = masked_page_hocr(self.page)
+
+    def column_bounds(self, column_idx: int):
+        column_width = (PAGE_MARGINS[2] - PAGE_MARGINS[0] - (self.columns - 1) * COLUMN_GAP) // self.columns
+        x1 = PAGE_MARGINS[0] + column_idx * (column_width + COLUMN_GAP)
+        return x1, x1 + column_width
+
+    def add_column_separators(self, y1: int, y2: int):
+        for column_idx in range(1, self.columns):
+            x = self.column_bounds(column_idx)[0] - COLUMN_GAP // 2
+            self.add_rule('empty_carea', (x - 3, y1, x + 3, y2))
+
+    # -- Elements ------------------------------------------------------------------------------------------------------
+    def add_rule(self, kind: str, bbox):
+        """
+        Adds a drawn line either as ocr_separator or as carea with an empty word like Tesseract detects table lines
+        """
+        x1, y1, x2, y2 = bbox
+        if kind == 'ocr_separator':
+            separator = etree.SubElement(self.page, f'{{{XHTML}}}div')
+            separator.set('class', 'ocr_separator')
+            separator.set('title', f'bbox {x1} {y1} {x2} {y2}')
+        else:
+            carea = etree.SubElement(self.page, f'{{{XHTML}}}div')
+            carea.set('class', 'ocr_carea')
+            carea.set('title', f'bbox {x1} {y1} {x2} {y2}')
+            par = etree.SubElement(carea, f'{{{XHTML}}}p')
+            par.set('class', 'ocr_par')
+            par.set('title', f'bbox {x1} {y1} {x2} {y2}')
+            line = etree.SubElement(par, f'{{{XHTML}}}span')
+            line.set('class', 'ocr_line')
+            line.set('title', f'bbox {x1} {y1} {x2} {y2}; baseline 0 0; x_size 0')
+            word = etree.SubElement(line, f'{{{XHTML}}}span')
+            word.set('class', 'ocrx_word')
+            word.set('title', f'bbox {x1} {y1} {x2} {y2}; x_wconf 95')
+        if self.render_images:
+            self.draw.rectangle([x1, y1, x2 - 1, y2 - 1], fill=0)
+
+    def add_carea(self, lines: List[str], x1: int, y1: int, align: str = 'left', width: int = None,
+                  line_class: str = 'ocr_line') -> int:
+        """
+        Adds a carea with one ocr_par and the lines at x1, y1
+        :return: y2 of the carea
+        """
+        line_widths = [text_width(line) for line in lines]
+        width = max(line_widths) if width is None else width
+        carea_bbox = [PAGE_SIZE[0], y1, 0, y1 + len(lines) * LINE_PITCH - (LINE_PITCH - LINE_HEIGHT)]
+        carea = etree.SubElement(self.page, f'{{{XHTML}}}div')
+        carea.set('class', 'ocr_carea')
+        par = etree.SubElement(carea, f'{{{XHTML}}}p')
+        par.set('class', 'ocr_par')
+        par.set('lang', 'deu')
+        for line_idx, (line_text, line_width) in enumerate(zip(lines, line_widths)):
+            line_x1 = x1 + (width - line_width) // 2 if align == 'center' else x1
+            line_y1 = y1 + line_idx * LINE_PITCH
+            self.add_line(par, line_text, line_x1, line_y1, line_class)
+            carea_bbox[0] = min(carea_bbox[0], line_x1)
+            carea_bbox[2] = max(carea_bbox[2], line_x1 + line_width)
+        title = f'bbox {carea_bbox[0]} {carea_bbox[1]} {carea_bbox[2]} {carea_bbox[3]}'
+        carea.set('title', title)
+        par.set('title', title)
+        return carea_bbox[3]
+
+    def add_line(self, par: etree.ElementTree, text: str, x1: int, y1: int, line_class: str):
+        line = etree.SubElement(par, f'{{{XHTML}}}span')
+        line.set('class', line_class)
+        line.set('title', f'bbox {x1} {y1} {x1 + text_width(text)} {y1 + LINE_HEIGHT}; baseline 0 -8; '
+                          f'x_size {LINE_HEIGHT}; x_descenders 8; x_ascenders 10')
+        word_x1 = x1
+        for word_text in text.split(" "):
+            word_x2 = word_x1 + len(word_text) * CHAR_WIDTH
+            word = etree.SubElement(line, f'{{{XHTML}}}span')
+            word.set('class', 'ocrx_word')
+            word.set('title', f'bbox {word_x1} {y1} {word_x2} {y1 + LINE_HEIGHT}; x_wconf {self.rnd.randint(70, 96)}')
+            word.text = word_text
+            if self.render_images:
+                self.draw_word(word_text, word_x1, y1)
+            word_x1 = word_x2 + SPACE_WIDTH
+        if self.render_images:
+            line_id = next(_MARKER_IDS)
+            _LINE_TEXTS[line_id] = text
+            self.draw_marker(x1, y1, line_id)
+
+    # -- Rendering -----------------------------------------------------------------------------------------------------
+    def draw_word(self, word: str, x1: int, y1: int):
+        for char_idx, char in enumerate(word):
+            char_x1 = x1 + char_idx * CHAR_WIDTH
+            top = y1 + 4 if char.isupper() or char.isdigit() or char in "bdfhklt§()" else y1 + 12
+            bottom = y1 + LINE_HEIGHT - 2 if char in "gjpqy," else y1 + LINE_HEIGHT - 8
+            self.draw.rectangle([char_x1 + 3, top, char_x1 + CHAR_WIDTH - 4, bottom], fill=0)
+
+    def draw_marker(self, x1: int, y1: int, marker_id: int):
+        bits = [(marker_id >> bit) & 1 for bit in range(ID_BITS)] + [bin(marker_id).count("1") % 2]
+        cells = list(START_BITS) + [cell for bit in bits for cell in ((1, 0) if bit else (0, 1))]
+        for cell_idx, cell in enumerate(cells):
+            if cell:
+                self.draw.line([x1 + cell_idx * MARKER_CELL, y1, x1 + (cell_idx + 1) * MARKER_CELL - 1, y1], fill=0)
+
+    # -- Flow ----------------------------------------------------------------------------------------------------------
+    def place_block(self, block: Block):
+        height = len(block.lines) * LINE_PITCH
+        if block.full_width:
+            y1 = max(self.column_ys)
+            if y1 + height > PAGE_MARGINS[3]:
+                self.new_page()
+                y1 = max(self.column_ys)
+            elif self.columns > 1 and y1 > self.column_top:
+                # The columns above end here
+                self.add_column_separators(self.column_top, y1)
+            x1, x2 = PAGE_MARGINS[0], PAGE_MARGINS[2]
+            y2 = self.add_carea(block.lines, x1, y1, align=block.align, width=x2 - x1, line_class=block.line_class)
+            self.column_ys = [y2 + CAREA_GAP] * self.columns
+            self.column_top = y2 + CAREA_GAP
+            self.column_idx = 0
+            return
+        if self.column_ys[self.column_idx] + height > PAGE_MARGINS[3]:
+            if self.column_idx + 1 < self.columns:
+                self.column_idx += 1
+            else:
+                self.new_page()
+        x1, x2 = self.column_bounds(self.column_idx)
+        y2 = self.add_carea(block.lines, x1, self.column_ys[self.column_idx], align=block.align, width=x2 - x1,
+                            line_class=block.line_class)
+        self.column_ys[self.column_idx] = y2 + CAREA_GAP
+
+    def add_footnote(self, text: str):
+        """
+        Adds a footnote at the bottom of the current page
+        """
+        lines = wrap_text(text, PAGE_MARGINS[2] - PAGE_MARGINS[0])
+        self.add_carea(lines, PAGE_MARGINS[0], PAGE_MARGINS[3] + 40)
+
+    def add_table(self, n_rows: int, n_columns: int, y1: int, rnd: random.Random):
+        """
+        Adds a table with drawn lines as empty careas and the text of each cell as careas inside the cells
+        """
+        x1, x2 = PAGE_MARGINS[0], PAGE_MARGINS[2]
+        column_xs = [x1 + (x2 - x1) * column_idx // n_columns for column_idx in range(n_columns + 1)]
+        row_ys = [y1]
+        rows = []
+        for row_idx in range(n_rows):
+            row_cells = []
+            for column_idx in range(n_columns):
+                cell_width = column_xs[column_idx + 1] - column_xs[column_idx] - 40
+                if row_idx == 0:
+                    text = TABLE_HEADINGS[column_idx % len(TABLE_HEADINGS)]
+                elif column_idx == 0:
+                    text = str(row_idx)
+                elif column_idx == n_columns - 1:
+                    text = str(rnd.randint(2, 26))
+                else:
+                    text = " ".join(f"{'abcdef'[item_idx]}) {sentence(rnd, 2, 6)}" for item_idx in
+                                    range(rnd.randint(1, 3)))
+                row_cells.append(wrap_text(text, cell_width))
+            row_height = max(len(cell_lines) for cell_lines in row_cells) * LINE_PITCH + 40
+            if row_ys[-1] + row_height > PAGE_MARGINS[3]:
+                break
+            rows.append(row_cells)
+            row_ys.append(row_ys[-1] + row_height)
+        for row_cells, row_y1 in zip(rows, row_ys):
+            for column_idx, cell_lines in enumerate(row_cells):
+                self.add_carea(cell_lines, column_xs[column_idx] + 20, row_y1 + 20)
+        for row_y in row_ys:
+            self.add_rule('empty_carea', (x1, row_y - 3, x2, row_y + 3))
+        for column_x in column_xs:
+            self.add_rule('empty_carea', (column_x - 3, row_ys[0], column_x + 3, row_ys[-1]))
+
+
+def masked_page_hocr(page: etree.ElementTree) -> str:
+    """
+    Returns the hOCR document of a page as Tesseract would recognize it after the lines were whitened
+    """
+    page = deepcopy(page)
+    for element in SEPARATORS(page) + [carea for carea in CAREAS(page)
+                                       if all(word.text is None for word in WORDS(carea))]:
+        element.getparent().remove(element)
+    return HOCR_DOCUMENT_TEMPLATE.format(etree.tostring(page, encoding='unicode'))
+
+
+def generate_regulation(n_paragraphs: int = 12, n_appendix_pages: int = 2, columns: int = 1, seed: int = 0,
+                        render_images: bool = True, separators: bool = True, table_columns: int = 4,
+                        table_rows: int = 12, footnote_rate: float = 0.2,
+                        image_dir: str = '/tmp/scantailor/synthetic') -> SyntheticRegulation:
+    """
+    Generates a regulation
+    :param n_paragraphs: number of § in the body, which determines the number of body pages (about 4 per page)
+    :param n_appendix_pages: number of appendix pages with a table each
+    :param columns: number of text columns in the body. With more than one column, the columns are separated by lines
+    :param seed: seed of the random content and layout
+    :param render_images: If False, only the hOCR is generated and images is None
+    :param separators: If True, each page header is underlined with an ocr_separator
+    :param table_columns: number of columns of the appendix tables
+    :param table_rows: maximum number of rows of the appendix tables, including the heading row
+    :param footnote_rate: probability of a footnote at the bottom of a body page
+    :param image_dir: directory of the page images in the titles of the pages
+    :return: the regulation
+    """
+    rnd = random.Random(seed)
+    builder = DocumentBuilder(rnd, columns, render_images, separators, image_dir)
+    builder.new_page()
+    # Text before the title that is removed by remove_pre_text_elements
+    builder.place_block(Block([f"Nr. {rnd.randint(1, 90)} - Tag der Ausgabe: Bonn, den {rnd.randint(1, 28)}. "
+                               f"{rnd.choice(MONTHS)} {rnd.randint(1970, 2005)}"], full_width=True))
+    column_width = builder.column_bounds(0)[1] - builder.column_bounds(0)[0]
+    page_count = len(builder.pages)
+    for block in body_blocks(rnd, n_paragraphs, column_width):
+        builder.place_block(block)
+        if len(builder.pages) > page_count:
+            page_count = len(builder.pages)
+            if rnd.random() < footnote_rate and page_count > 1:
+                builder.page = builder.pages[-2]
+                builder.add_footnote(f"* {sentence(rnd, 4, 10)}")
+                builder.page = builder.pages[-1]
+    n_body_pages = len(builder.pages)
+    for appendix_page_idx in range(n_appendix_pages):
+        builder.new_page()
+        table_y1 = PAGE_MARGINS[1]
+        if appendix_page_idx == 0:
+            table_y1 = builder.add_carea(["Anlage", "Ausbildungsrahmenplan"], PAGE_MARGINS[0], PAGE_MARGINS[1],
+                                         align='center', width=PAGE_MARGINS[2] - PAGE_MARGINS[0],
+                                         line_class='ocr_header') + 2 * CAREA_GAP
+        builder.add_table(table_rows, table_columns, table_y1, rnd)
+    builder.finish_page()
+    return SyntheticRegulation(etree.ElementTree(builder.html), builder.images if render_images else None,
+                               n_body_pages, n_appendix_pages)
+
+
+def write_regulation(regulation: SyntheticRegulation, directory: str):
+    """
+    Writes one hOCR file per page like the Tesseract command line tool and the page images as TIFF
+    :return: paths of the hOCR files and of the images
+    """
+    os.makedirs(directory, exist_ok=True)
+    hocr_paths = []
+    image_paths = []
+    pages = regulation.hocr_tree.getroot().find(f'{{{XHTML}}}body')
+    for page_idx, page in enumerate(pages):
+        hocr_path = os.path.join(directory, f"page_{page_idx:04d}.hocr")
+        with open(hocr_path, 'w', encoding='utf-8') as hocr_file:
+            hocr_file.write(HOCR_DOCUMENT_TEMPLATE.format(etree.tostring(page, encoding='unicode')))
+        hocr_paths.append(hocr_path)
+        if regulation.images is not None:
+            image_path = os.path.join(directory, f"page_{page_idx:04d}.tif")
+            regulation.images[page_idx].save(image_path, compression='tiff_lzw')
+            image_paths.append(image_path)
+    return hocr_paths, image_paths
+
+
+def read_markers(image) -> List[int]:
+    """
+    Finds the markers in an image and returns their ids from top to bottom and left to right
+    """
+    return [marker_id for marker_id, _, _ in read_marker_positions(image)]
+
+
+def read_marker_positions(image) -> List[Tuple[int, int, int]]:
+    """
+    Finds the markers in an image and returns their ids and the x and y of their first pixel from top to bottom and
+    left to right
+    """
+    dark = np.asarray(image.convert('L') if image.mode != 'L' else image) < 128
+    height, width = dark.shape
+    span = width - MARKER_WIDTH + 1
+    if height < 3 or span <= 0:
+        return []
+    # Sample every cell at its second pixel, for all rows that have a row above and below
+    candidates = np.ones((height - 2, span), dtype=bool)
+    for cell_idx, cell in enumerate(START_BITS):
+        cell_pixels = dark[1:-1, cell_idx * MARKER_CELL + 1:cell_idx * MARKER_CELL + 1 + span]
+        candidates &= cell_pixels if cell else ~cell_pixels
+    markers = []
+    marker_ids = set()
+    for row, x in zip(*np.nonzero(candidates)):
+        y = row + 1
+        # A marker is a single pixel row, glyphs are always taller
+        if dark[y - 1, x:x + MARKER_WIDTH].any() or dark[y + 1, x:x + MARKER_WIDTH].any():
+            continue
+        cells = dark[y, x + 1:x + MARKER_WIDTH:MARKER_CELL][len(START_BITS):]
+        if np.any(cells[0::2] == cells[1::2]):
+            continue
+        bits = cells[0::2].astype(int).tolist()
+        marker_id = sum(bit << bit_idx for bit_idx, bit in enumerate(bits[:ID_BITS]))
+        if bits[ID_BITS] != bin(marker_id).count("1") % 2 or marker_id in marker_ids:
+            continue
+        marker_ids.add(marker_id)
+        markers.append((marker_id, int(x), int(y)))
+    return markers
+
+
+class SyntheticOcrEngine(OcrEngine):
+    """
+    OCR stub for rendered synthetic regulations. It "recognizes" the lines whose markers are in the image.
+    latency is the time in seconds that each call waits without holding the GIL, like the Tesseract subprocess of
+    pytesseract, to measure how the pipeline overlaps OCR calls
+    """
+    latency = 0.0
+
+    def image_to_string(self, image: Image) -> str:
+        time.sleep(self.latency)
+        return "\n".join(_LINE_TEXTS[marker_id] for marker_id in read_markers(image) if marker_id in _LINE_TEXTS)
+
+    def image_to_hocr(self, image: Image) -> str:
+        time.sleep(self.latency)
+        marker_ids = read_markers(image)
+        for marker_id in marker_ids:
+            if marker_id in _PAGE_HOCR:
+                return _PAGE_HOCR[marker_id]
+        # A crop, e.g., a table cell: one carea with the lines of the crop at the positions of their markers
+        width, height = image.size
+        page = etree.Element(f'{{{XHTML}}}div', nsmap={None: XHTML})
+        page.set('class', 'ocr_page')
+        page.set('title', f'image ""; bbox 0 0 {width} {height}; ppageno 0')
+        lines = [(_LINE_TEXTS[marker_id], x, y) for marker_id, x, y in read_marker_positions(image)
+                 if marker_id in _LINE_TEXTS]
+        if lines:
+            carea = etree.SubElement(page, f'{{{XHTML}}}div')
+            carea.set('class', 'ocr_carea')
+            carea.set('title', f'bbox 0 0 {width} {height}')
+            par = etree.SubElement(carea, f'{{{XHTML}}}p')
+            par.set('class', 'ocr_par')
+            par.set('title', f'bbox 0 0 {width} {height}')
+            for line_text, x1, y1 in lines:
+                y2 = min(y1 + LINE_HEIGHT, height)
+                line = etree.SubElement(par, f'{{{XHTML}}}span')
+                line.set('class', 'ocr_line')
+                line.set('title', f'bbox {x1} {y1} {min(x1 + text_width(line_text), width)} {y2}')
+                word_x1 = x1
+                for word_text in line_text.split(" "):
+                    word_x2 = word_x1 + len(word_text) * CHAR_WIDTH
+                    word = etree.SubElement(line, f'{{{XHTML}}}span')
+                    word.set('class', 'ocrx_word')
+                    word.set('title', f'bbox {min(word_x1, width)} {y1} {min(word_x2, width)} {y2}')
+                    word.text = word_text
+                    word_x1 = word_x2 + SPACE_WIDTH
+        return HOCR_DOCUMENT_TEMPLATE.format(etree.tostring(page, encoding='unicode'))
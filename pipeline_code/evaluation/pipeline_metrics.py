@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+from typing import List
+
+"""
+Summarizes the per-document metrics that encode_hocr_tree_in_tei writes with metrics_path (see
+pipeline/instrumentation.py) for a corpus run: the totals per stage and the documents that took the most OCR calls,
+OCR pixels or time.
+Run from pipeline_code with: python -m evaluation.pipeline_metrics data_directory/logs/vet data_directory/logs/cvet
+"""
+
+
+METRICS_FILE_SUFFIX = '.metrics.json'
+STAGE_METRICS = ["calls", "wall_time", "cpu_time", "ocr_calls", "ocr_pixels"]
+
+
+def load_metrics(directories: List[str]) -> List[dict]:
+    """
+    Reads all metrics files in the directories and their subdirectories
+    """
+    metrics = []
+    for directory in directories:
+        for root, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                if filename.endswith(METRICS_FILE_SUFFIX):
+                    with open(os.path.join(root, filename), encoding='utf-8') as metrics_file:
+                        metrics.append(json.load(metrics_file))
+    return metrics
+
+
+def summarize_stages(metrics: List[dict]) -> dict:
+    """
+    Sums up the metrics of each stage over all documents
+    :param metrics: metrics of the documents
+    :return: stage path -> summed metrics and the number of documents in which the stage ran
+    """
+    summary = {}
+    for document_metrics in metrics:
+        for path, stage_metrics in document_metrics["stages"].items():
+            if path not in summary:
+                summary[path] = {name: 0 for name in STAGE_METRICS}
+                summary[path]["documents"] = 0
+            for name in STAGE_METRICS:
+                summary[path][name] += stage_metrics.get(name, 0)
+            summary[path]["documents"] += 1
+    return summary
+
+
+def top_documents(metrics: List[dict], key: str = "ocr_calls", n: int = 10) -> List[dict]:
+    """
+    Returns the n documents with the highest value of key, which is a counter or "wall_time"
+    """
+    def document_value(document_metrics):
+        if key == "wall_time":
+            return document_metrics["wall_time"]
+        return document_metrics["counters"].get(key, 0)
+    return sorted(metrics, key=document_value, reverse=True)[:n]
+
+
+def print_summary(metrics: List[dict], n: int = 10):
+    summary = summarize_stages(metrics)
+    total_ocr_calls = sum(document_metrics["counters"].get("ocr_calls", 0) for document_metrics in metrics)
+    print(f"{len(metrics)} documents, {total_ocr_calls} OCR calls")
+    print(f"{'stage':<80} {'wall [s]':>10} {'cpu [s]':>10} {'OCR calls':>10} {'share':>6} {'MPixels':>9}")
+    for path, stage_summary in summary.items():
+        share = stage_summary["ocr_calls"] / total_ocr_calls if total_ocr_calls > 0 else 0.0
+        print(f"{path:<80} {stage_summary['wall_time']:>10.1f} {stage_summary['cpu_time']:>10.1f} "
+              f"{stage_summary['ocr_calls']:>10} {share:>6.1%} {stage_summary['ocr_pixels'] / 1e6:>9.1f}")
+    for key in ["ocr_calls", "ocr_pixels", "wall_time"]:
+        print(f"\nDocuments with the most {key}:")
+        for document_metrics in top_documents(metrics, key=key, n=n):
+            if key == "wall_time":
+                print(f"  {document_metrics['document']}: {document_metrics['wall_time']:.1f} s")
+            else:
+                print(f"  {document_metrics['document']}: {document_metrics['counters'].get(key, 0)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summary of the pipeline metrics of a corpus run")
+    parser.add_argument('directories', nargs='+', help="directories with *.metrics.json files, e.g., the log directories")
+    parser.add_argument('--top', type=int, default=10, help="number of documents listed per metric")
+    args = parser.parse_args()
+    print_summary(load_metrics(args.directories), n=args.top)
@@ -1,74 +1,129 @@
-from lxml import etree
-from PIL import Image
 import os
-from pipeline.hocr_tools.hocr_helpers import combine_hocr_pages
+from pipeline.hocr_tools.hocr_loader import load_hocr_document
 from pipeline.text_encoding import encode_hocr_tree_in_tei
+from pipeline.tei_encoding.page_images import PageImageProvider
 import time
-from concurrent.futures import ProcessPoolExecutor
+from pipeline.encoding_scheduler import schedule_encodings, estimate_encoding_cost_from_pages
 from pipeline.pipeline_logger import file_logger
+from pipeline.tei_encoding.ocr_cache import configure_ocr_cache, get_ocr_cache
 
 
-vet_files = [name.split(".")[0] for name in os.listdir('data_directory/OffenegesetzeDE/scantailor_output/')]
 vet_tesseract_directory = 'data_directory/OffenegesetzeDE/tesseract_output/'
 vet_scantailor_directory = 'data_directory/OffenegesetzeDE/scantailor_output/'
 vet_tei_output_directory = 'data_directory/tei_output/vet/'
 vet_logs_directory = 'data_directory/logs/vet/'
 
 
-# Here, the regulations are in directories for each year and need to be joined by an additional layer
-cvet_base_dir = 'data_directory/fortbildungsordnungen/scantailor_output/'
-cvet_files = []
-cvet_years = [year_dir for year_dir in os.listdir(cvet_base_dir)]
-for year in cvet_years:
-    year_dir = os.path.join(cvet_base_dir, year)
-    for img_file in os.listdir(year_dir):
-        cvet_files.append(os.path.join(year, img_file.split(".")[0]))
-
 cvet_tesseract_directory = 'data_directory/fortbildungsordnungen/tesseract_output/'
 cvet_scantailor_directory = 'data_directory/fortbildungsordnungen/scantailor_output/'
 cvet_tei_output_directory = 'data_directory/tei_output/cvet/'
 cvet_logs_directory = 'data_directory/logs/cvet/'
 
+# Re-OCR results are kept on disk so that reruns do not recognize the same crops again
+ocr_cache_path = 'data_directory/ocr_cache.sqlite'
+
+
+# The directories are only listed in the main process. Worker processes that are started with spawn (e.g., with
+# max_tasks_per_child) import this module again and do not need the listings
+def list_vet_files():
+    return [name.split(".")[0] for name in os.listdir(vet_scantailor_directory)]
+
+
+def list_cvet_files():
+    # Here, the regulations are in directories for each year and need to be joined by an additional layer
+    cvet_files = []
+    for year in os.listdir(cvet_scantailor_directory):
+        year_dir = os.path.join(cvet_scantailor_directory, year)
+        for img_file in os.listdir(year_dir):
+            cvet_files.append(os.path.join(year, img_file.split(".")[0]))
+    return cvet_files
+
 
 def manage_encodings(max_workers, input_files,
                      tesseract_directory,
                      scantailor_directory,
                      tei_output_directory,
-                     logs_directory):
-    hocr_dirs = [os.path.join(tesseract_directory, regulation_subdirectory) for regulation_subdirectory in input_files]
-    img_dirs = [os.path.join(scantailor_directory, regulation_subdirectory) for regulation_subdirectory in input_files]
-    out_files = [os.path.join(tei_output_directory, os.path.basename(regulation_subdirectory) + ".xml") for regulation_subdirectory in input_files]
-    log_files = [os.path.join(logs_directory, os.path.basename(regulation_subdirectory) + ".log") for regulation_subdirectory in input_files]
-    encoding_parameters = list(zip(hocr_dirs, img_dirs, out_files, log_files))
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(initialize_encoding, encoding_parameters)
+                     logs_directory,
+                     page_workers: int = 0,
+                     max_tasks_per_child: int = None,
+                     logger=None):
+    """
+    Encodes the regulations with max_workers processes, the largest regulations first (see
+    pipeline/encoding_scheduler.py). With page_workers > 1, each process additionally handles the pages of its
+    regulation in so many threads, which keeps the cores busy for long regulations at the end of a batch. If
+    max_tasks_per_child is given, each process is replaced after so many tasks. This requires Python 3.11 and starts the
+    processes with spawn. The run report is written to the logs directory. A regulation whose hOCR directory cannot be
+    listed is reported as failed, the other regulations are still encoded
+    """
+    if logger is None:
+        logger = file_logger()
+    tasks = []
+    for regulation_subdirectory in input_files:
+        hocr_dir = os.path.join(tesseract_directory, regulation_subdirectory)
+        img_dir = os.path.join(scantailor_directory, regulation_subdirectory)
+        out_file = os.path.join(tei_output_directory, os.path.basename(regulation_subdirectory) + ".xml")
+        log_file = os.path.join(logs_directory, os.path.basename(regulation_subdirectory) + ".log")
+        if os.path.exists(out_file):
+            logger.info(f"File '{out_file}' already exists")
+            continue
+        task = {"name": regulation_subdirectory,
+                "parameters": (hocr_dir, img_dir, out_file, log_file, page_workers)}
+        try:
+            task["hocr_paths"] = list_hocr_paths(hocr_dir)
+        except OSError as e:
+            task["error"] = repr(e)
+            task["estimate"] = estimate_encoding_cost_from_pages(count_page_images(img_dir))
+        tasks.append(task)
+    schedule_encodings(initialize_encoding, tasks, max_workers=max_workers, max_tasks_per_child=max_tasks_per_child,
+                       report_path=os.path.join(logs_directory, 'run_report.json'), logger=logger)
+
+
+def list_hocr_paths(hocr_directory):
+    return [os.path.join(hocr_directory, hocr_filename) for hocr_filename in os.listdir(hocr_directory)
+            if hocr_filename.endswith(".hocr")]
+
+
+def count_page_images(img_directory):
+    try:
+        return len([img_filename for img_filename in os.listdir(img_directory) if img_filename.endswith(".tif")])
+    except OSError:
+        return 0
 
 
 def initialize_encoding(encoding_parameters):
-    hocr_directory, img_directory, out_file, log_file = encoding_parameters
+    hocr_directory, img_directory, out_file, log_file, page_workers = encoding_parameters
     if os.path.exists(out_file):
         print(f"File '{out_file}' already exists")
-        return
-    hocr_trees = [etree.parse(os.path.join(hocr_directory, hocr_filename)) for hocr_filename in os.listdir(hocr_directory)
-                  if hocr_filename.endswith(".hocr")]
-    imgs = [Image.open(os.path.join(img_directory, img_filename)) for img_filename in os.listdir(img_directory)
-            if img_filename.endswith(".tif")]
+        return {"status": "skipped"}
+    hocr_paths = list_hocr_paths(hocr_directory)
+    imgs = PageImageProvider([os.path.join(img_directory, img_filename) for img_filename in os.listdir(img_directory)
+                              if img_filename.endswith(".tif")])
     logger = file_logger(log_file)
-    tree = combine_hocr_pages(hocr_trees)
+    tree = load_hocr_document(hocr_paths)
+    if get_ocr_cache().cache_path != ocr_cache_path:
+        configure_ocr_cache(cache_path=ocr_cache_path)
+    get_ocr_cache().reset_stats()
     start_time = time.time()
-    tei_tree = encode_hocr_tree_in_tei(hocr_tree=tree, images=imgs, logger=logger)
-    logger.info("--- Finished process after %s seconds ---" % (time.time() - start_time))
+    # The time and OCR calls per stage are stored next to the log, see evaluation/pipeline_metrics.py
+    metrics_path = os.path.splitext(log_file)[0] + ".metrics.json"
+    with imgs:
+        tei_tree = encode_hocr_tree_in_tei(hocr_tree=tree, images=imgs, logger=logger, metrics_path=metrics_path,
+                                           page_workers=page_workers)
+    encoding_time = time.time() - start_time
+    logger.info("--- Finished process after %s seconds ---" % encoding_time)
+    logger.info("OCR cache statistics: %s", get_ocr_cache().stats())
     tei_tree.write(out_file, pretty_print=True, encoding='utf-8')
     print(f"Wrote to {out_file}")
+    return {"encoding_time": encoding_time, "worker_pid": os.getpid()}
 
 
 if __name__ == '__main__':
-    manage_encodings(max_workers=8, input_files=vet_files,
+    manage_encodings(max_workers=8, input_files=list_vet_files(),
                      tesseract_directory=vet_tesseract_directory,
                      scantailor_directory=vet_scantailor_directory,
                      tei_output_directory=vet_tei_output_directory,
                      logs_directory=vet_logs_directory)
-    manage_encodings(max_workers=8, input_files=cvet_files,
+    manage_encodings(max_workers=8, input_files=list_cvet_files(),
                      tesseract_directory=cvet_tesseract_directory,
                      scantailor_directory=cvet_scantailor_directory,
                      tei_output_directory=cvet_tei_output_directory,
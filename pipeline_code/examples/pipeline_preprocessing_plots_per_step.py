@@ -3,7 +3,7 @@ import os
 from PIL import Image
 from pipeline.resegmentation.paragraph_splitting_y import split_ocr_careas_horizontally
 from pipeline.resegmentation.paragraph_merging_x import merge_careas_on_x_axis_in_document_tree
-from pipeline.hocr_tools.hocr_helpers import combine_hocr_pages
+from pipeline.hocr_tools.hocr_helpers import combine_hocr_pages, combine_hocr_files
 from pipeline.tei_encoding.layout_extraction import get_header_elements, remove_pre_text_elements, \
     remove_empty_careas, get_body_and_appendix_tree
 from pipeline.hocr_tools.hocr_element_visualization import plot_hocr_bboxes
@@ -15,11 +15,11 @@ from pipeline.constants import NAMESPACES
 hocr_directory = 'data_directory/OffenegesetzeDE/tesseract_output/brd_kartographen_1975'
 img_directory = 'data_directory/OffenegesetzeDE/scantailor_output/brd_kartographen_1975'
 
-hocr_trees = [etree.parse(os.path.join(hocr_directory, hocr_filename)) for hocr_filename in os.listdir(hocr_directory)
+hocr_paths = [os.path.join(hocr_directory, hocr_filename) for hocr_filename in os.listdir(hocr_directory)
               if hocr_filename.endswith(".hocr")]
 images = [Image.open(os.path.join(img_directory, img_filename)) for img_filename in os.listdir(img_directory)
           if img_filename.endswith(".tif")]
-hocr_tree = combine_hocr_pages(hocr_trees)
+hocr_tree = combine_hocr_files(hocr_paths)
 logger = file_logger()
 max_area_dist = 50
 
@@ -90,7 +90,7 @@ try:
         logger.info("Pre-text elements had to be removed")
         body_tree = combine_hocr_pages([etree.fromstring(
             bytes(pytesseract.run_and_get_output(image, 'hocr', 'deu', '--dpi 300', '--psm 3'), 'utf-8')) for image in
-            images[:appendix_page_start_idx]])
+            images[:appendix_page_start_idx]], move_pages=True)
         text_headers = [get_header_elements(page) for page in
                         body_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES)]
         split_ocr_careas_horizontally(body_tree)
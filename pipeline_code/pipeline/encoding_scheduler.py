@@ -0,0 +1,175 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, List
+from pipeline.hocr_tools.hocr_loader import iter_hocr_pages
+from pipeline.hocr_tools.hocr_selectors import WORDS
+from pipeline.tei_encoding.layout_extraction import is_signature_page
+from pipeline.pipeline_logger import file_logger
+
+"""
+Scheduler for the encoding of many regulations in a process pool. The encoding time of a regulation grows with its
+pages, its words and especially its table pages, whose cells are recognized one by one. If a few large regulations are
+started last, the other processes are idle while they run. Therefore, the cost of each regulation is estimated from
+its hOCR files first, and the regulations are started longest-first. Only a bounded number of regulations is submitted
+at a time, so that the order is kept and the pending parameters are not all pickled up front. Every finished
+regulation is recorded in a run report with its estimate and the time its encoding took in the worker, so that the
+weights of the estimate can be checked against the measured times. A task that cannot be prepared, e.g., because its
+hOCR directory is missing, is reported as failed without being run.
+"""
+
+
+# Relative cost of a page, a word and a table page (in addition to its page and word cost)
+PAGE_COST = 1.0
+WORD_COST = 0.002
+TABLE_PAGE_COST = 4.0
+
+
+def estimate_encoding_cost(hocr_paths: List[str]) -> dict:
+    """
+    Counts the pages, words and table pages of a regulation in one pass over its hOCR files. The pages after the
+    signature of the ministry are the appendix, whose pages are encoded as tables
+    :param hocr_paths: paths to the hOCR files of the regulation in page order
+    :return: the counts and the estimated cost
+    """
+    pages = words = table_pages = 0
+    appendix_started = False
+    for page in iter_hocr_pages(hocr_paths):
+        pages += 1
+        words += len(WORDS(page))
+        if appendix_started:
+            table_pages += 1
+        elif is_signature_page(page):
+            appendix_started = True
+        # The counted page is not needed anymore
+        page.clear()
+    return {"pages": pages, "words": words, "table_pages": table_pages,
+            "cost": pages * PAGE_COST + words * WORD_COST + table_pages * TABLE_PAGE_COST}
+
+
+def estimate_encoding_cost_from_pages(pages: int) -> dict:
+    """
+    Estimate of a regulation whose hOCR cannot be read, e.g., from the number of its page images
+    """
+    return {"pages": pages, "words": 0, "table_pages": 0, "cost": pages * PAGE_COST}
+
+
+def schedule_encodings(encode: Callable, tasks: List[dict], max_workers: int, max_in_flight: int = None,
+                       max_tasks_per_child: int = None, report_path: str = None, logger=None) -> List[dict]:
+    """
+    Runs encode(task["parameters"]) for every task in a process pool, starting with the highest estimated cost
+    :param encode: function that encodes one regulation and writes its output. It is called in the worker processes
+    and must be importable from there. It may return a dict, which is added to the report of the task
+    :param tasks: dicts with the "name" of the regulation, its "hocr_paths" for the estimate and the "parameters" of
+    encode. A task with an "error" is not run and reported as failed; it needs an "estimate" for the report
+    :param max_workers: number of processes
+    :param max_in_flight: maximal number of submitted tasks that have not finished, 2 * max_workers if None
+    :param max_tasks_per_child: If given, a process is replaced after so many tasks (estimates and encodings), which
+    frees the memory that PIL and lxml keep after large regulations. Requires Python 3.11 and makes the pool start its
+    processes with spawn, so every new process imports the module of encode again
+    :param report_path: If given, the run report is written to this JSON file
+    :param logger: logger for the progress
+    :return: the report of each task in the order in which the tasks finished
+    """
+    if logger is None:
+        logger = file_logger()
+    max_in_flight = max_in_flight if max_in_flight is not None else 2 * max_workers
+    executor_options = {"max_workers": max_workers}
+    if max_tasks_per_child is not None:
+        executor_options["max_tasks_per_child"] = max_tasks_per_child
+    start_time = time.time()
+    reports = []
+    try:
+        for task in tasks:
+            if "error" in task:
+                reports.append({"name": task["name"], "estimate": task["estimate"], "duration": 0.0,
+                                "queue_and_run_time": 0.0, "status": "failed", "error": task["error"]})
+                logger.info(f"Failed {task['name']} ({len(reports)}/{len(tasks)}): {task['error']}")
+        runnable_tasks = [task for task in tasks if "error" not in task]
+        with ProcessPoolExecutor(**executor_options) as executor:
+            estimate_tasks(executor, runnable_tasks)
+            pending = deque(sorted(runnable_tasks, key=lambda task: task["estimate"]["cost"], reverse=True))
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < max_in_flight:
+                    task = pending.popleft()
+                    in_flight[executor.submit(timed_encoding, encode, task["parameters"])] = (task, time.time())
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task, submit_time = in_flight.pop(future)
+                    reports.append(task_report(task, future, time.time() - submit_time))
+                    logger.info(f"Finished {task['name']} ({len(reports)}/{len(tasks)}): {reports[-1]['status']}")
+    finally:
+        if report_path is not None:
+            write_run_report(report_path, reports, start_time, max_workers, max_tasks_per_child)
+    return reports
+
+
+def estimate_tasks(executor: ProcessPoolExecutor, tasks: List[dict]):
+    """
+    Estimates the cost of all tasks in the processes of executor and stores it as task["estimate"]. A task whose hOCR
+    cannot be read gets the cost 0, its encoding fails later and is reported
+    """
+    futures = [executor.submit(estimate_encoding_cost, task["hocr_paths"]) for task in tasks]
+    for task, future in zip(tasks, futures):
+        try:
+            task["estimate"] = future.result()
+        except Exception as e:
+            task["estimate"] = {"pages": 0, "words": 0, "table_pages": 0, "cost": 0.0, "error": repr(e)}
+
+
+def timed_encoding(encode: Callable, parameters) -> dict:
+    """
+    Runs encode(parameters) in a worker process and measures its time there, without the time the task waited in the
+    queue of the pool
+    :return: dict with the "result" of encode or the "error" it raised, and the "duration" in seconds
+    """
+    start_time = time.perf_counter()
+    try:
+        result = encode(parameters)
+    except Exception as e:
+        return {"error": repr(e), "duration": time.perf_counter() - start_time}
+    return {"result": result, "duration": time.perf_counter() - start_time}
+
+
+def task_report(task: dict, future, queue_and_run_time: float) -> dict:
+    """
+    Report of a finished task with its estimate, the time its encoding took in the worker ("duration"), the time from
+    its submission until it finished and its result
+    """
+    report = {"name": task["name"], "estimate": task["estimate"], "duration": None,
+              "queue_and_run_time": queue_and_run_time}
+    exception = future.exception()
+    if exception is not None:
+        # The worker did not return, e.g., because it was killed
+        report["status"] = "failed"
+        report["error"] = repr(exception)
+        return report
+    timed_result = future.result()
+    report["duration"] = timed_result["duration"]
+    if "error" in timed_result:
+        report["status"] = "failed"
+        report["error"] = timed_result["error"]
+    else:
+        report["status"] = "finished"
+        if isinstance(timed_result["result"], dict):
+            report.update(timed_result["result"])
+    return report
+
+
+def write_run_report(report_path: str, reports: List[dict], start_time: float, max_workers: int,
+                     max_tasks_per_child: int = None):
+    directory = os.path.dirname(report_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    status_counts = {}
+    for report in reports:
+        status_counts[report["status"]] = status_counts.get(report["status"], 0) + 1
+    with open(report_path, 'w', encoding='utf-8') as report_file:
+        json.dump({"max_workers": max_workers,
+                   "max_tasks_per_child": max_tasks_per_child,
+                   "wall_time": time.time() - start_time,
+                   "status_counts": status_counts,
+                   "tasks": reports}, report_file, indent=2)
@@ -1,7 +1,9 @@
 from lxml import etree
-from typing import List, Tuple
+from typing import Iterator, List, Tuple
 from copy import deepcopy
-from ..constants import NAMESPACES
+import numpy as np
+from pipeline.hocr_tools.hocr_selectors import BODY, BODY_PAGES, CAREAS, DOCUMENT_BODY, DOCUMENT_PAGES, PAGES, PARS, \
+    TEXT_AND_HEADER_LINES, TEXT_LINES, WORDS
 
 
 """
@@ -9,19 +11,23 @@ Working on hOCR trees
 """
 
 
-def combine_hocr_pages(hocr_trees: List[etree.ElementTree]) -> etree:
+def combine_hocr_pages(hocr_trees: List[etree.ElementTree], move_pages: bool = False) -> etree:
     """
     Takes a list of etrees that contain the parsed hOCR vet_files and combines all div tags with class='ocr_page' into one
     single tree. This results in a single etree that contains all pages
     :param hocr_trees: list of hOCR etrees
+    :param move_pages: If True, the pages are moved into a new document instead of copying the trees. The input trees
+    are emptied in the process and must not be used afterward
     :return: hOCR etree with all pages of the document
     """
     # Kann auch über cli mit hocr-tools (i.e., hocr-combine) gemacht werden
+    if move_pages:
+        return move_hocr_pages(iter(hocr_trees))
     doc_tree = deepcopy(hocr_trees[0])
-    target_body = doc_tree.xpath("///x:body", namespaces=NAMESPACES)[0]
+    target_body = DOCUMENT_BODY(doc_tree)[0]
     for i in range(1, len(hocr_trees)):
         source_tree = deepcopy(hocr_trees[i])
-        source_element = source_tree.xpath("///x:div[@class='ocr_page']", namespaces=NAMESPACES)[0]
+        source_element = DOCUMENT_PAGES(source_tree)[0]
         target_body.append(source_element)
         # Ensure the XML will be well-formed
         etree_string = etree.tostring(hocr_trees[i], pretty_print=True, encoding="unicode")
@@ -32,6 +38,40 @@ def combine_hocr_pages(hocr_trees: List[etree.ElementTree]) -> etree:
     return doc_tree
 
 
+def combine_hocr_files(hocr_paths: List[str], parser: etree.XMLParser = None) -> etree.ElementTree:
+    """
+    Streaming version of combine_hocr_pages that parses one hOCR file at a time and moves its page into the combined
+    document, so that only the combined document stays in memory
+    :param hocr_paths: paths to the hOCR files in page order
+    :param parser: parser that is used for each file, the default parser of lxml if None
+    :return: hOCR etree with all pages of the document
+    """
+    return move_hocr_pages(etree.parse(hocr_path, parser) for hocr_path in hocr_paths)
+
+
+def move_hocr_pages(hocr_trees: Iterator[etree.ElementTree]) -> etree.ElementTree:
+    """
+    Moves the content of the hOCR trees into a new document without copying. The first tree provides the whole
+    document, i.e., its head and all of its pages. Of every other tree, only the first ocr_page is moved, like in
+    combine_hocr_pages
+    :param hocr_trees: parsed hOCR trees or their root elements
+    :return: hOCR etree with all pages of the document
+    """
+    source_root = next(hocr_trees, None)
+    if source_root is None:
+        raise ValueError("There are no hOCR trees to combine")
+    if isinstance(source_root, etree._ElementTree):
+        source_root = source_root.getroot()
+    doc_root = etree.Element(source_root.tag, attrib=dict(source_root.attrib), nsmap=source_root.nsmap)
+    doc_root.text = source_root.text
+    for child in list(source_root):
+        doc_root.append(child)
+    target_body = BODY(doc_root)[0]
+    for hocr_tree in hocr_trees:
+        target_body.append(PAGES(hocr_tree)[0])
+    return etree.ElementTree(doc_root)
+
+
 def remove_element_from_hocr_tree(hocr_element: etree.ElementTree):
     parent = hocr_element.getparent()
     if parent is not None:
@@ -66,6 +106,25 @@ def get_surrounding_bbox(hocr_element_list: List[etree.ElementTree]) -> Tuple[in
     return x1, y1, x2, y2
 
 
+def get_element_bboxes(hocr_element_list: List[etree.ElementTree]) -> np.ndarray:
+    """
+    Returns the bboxes of the input elements as an array with one row x1, y1, x2, y2 per element
+    :param hocr_element_list: list of parsed hOCR elements
+    :return: array of shape (len(hocr_element_list), 4)
+    """
+    return np.array([get_element_bbox(elem) for elem in hocr_element_list], dtype=np.int64).reshape(-1, 4)
+
+
+def get_surrounding_bbox_of_bboxes(bboxes: np.ndarray) -> Tuple[int, int, int, int]:
+    """
+    Array version of get_surrounding_bbox
+    :param bboxes: array with one row x1, y1, x2, y2 per bbox
+    :return: x1, y1, x2, y2 that span a bbox around all bboxes
+    """
+    bboxes = np.asarray(bboxes)
+    return int(bboxes[:, 0].min()), int(bboxes[:, 1].min()), int(bboxes[:, 2].max()), int(bboxes[:, 3].max())
+
+
 """
 Checking if elements overlap in any direction
 """
@@ -92,6 +151,43 @@ def ocr_elements_overlap(hocr_elem_1, hocr_elem_2):
         hocr_elem_1, hocr_elem_2)
 
 
+def bboxes_overlap_horizontally(bboxes: np.ndarray, bbox) -> np.ndarray:
+    """
+    Array version of ocr_elements_overlap_horizontally that compares each row of bboxes with bbox
+    :param bboxes: array with one row x1, y1, x2, y2 per bbox
+    :param bbox: x1, y1, x2, y2
+    :return: boolean array
+    """
+    bboxes = np.asarray(bboxes)
+    _, b_y1, _, b_y2 = bbox
+    y1 = bboxes[:, 1]
+    y2 = bboxes[:, 3]
+    return ((y1 <= b_y1) & (b_y1 <= y2)) | ((y1 <= b_y2) & (b_y2 <= y2)) | \
+        ((b_y1 <= y1) & (y1 <= b_y2)) | ((b_y1 <= y2) & (y2 <= b_y2))
+
+
+def bboxes_overlap_vertically(bboxes: np.ndarray, bbox) -> np.ndarray:
+    """
+    Array version of ocr_elements_overlap_vertically that compares each row of bboxes with bbox
+    :param bboxes: array with one row x1, y1, x2, y2 per bbox
+    :param bbox: x1, y1, x2, y2
+    :return: boolean array
+    """
+    bboxes = np.asarray(bboxes)
+    b_x1, _, b_x2, _ = bbox
+    return ~((bboxes[:, 2] < b_x1) | (b_x2 < bboxes[:, 0]))
+
+
+def bboxes_overlap(bboxes: np.ndarray, bbox) -> np.ndarray:
+    """
+    Checks for each row of bboxes if it overlaps with bbox in both directions
+    :param bboxes: array with one row x1, y1, x2, y2 per bbox
+    :param bbox: x1, y1, x2, y2
+    :return: boolean array
+    """
+    return bboxes_overlap_horizontally(bboxes, bbox) & bboxes_overlap_vertically(bboxes, bbox)
+
+
 """
 Getting text from hOCR trees and elements
 """
@@ -103,16 +199,15 @@ def print_hocr_tree(hocr_tree: etree.ElementTree):
     :param hocr_tree: tree of which the text is printed
     :return:
     """
-    text_pages = hocr_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
+    text_pages = BODY_PAGES(hocr_tree)
     for text_page in text_pages:
-        text_careas = text_page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+        text_careas = CAREAS(text_page)
         for text_carea in text_careas:
-            text_pars = text_carea.xpath(".//x:p[@class='ocr_par']", namespaces=NAMESPACES)
+            text_pars = PARS(text_carea)
             for text_par in text_pars:
-                text_lines_or_floats = text_par.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat']",
-                                                      namespaces=NAMESPACES)
+                text_lines_or_floats = TEXT_LINES(text_par)
                 for text_line_or_float in text_lines_or_floats:
-                    text_ocr_words = text_line_or_float.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
+                    text_ocr_words = WORDS(text_line_or_float)
                     text_ocr_line = " ".join([w.text for w in text_ocr_words])
                     print(text_ocr_line)
 
@@ -126,7 +221,7 @@ def build_ocr_carea_texts(page_elem_tree: etree.ElementTree) -> List[List[str]]:
     :param page_elem_tree: The element tree which will be splitted into its text
     :return: A list of lists (ocr_careas) that contain lists (ocr_line / ocr_textfloat) with lines
     """
-    page_ocr_careas = page_elem_tree.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+    page_ocr_careas = CAREAS(page_elem_tree)
     parsed_ocr_careas = []  # This stores the corresponding area
     for area in page_ocr_careas:
         parsed_ocr_careas.append(build_ocr_carea_text(area))
@@ -139,11 +234,10 @@ def build_ocr_carea_text(ocr_carea_elem: etree.Element) -> List[str]:
     :param ocr_carea_elem: Element from which the text will be formatted
     :return: List of lines in the ocr_carea
     """
-    text_elements = ocr_carea_elem.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']",
-                                         namespaces=NAMESPACES)
+    text_elements = TEXT_AND_HEADER_LINES(ocr_carea_elem)
     ocr_carea_lines = []
     for text_element in text_elements:
-        x_word_spans = text_element.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
+        x_word_spans = WORDS(text_element)
         line = " ".join([w.text for w in x_word_spans if w.text is not None])
         ocr_carea_lines.append(line)
     return ocr_carea_lines
@@ -0,0 +1,268 @@
+"""
+Columnar index of an hOCR page (or any other hOCR element). The title attributes are parsed once into NumPy arrays
+with one row per element, so that geometry checks can run on arrays instead of parsing the title strings in inner
+loops. The index stays coherent with the lxml tree as long as the tree is changed through remove, merge, split and
+set_bbox.
+"""
+from lxml import etree
+from typing import List
+import numpy as np
+from pipeline.hocr_tools.hocr_helpers import get_surrounding_bbox_of_bboxes
+
+
+HOCR_CLASSES = ['ocr_page', 'ocr_carea', 'ocr_par', 'ocr_line', 'ocr_textfloat', 'ocr_header', 'ocr_caption',
+                'ocrx_word', 'ocr_separator', 'ocr_photo']
+HOCR_CLASS_CODES = {hocr_class: code for code, hocr_class in enumerate(HOCR_CLASSES)}
+UNKNOWN_CLASS_CODE = -1
+LINE_CLASSES = ['ocr_line', 'ocr_textfloat', 'ocr_header']
+
+
+def get_title_bbox(title: str):
+    """
+    Finds the bbox property in an hOCR title attribute. Other than in get_element_bbox, the bbox does not need to be the
+    first property, e.g., for ocr_page elements
+    :param title: title attribute
+    :return: x1, y1, x2, y2 or None if the title has no bbox
+    """
+    if title is None:
+        return None
+    for title_property in title.split(";"):
+        title_property = title_property.strip()
+        if title_property.startswith('bbox'):
+            return list(map(int, title_property.split(" ")[1:5]))
+    return None
+
+
+class HocrIndex:
+    """
+    Arrays (one row per hOCR element with a bbox in document order):
+    - classes: class code of the element, see HOCR_CLASS_CODES
+    - bboxes: x1, y1, x2, y2
+    - parents: row of the closest indexed ancestor, -1 for the root
+    - text_offsets, text_lengths: position of the element's text in self.text, -1 if it has no text
+    - alive: False once the element was removed through the index
+    The child rows of each row are kept as lists as well, so that the descendants of an element are found in the time
+    of its subtree. Ranges in document order would not survive merge and split, which move children to other elements.
+    split appends the new element as the last row and merge can move children behind other elements, so after these
+    changes the rows are no longer in document order. The document position of each row is then computed again from
+    the tree when it is needed
+    """
+    def __init__(self, hocr_element: etree.ElementTree):
+        if isinstance(hocr_element, etree._ElementTree):
+            hocr_element = hocr_element.getroot()
+        self.root = hocr_element
+        self._elements = []
+        self._rows = {}
+        classes = []
+        bboxes = []
+        parents = []
+        text_offsets = []
+        text_lengths = []
+        text_parts = []
+        text_length = 0
+        for element in hocr_element.iter(tag=etree.Element):
+            bbox = get_title_bbox(element.get('title'))
+            if bbox is None:
+                continue
+            parent_row = -1
+            ancestor = element.getparent()
+            while ancestor is not None and element is not hocr_element:
+                if ancestor in self._rows:
+                    parent_row = self._rows[ancestor]
+                    break
+                if ancestor is hocr_element:
+                    break
+                ancestor = ancestor.getparent()
+            self._rows[element] = len(self._elements)
+            self._elements.append(element)
+            classes.append(HOCR_CLASS_CODES.get(element.get('class'), UNKNOWN_CLASS_CODE))
+            bboxes.append(bbox)
+            parents.append(parent_row)
+            if element.text is not None:
+                text_offsets.append(text_length)
+                text_lengths.append(len(element.text))
+                text_parts.append(element.text)
+                text_length += len(element.text)
+            else:
+                text_offsets.append(-1)
+                text_lengths.append(0)
+        self.classes = np.array(classes, dtype=np.int16)
+        self.bboxes = np.array(bboxes, dtype=np.int64).reshape(-1, 4)
+        self.parents = np.array(parents, dtype=np.int64)
+        self.text_offsets = np.array(text_offsets, dtype=np.int64)
+        self.text_lengths = np.array(text_lengths, dtype=np.int64)
+        self.alive = np.ones(len(self._elements), dtype=bool)
+        self.text = "".join(text_parts)
+        self._children = [[] for _ in self._elements]
+        for row, parent_row in enumerate(parents):
+            if parent_row >= 0:
+                self._children[parent_row].append(row)
+        # Document position of each row, None if it has to be computed again after merge or split
+        self._positions = None
+
+    def __len__(self):
+        return len(self._elements)
+
+    def row(self, hocr_element: etree.ElementTree) -> int:
+        return self._rows[hocr_element]
+
+    def element(self, row: int) -> etree.ElementTree:
+        return self._elements[row]
+
+    def elements(self, rows) -> List[etree.ElementTree]:
+        return [self._elements[row] for row in rows]
+
+    def bbox(self, hocr_element: etree.ElementTree) -> np.ndarray:
+        return self.bboxes[self._rows[hocr_element]]
+
+    def element_text(self, row: int):
+        if self.text_offsets[row] < 0:
+            return None
+        return self.text[self.text_offsets[row]:self.text_offsets[row] + self.text_lengths[row]]
+
+    def rows_of_class(self, hocr_classes, within: etree.ElementTree = None) -> np.ndarray:
+        """
+        Returns the rows of all alive elements that have one of the hocr_classes in document order
+        :param hocr_classes: a class name or a list of class names
+        :param within: If not None, only descendants of this element are returned
+        :return: array of rows
+        """
+        if isinstance(hocr_classes, str):
+            hocr_classes = [hocr_classes]
+        codes = [HOCR_CLASS_CODES.get(hocr_class, UNKNOWN_CLASS_CODE) for hocr_class in hocr_classes]
+        mask = np.isin(self.classes, codes) & self.alive
+        if within is not None:
+            mask &= self.descendant_mask(self._rows[within])
+        rows = np.flatnonzero(mask)
+        if self._positions is not None:
+            rows = rows[np.argsort(self._positions[rows], kind='stable')]
+        return rows
+
+    def _update_positions(self):
+        """
+        Sets the document position of each alive row after the tree was changed through merge or split
+        """
+        self._positions = np.full(len(self._elements), len(self._elements), dtype=np.int64)
+        position = 0
+        for element in self.root.iter(tag=etree.Element):
+            row = self._rows.get(element)
+            if row is not None:
+                self._positions[row] = position
+                position += 1
+
+    def descendant_rows(self, row: int) -> np.ndarray:
+        """
+        Returns the rows of all descendants of row
+        """
+        descendant_rows = []
+        stack = list(self._children[row])
+        while stack:
+            descendant_row = stack.pop()
+            descendant_rows.append(descendant_row)
+            stack.extend(self._children[descendant_row])
+        return np.array(descendant_rows, dtype=np.int64)
+
+    def descendant_mask(self, row: int) -> np.ndarray:
+        """
+        Returns a mask of all rows that are descendants of row
+        """
+        mask = np.zeros(len(self._elements), dtype=bool)
+        mask[self.descendant_rows(row)] = True
+        return mask
+
+    def has_ancestor_of_class(self, rows, hocr_class: str) -> np.ndarray:
+        """
+        Checks for each row if any of its ancestors has the hocr_class
+        """
+        code = HOCR_CLASS_CODES.get(hocr_class, UNKNOWN_CLASS_CODE)
+        result = np.zeros(len(rows), dtype=bool)
+        ancestors = self.parents[np.asarray(rows, dtype=np.int64)]
+        while np.any(ancestors >= 0):
+            valid = ancestors >= 0
+            result[valid] |= self.classes[ancestors[valid]] == code
+            ancestors = np.where(valid, self.parents[np.maximum(ancestors, 0)], -1)
+        return result
+
+    def set_bbox(self, hocr_element: etree.ElementTree, bbox):
+        """
+        Sets the bbox of the element in the title attribute and in the index. Other title properties are kept
+        """
+        x1, y1, x2, y2 = [int(coordinate) for coordinate in bbox]
+        title_properties = hocr_element.get('title').split(";")
+        bbox_idx = [title_property.strip().startswith('bbox') for title_property in title_properties].index(True)
+        title_properties[bbox_idx] = f"{' ' if bbox_idx > 0 else ''}bbox {x1} {y1} {x2} {y2}"
+        hocr_element.set("title", ";".join(title_properties))
+        self.bboxes[self._rows[hocr_element]] = (x1, y1, x2, y2)
+
+    def remove(self, hocr_element: etree.ElementTree):
+        """
+        Detaches the element from its parent and marks it and its descendants as removed
+        """
+        row = self._rows[hocr_element]
+        self.alive[row] = False
+        self.alive[self.descendant_rows(row)] = False
+        parent = hocr_element.getparent()
+        if parent is not None:
+            parent.remove(hocr_element)
+
+    def merge(self, target: etree.ElementTree, source: etree.ElementTree, bbox=None):
+        """
+        Moves all children of source to the end of target, removes source and sets the bbox of target
+        :param target: element that receives the children
+        :param source: element that is merged into target and removed afterward
+        :param bbox: new bbox of target, the bbox around both elements if None
+        :return:
+        """
+        target_row = self._rows[target]
+        source_row = self._rows[source]
+        if bbox is None:
+            bbox = get_surrounding_bbox_of_bboxes(self.bboxes[[target_row, source_row]])
+        for child in list(source):
+            target.append(child)
+        source_child_rows = self._children[source_row]
+        self.parents[source_child_rows] = target_row
+        self._children[target_row].extend(source_child_rows)
+        self._children[source_row] = []
+        self.remove(source)
+        self.set_bbox(target, bbox)
+        self._update_positions()
+
+    def split(self, hocr_element: etree.ElementTree, child_idx: int) -> etree.ElementTree:
+        """
+        Moves the children before child_idx into a new element with the same tag and class that is inserted in front of
+        hocr_element. The bboxes of both elements are set around their remaining children
+        :param hocr_element: element to split
+        :param child_idx: index of the first child that stays in hocr_element
+        :return: the new element
+        """
+        row = self._rows[hocr_element]
+        new_element = etree.Element(hocr_element.tag)
+        new_element.set("class", hocr_element.get("class"))
+        new_element.set("title", hocr_element.get("title"))
+        for child in list(hocr_element)[:child_idx]:
+            new_element.append(child)
+        hocr_element.addprevious(new_element)
+        new_row = len(self._elements)
+        self._rows[new_element] = new_row
+        self._elements.append(new_element)
+        self.classes = np.append(self.classes, self.classes[row])
+        self.bboxes = np.vstack([self.bboxes, self.bboxes[row]])
+        self.parents = np.append(self.parents, self.parents[row])
+        self.text_offsets = np.append(self.text_offsets, -1)
+        self.text_lengths = np.append(self.text_lengths, 0)
+        self.alive = np.append(self.alive, True)
+        self._children.append([])
+        if self.parents[row] >= 0:
+            self._children[self.parents[row]].append(new_row)
+        # The children of row may be nested in elements without bbox, which are not indexed
+        moved_child_rows = [child_row for child_row in self._children[row]
+                            if any(ancestor is new_element for ancestor in self._elements[child_row].iterancestors())]
+        self.parents[moved_child_rows] = new_row
+        self._children[new_row] = moved_child_rows
+        self._children[row] = [child_row for child_row in self._children[row] if self.parents[child_row] == row]
+        for element_row in [new_row, row]:
+            child_rows = [child_row for child_row in self._children[element_row] if self.alive[child_row]]
+            if child_rows:
+                self.set_bbox(self._elements[element_row], get_surrounding_bbox_of_bboxes(self.bboxes[child_rows]))
+        self._update_positions()
+        return new_element
@@ -0,0 +1,105 @@
+"""
+Loads hOCR files page by page with iterparse into a compact representation. While a file is parsed, the title
+attribute of every element is reduced to the properties the pipeline reads (the bbox, and the image for pages), the
+id attributes are dropped and the indentation between the elements is not stored. Tesseract writes baseline, x_size,
+x_wconf, an id and a line break with indentation for every line and word, so this shrinks the parsed pages by about a
+third.
+load_hocr_document keeps all compact pages of a document in one tree, because the encoding works on the whole document,
+so its memory still grows with the number of pages. Only a consumer of iter_hocr_pages that handles one page at a time
+and clears it afterward, like the cost estimate of the encoding scheduler, keeps its memory bounded by a page (and by
+the file, if a file contains several pages).
+"""
+from copy import deepcopy
+from typing import Iterator, List, Sequence
+from lxml import etree
+from pipeline.constants import NAMESPACES
+
+
+# Title properties that are kept by default. The order of the properties in the title is not changed, which matters
+# for ocr_page elements, whose bbox is read as second property after the image
+DEFAULT_TITLE_PROPERTIES = ('image', 'bbox')
+OCR_PAGE_TAG = f"{{{NAMESPACES['x']}}}div"
+
+
+def prune_title(title: str, keep_properties: Sequence[str] = DEFAULT_TITLE_PROPERTIES) -> str:
+    """
+    Removes all properties from an hOCR title attribute that are not in keep_properties
+    :param title: title attribute, e.g., 'bbox 1 2 3 4; baseline 0 -5; x_size 30'
+    :param keep_properties: names of the properties to keep
+    :return: the title with the remaining properties in their original order, e.g., 'bbox 1 2 3 4'
+    """
+    title_properties = [title_property.strip() for title_property in title.split(";")]
+    return "; ".join([title_property for title_property in title_properties
+                      if title_property.split(" ", 1)[0] in keep_properties])
+
+
+def iter_hocr_pages(hocr_paths: List[str],
+                    keep_title_properties: Sequence[str] = DEFAULT_TITLE_PROPERTIES,
+                    keep_ids: bool = False,
+                    remove_blank_text: bool = True) -> Iterator[etree.Element]:
+    """
+    Parses the hOCR files one after another and yields each ocr_page as soon as it is complete
+    :param hocr_paths: paths to the hOCR files in page order
+    :param keep_title_properties: title properties that are kept, None to keep all of them
+    :param keep_ids: If True, the id attributes are kept
+    :param remove_blank_text: If True, whitespace between elements is not stored. The text of the words is kept even if
+    it only consists of whitespace
+    :return: iterator over the ocr_page elements. A page is still part of the tree of its file until the caller moves it.
+    The tree of a file keeps its earlier pages, so a caller that only reads the pages should clear each page when it is
+    done with it
+    """
+    for hocr_path in hocr_paths:
+        for _, element in etree.iterparse(hocr_path, events=('end',), remove_blank_text=remove_blank_text):
+            title = element.get('title')
+            if keep_title_properties is not None and title is not None:
+                element.set('title', prune_title(title, keep_title_properties))
+            if not keep_ids and 'id' in element.attrib:
+                del element.attrib['id']
+            if element.tag == OCR_PAGE_TAG and element.get('class') == 'ocr_page':
+                yield element
+
+
+def load_hocr_document(hocr_paths: List[str],
+                       keep_title_properties: Sequence[str] = DEFAULT_TITLE_PROPERTIES,
+                       keep_ids: bool = False,
+                       remove_blank_text: bool = True) -> etree.ElementTree:
+    """
+    Builds one hOCR document from the pages of all files. The html and head elements are taken from the first file.
+    All pages are kept in the document, so the memory grows with the number of pages, only the size of each page is
+    reduced. See iter_hocr_pages for the parameters
+    :param hocr_paths: paths to the hOCR files in page order
+    :param keep_title_properties: title properties that are kept, None to keep all of them
+    :param keep_ids: If True, the id attributes are kept
+    :param remove_blank_text: If True, whitespace between elements is not stored
+    :return: hOCR etree with all pages of the document
+    """
+    doc_root = None
+    doc_body = None
+    for page in iter_hocr_pages(hocr_paths, keep_title_properties=keep_title_properties, keep_ids=keep_ids,
+                                remove_blank_text=remove_blank_text):
+        if doc_root is None:
+            doc_root, doc_body = copy_document_skeleton(page)
+        doc_body.append(page)
+    if doc_root is None:
+        raise ValueError("The hOCR files do not contain any ocr_page")
+    return etree.ElementTree(doc_root)
+
+
+def copy_document_skeleton(page: etree.Element):
+    """
+    Creates a new html element with a copy of the head of the document of page and an empty body
+    :param page: ocr_page of the source document
+    :return: the new html and body element
+    """
+    source_body = page.getparent()
+    source_root = source_body.getparent()
+    doc_root = etree.Element(source_root.tag, attrib=dict(source_root.attrib), nsmap=source_root.nsmap)
+    doc_root.text = source_root.text
+    for child in source_root:
+        if child is source_body:
+            break
+        doc_root.append(deepcopy(child))
+    doc_body = etree.SubElement(doc_root, source_body.tag, attrib=dict(source_body.attrib))
+    doc_body.text = source_body.text
+    doc_body.tail = source_body.tail
+    return doc_root, doc_body
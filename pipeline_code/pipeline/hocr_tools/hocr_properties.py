@@ -1,6 +1,7 @@
 from lxml import etree
-from pipeline.constants import NAMESPACES
+from pipeline.hocr_tools.hocr_selectors import ALL_CAREAS, BODY_PAGE_CAREAS, TEXT_AND_HEADER_LINES, TEXT_LINES, WORDS
 from pipeline.hocr_tools.hocr_helpers import get_element_bbox
+from pipeline.hocr_tools.hocr_index import HocrIndex, LINE_CLASSES
 import numpy as np
 
 
@@ -10,16 +11,14 @@ def carea_contains_only_header(carea_element: etree.ElementTree):
     :param carea_element:
     :return: True if all lines are an ocr_header, False otherwise
     """
-    for line_elem in carea_element.xpath(
-            ".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']", namespaces=NAMESPACES):
+    for line_elem in TEXT_AND_HEADER_LINES(carea_element):
         if line_elem.attrib['class'] != "ocr_header":
             return False
     return True
 
 
 def carea_contins_only_empty_words(carea_element: etree.ElementTree):
-    return all([w.text is None or w.text.strip() == '' for w in carea_element.xpath(".//x:span[@class='ocrx_word']",
-                                                                                    namespaces=NAMESPACES)])
+    return all([w.text is None or w.text.strip() == '' for w in WORDS(carea_element)])
 
 
 def ocr_element_is_centered(carea_element: etree.ElementTree, page_element: etree.ElementTree,
@@ -42,21 +41,24 @@ def ocr_element_is_centered(carea_element: etree.ElementTree, page_element: etre
     return False
 
 
-def average_line_height_and_std(hocr_tree: etree.ElementTree):
+def average_line_height_and_std(hocr_tree: etree.ElementTree, hocr_index: HocrIndex = None):
     """
     Computes the average line height on all ocr_careas and returns mean and standard deviation of the line heights
     :param hocr_tree: hOCR tree to compute the average line height and standard deviation of
+    :param hocr_index: If not None, the line heights are taken from this index of the hocr_tree
     :return: average line height and standard deviation
     """
-    # print(etree.tostring(hocr_tree, pretty_print=True, encoding='unicode'))
-    ocr_careas = hocr_tree.xpath("//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
-    line_heights = []
-    for ocr_carea in ocr_careas:
-        # print(ocr_carea)
-        lines = ocr_carea.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']", namespaces=NAMESPACES)  # TODO careas werden nicht gefunden?
-        for i in range(len(lines)):
-            _, y1, _, y2 = get_element_bbox(lines[i])
-            line_heights.append(y2 - y1)
+    if hocr_index is not None:
+        line_rows = hocr_index.rows_of_class(LINE_CLASSES)
+        line_rows = line_rows[hocr_index.has_ancestor_of_class(line_rows, 'ocr_carea')]
+        line_heights = list(hocr_index.bboxes[line_rows, 3] - hocr_index.bboxes[line_rows, 1])
+    else:
+        line_heights = []
+        for ocr_carea in ALL_CAREAS(hocr_tree):
+            lines = TEXT_AND_HEADER_LINES(ocr_carea)  # TODO careas werden nicht gefunden?
+            for i in range(len(lines)):
+                _, y1, _, y2 = get_element_bbox(lines[i])
+                line_heights.append(y2 - y1)
     # print(line_heights)
     q1 = np.percentile(line_heights, 25)
     q3 = np.percentile(line_heights, 75)
@@ -79,8 +81,7 @@ def carea_has_average_line_height(ocr_carea: etree.ElementTree, avg_line_height,
     :param line_height_std: standard deviation for the line height
     :return: True if all lines lie within 2 * std of the mean, False otherwise
     """
-    lines = ocr_carea.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']",
-                            namespaces=NAMESPACES)
+    lines = TEXT_AND_HEADER_LINES(ocr_carea)
     carea_line_heights = []
     for line in lines:
         line_x1, line_y1, line_x2, line_y2 = get_element_bbox(line)
@@ -103,10 +104,10 @@ def document_average_character_area_and_std(hocr_tree: etree.ElementTree):
     :return: average line height and standard deviation
     """
     # print(etree.tostring(hocr_tree, pretty_print=True, encoding='unicode'))
-    ocr_careas = hocr_tree.xpath("///x:body/x:div[@class='ocr_page']//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+    ocr_careas = BODY_PAGE_CAREAS(hocr_tree)
     average_character_areas = []
     for ocr_carea in ocr_careas:
-        words = ocr_carea.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
+        words = WORDS(ocr_carea)
         for i in range(len(words)):
             x1, y1, x2, y2 = get_element_bbox(words[i])
             average_character_areas.append((x2 - x1) / (len(words[i].text)))
@@ -137,8 +138,7 @@ def carea_average_character_area_and_std(carea_element: etree.ElementTree):
     :param carea_element:
     :return:
     """
-    words = carea_element.xpath(".//x:span[@class='ocrx_word']",
-                                namespaces=NAMESPACES)
+    words = WORDS(carea_element)
     character_areas = []
     for word in words:
         x1, y1, x2, y2 = get_element_bbox(word)
@@ -158,17 +158,24 @@ def carea_average_character_area_and_std(carea_element: etree.ElementTree):
 
 def carea_has_average_character_areas(carea_element: etree.ElementTree,
                                       hocr_tree: etree.ElementTree,
-                                      std_threshold=0.6):  # 1.8 für neue, 1 für alte
+                                      std_threshold=0.6,  # 1.8 für neue, 1 für alte
+                                      document_stats: 'DocumentStats' = None):
     """
     Computes the average character area of a carea and compares it to the average character area of the document.
     :param carea_element:
     :param hocr_tree:
     :param std_threshold:
+    :param document_stats: If not None, the average character area of the document is taken from these statistics
+    instead of computing it over the whole hocr_tree
     :return: True if the carea's average character area lies within std_threshold times the standard deviation of the
     document's average carea
     """
     carea_average_character_area, carea_std_character_area = carea_average_character_area_and_std(carea_element)
-    document_average_character_area, document_std_character_area = document_average_character_area_and_std(hocr_tree)
+    if document_stats is not None:
+        document_average_character_area, document_std_character_area = document_stats.character_area_mean_and_std
+    else:
+        document_average_character_area, document_std_character_area = \
+            document_average_character_area_and_std(hocr_tree)
     if carea_average_character_area <= document_average_character_area + std_threshold * document_std_character_area:
         return True
     return False
@@ -181,3 +188,74 @@ def ocr_word_is_empty(word_element: etree.Element) -> bool:
     :return: True if word is empty, False otherwise
     """
     return word_element.text is None or len(word_element.text.strip()) == 0
+
+
+def line_distances_per_ocr_carea(hocr_tree: etree.ElementTree) -> np.array:
+    """
+    Computes the line distances for lines in each ocr_carea and not across different_ocr_careas
+    :param hocr_tree:
+    :return: array of shape (n, 1) with the distances between consecutive lines that do not overlap
+    """
+    ocr_careas = BODY_PAGE_CAREAS(hocr_tree)
+    line_distances = []
+    for ocr_carea in ocr_careas:
+        lines = TEXT_LINES(ocr_carea)
+        for i in range(1, len(lines)):
+            _, _, _, prev_y2 = get_element_bbox(lines[i-1])
+            _, y1, _, _ = get_element_bbox(lines[i])
+            if y1 > prev_y2:
+                line_distances.append(y1 - prev_y2)
+    return np.array(line_distances).reshape(-1, 1)
+
+
+class DocumentStats:
+    """
+    Document-level statistics of an hOCR tree. Each statistic is computed on first access and cached until invalidate
+    is called, so that checks on single careas do not have to go over the whole document again. Whoever changes the
+    tree in a way that affects the statistics (e.g., removing or splitting careas) has to call invalidate
+    """
+    def __init__(self, hocr_tree: etree.ElementTree, hocr_index: HocrIndex = None):
+        """
+        :param hocr_tree: hOCR tree the statistics are computed for
+        :param hocr_index: optional index of hocr_tree that is used for the line heights
+        """
+        self.hocr_tree = hocr_tree
+        self.hocr_index = hocr_index
+        # Counts how often the statistics were invalidated
+        self.epoch = 0
+        self._cache = {}
+
+    def invalidate(self, hocr_index: HocrIndex = None):
+        """
+        Drops all cached statistics after the tree was changed
+        :param hocr_index: new index of the changed tree, None if no index should be used
+        """
+        self.hocr_index = hocr_index
+        self.epoch += 1
+        self._cache = {}
+
+    def _get(self, name: str, compute):
+        if name not in self._cache:
+            self._cache[name] = compute()
+        return self._cache[name]
+
+    @property
+    def line_height_mean_and_std(self):
+        """
+        Mean and standard deviation of the line heights in all ocr_careas, see average_line_height_and_std
+        """
+        return self._get('line_height', lambda: average_line_height_and_std(self.hocr_tree, self.hocr_index))
+
+    @property
+    def character_area_mean_and_std(self):
+        """
+        Mean and standard deviation of the character widths of all words, see document_average_character_area_and_std
+        """
+        return self._get('character_area', lambda: document_average_character_area_and_std(self.hocr_tree))
+
+    @property
+    def line_distances(self) -> np.array:
+        """
+        Distances between the lines within each ocr_carea, see line_distances_per_ocr_carea
+        """
+        return self._get('line_distances', lambda: line_distances_per_ocr_carea(self.hocr_tree))
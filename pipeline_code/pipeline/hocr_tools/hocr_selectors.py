@@ -0,0 +1,34 @@
+"""
+XPath selectors for hOCR elements that are compiled once at import instead of parsing the expression on every call.
+Each selector is called with the element or tree to search in, e.g., CAREAS(page) instead of
+page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES). The expressions are the same as in the former
+string queries, so the results do not change.
+"""
+from lxml import etree
+from pipeline.constants import NAMESPACES
+
+
+def _compile(path: str) -> etree.XPath:
+    return etree.XPath(path, namespaces=NAMESPACES)
+
+
+# Document level
+BODY = _compile("//x:body")
+DOCUMENT_BODY = _compile("///x:body")
+PAGES = _compile("//x:div[@class='ocr_page']")
+DOCUMENT_PAGES = _compile("///x:div[@class='ocr_page']")
+BODY_PAGES = _compile("///x:body/x:div[@class='ocr_page']")
+BODY_PAGE_CAREAS = _compile("///x:body/x:div[@class='ocr_page']//x:div[@class='ocr_carea']")
+ALL_CAREAS = _compile("//x:div[@class='ocr_carea']")
+
+# Descendants of an element
+DESCENDANT_PAGES = _compile(".//x:div[@class='ocr_page']")
+CAREAS = _compile(".//x:div[@class='ocr_carea']")
+SEPARATORS = _compile(".//x:div[@class='ocr_separator']")
+PARS = _compile(".//x:p[@class='ocr_par']")
+LINES = _compile(".//x:span[@class='ocr_line']")
+TEXT_LINES = _compile(".//x:span[@class='ocr_line' or @class='ocr_textfloat']")
+CHILD_TEXT_LINES = _compile("./x:span[@class='ocr_line' or @class='ocr_textfloat']")
+TEXT_AND_HEADER_LINES = _compile(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']")
+WORDS = _compile(".//x:span[@class='ocrx_word']")
+
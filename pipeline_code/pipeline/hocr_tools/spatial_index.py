@@ -0,0 +1,82 @@
+from collections import defaultdict
+import numpy as np
+from lxml import etree
+from typing import List
+from pipeline.hocr_tools.hocr_helpers import bboxes_overlap
+from pipeline.hocr_tools.hocr_index import HocrIndex
+
+"""
+Uniform grid over bboxes for range queries. Instead of testing every bbox of a page against a query rectangle, only the
+bboxes that share a grid cell with the rectangle are tested.
+"""
+
+
+class BboxGrid:
+    """
+    Buckets bboxes x1, y1, x2, y2 into square grid cells of cell_size pixels. A query returns the ids (row indices of
+    the input array) of all bboxes that overlap the query rectangle with the same inclusive semantics as
+    rectangles_overlap in table_extraction
+    """
+    def __init__(self, bboxes, cell_size: int = 200):
+        self.bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        self.cell_size = cell_size
+        self._cells = defaultdict(list)
+        # Malformed bboxes (x1 > x2 or y1 > y2) cannot be bucketed and are candidates for every query
+        self._unbucketed = []
+        cell_ranges = np.floor(self.bboxes / cell_size).astype(np.int64)
+        for bbox_id, (cx1, cy1, cx2, cy2) in enumerate(cell_ranges.tolist()):
+            if cx1 > cx2 or cy1 > cy2:
+                self._unbucketed.append(bbox_id)
+                continue
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self._cells[(cx, cy)].append(bbox_id)
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def candidates(self, rect) -> np.ndarray:
+        """
+        Returns the sorted ids of all bboxes that share a grid cell with rect
+        """
+        x1, y1, x2, y2 = rect
+        if x1 > x2 or y1 > y2:
+            return np.arange(len(self.bboxes))
+        cx1, cy1, cx2, cy2 = [int(np.floor(coordinate / self.cell_size)) for coordinate in (x1, y1, x2, y2)]
+        bbox_ids = list(self._unbucketed)
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                bbox_ids.extend(self._cells.get((cx, cy), []))
+        return np.unique(np.array(bbox_ids, dtype=np.int64))
+
+    def query(self, rect) -> np.ndarray:
+        """
+        Returns the sorted ids of all bboxes that overlap rect
+        :param rect: x1, y1, x2, y2
+        :return: array of ids
+        """
+        candidate_ids = self.candidates(rect)
+        if len(candidate_ids) == 0:
+            return candidate_ids
+        return candidate_ids[bboxes_overlap(self.bboxes[candidate_ids], rect)]
+
+
+class PageWordIndex:
+    """
+    HocrIndex of an ocr_page together with a BboxGrid over its ocrx_word elements
+    """
+    def __init__(self, ocr_page_element: etree.ElementTree, cell_size: int = 200):
+        self.hocr_index = HocrIndex(ocr_page_element)
+        self.word_rows = self.hocr_index.rows_of_class('ocrx_word')
+        self.word_bboxes = self.hocr_index.bboxes[self.word_rows]
+        self.grid = BboxGrid(self.word_bboxes, cell_size=cell_size)
+
+    def overlapping_word_ids(self, rect) -> np.ndarray:
+        """
+        Returns the ids (rows of word_bboxes) of all words that overlap rect and were not removed through hocr_index
+        """
+        word_ids = self.grid.query(rect)
+        return word_ids[self.hocr_index.alive[self.word_rows[word_ids]]]
+
+    def overlapping_words(self, rect) -> List[etree.ElementTree]:
+        return self.hocr_index.elements(self.word_rows[self.overlapping_word_ids(rect)])
@@ -0,0 +1,204 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+"""
+Lightweight instrumentation of the encoding pipeline. While an instrumentation is started, every instrumented stage
+records its wall time, CPU time (including Tesseract subprocesses), the number of Tesseract calls and the pixel area
+that was passed to Tesseract. Stages can be nested; the metrics of a stage include those of its inner stages and are
+stored under the path of stage names, e.g., "encode_appendix/encode_appendix_tree/encode_table".
+Each thread has its own path of running stages. Work that is submitted to a thread pool is wrapped with
+bind_current_stages, so that it is measured within the stages that submitted it; the times of stages that run in
+several threads at once add up.
+Without a started instrumentation, the stages and counters do nothing.
+"""
+
+
+class PipelineInstrumentation:
+    """
+    Collects the metrics of the stages and free-form counters of one document
+    """
+    def __init__(self, document: str = None):
+        self.document = document
+        self.stages = OrderedDict()
+        self.counters = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._start_time = time.perf_counter()
+
+    @property
+    def _stack(self) -> list:
+        # The running stages of the current thread
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_stages(self) -> tuple:
+        return tuple(self._stack)
+
+    @contextmanager
+    def inherited_stages(self, stages: tuple):
+        """
+        Runs the with block in the current thread as if stages were running, e.g., in a worker thread
+        """
+        previous_stack = self._stack
+        self._local.stack = list(stages)
+        try:
+            yield
+        finally:
+            self._local.stack = previous_stack
+
+    def _stage_metrics(self, path: str) -> dict:
+        if path not in self.stages:
+            self.stages[path] = {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "ocr_calls": 0, "ocr_pixels": 0}
+        return self.stages[path]
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures the code in the with block as stage name within the currently running stages
+        """
+        with self._lock:
+            self._stack.append(name)
+            path = "/".join(self._stack)
+            self._stage_metrics(path)["calls"] += 1
+        start_wall_time = time.perf_counter()
+        start_cpu_time = cpu_time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                metrics = self._stage_metrics(path)
+                metrics["wall_time"] += time.perf_counter() - start_wall_time
+                metrics["cpu_time"] += cpu_time() - start_cpu_time
+                self._stack.pop()
+
+    def record_ocr_call(self, pixels: int):
+        """
+        Adds a Tesseract call on an image with so many pixels to all running stages
+        """
+        with self._lock:
+            for depth in range(1, len(self._stack) + 1):
+                metrics = self._stage_metrics("/".join(self._stack[:depth]))
+                metrics["ocr_calls"] += 1
+                metrics["ocr_pixels"] += pixels
+            self.count("ocr_calls")
+            self.count("ocr_pixels", pixels)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        return {"document": self.document,
+                "wall_time": time.perf_counter() - self._start_time,
+                "stages": {path: dict(metrics) for path, metrics in self.stages.items()},
+                "counters": dict(self.counters)}
+
+    def write_json(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+
+def cpu_time() -> float:
+    """
+    User and system time of this process and its finished child processes, e.g., tesseract called by pytesseract
+    """
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+# One instrumentation per process, like the OCR cache
+_INSTRUMENTATION = None
+
+
+def start_instrumentation(document: str = None) -> PipelineInstrumentation:
+    """
+    Starts a new instrumentation for the current process and returns it
+    :param document: name of the document that is encoded, stored in the metrics
+    """
+    global _INSTRUMENTATION
+    _INSTRUMENTATION = PipelineInstrumentation(document=document)
+    return _INSTRUMENTATION
+
+
+def stop_instrumentation() -> PipelineInstrumentation:
+    """
+    Stops the instrumentation of the current process and returns it with the collected metrics
+    """
+    global _INSTRUMENTATION
+    instrumentation = _INSTRUMENTATION
+    _INSTRUMENTATION = None
+    return instrumentation
+
+
+def get_instrumentation() -> PipelineInstrumentation:
+    return _INSTRUMENTATION
+
+
+@contextmanager
+def instrumented_stage(name: str):
+    """
+    Measures the with block as stage name if an instrumentation is started
+    """
+    if _INSTRUMENTATION is None:
+        yield
+        return
+    with _INSTRUMENTATION.stage(name):
+        yield
+
+
+def instrumented(name: str = None):
+    """
+    Decorator that measures every call of a function as stage, named after the function if name is None
+    """
+    def decorator(function):
+        stage_name = name if name is not None else function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with instrumented_stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind_current_stages(function):
+    """
+    Returns a function that runs function within the stages that are running now, e.g., before it is submitted to a
+    thread pool. Without a started instrumentation, function is returned as it is
+    """
+    instrumentation = _INSTRUMENTATION
+    if instrumentation is None:
+        return function
+    stages = instrumentation.current_stages()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with instrumentation.inherited_stages(stages):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def record_ocr_call(image):
+    """
+    Counts a Tesseract call on image for the running stages
+    """
+    if _INSTRUMENTATION is not None:
+        width, height = image.size
+        _INSTRUMENTATION.record_ocr_call(width * height)
+
+
+def count(name: str, value: int = 1):
+    """
+    Adds value to a counter of the started instrumentation
+    """
+    if _INSTRUMENTATION is not None:
+        _INSTRUMENTATION.count(name, value)
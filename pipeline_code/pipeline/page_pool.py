@@ -0,0 +1,107 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from lxml import etree
+from pipeline.instrumentation import bind_current_stages
+
+"""
+Pool for the page-local work of a single document, e.g., the resegmentation, the header extraction and the re-OCR of
+the careas of a page. The pages of a document are parts of the same lxml tree, which cannot be passed to other
+processes, and most of the time of a page is spent in Tesseract, which runs outside the GIL (as subprocess of
+pytesseract or in tesserocr). Therefore, the pages are processed in threads.
+Only the work on one page may run in a task. Everything that depends on other pages, like the body structure, stays
+sequential and uses the results in page order, so the encoding is the same as without a pool.
+lxml does not support changes to one document from several threads, so tasks that work on the ocr_page elements of a
+document run through map_page_elements, which moves each page into a document of its own while its task runs. Images
+are only cropped in the thread that owns them: a page image that was opened lazily with Image.open decodes its file on
+the first access, which is not thread-safe.
+"""
+
+
+class PagePool:
+    """
+    Runs one task per page in max_workers threads. With max_workers <= 1, the tasks run directly in the calling thread
+    """
+    def __init__(self, max_workers: int = 0):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='page') \
+            if max_workers > 1 else None
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        """
+        Starts function(*args, **kwargs) and returns its future
+        """
+        if self._executor is not None:
+            return self._executor.submit(bind_current_stages(function), *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def map(self, function, *iterables) -> list:
+        """
+        Applies function to the arguments of each page and returns the results in page order. If a task fails, the
+        exception of the first failed page is raised after all tasks finished
+        """
+        if self._executor is None:
+            return [function(*args) for args in zip(*iterables)]
+        futures = [self.submit(function, *args) for args in zip(*iterables)]
+        # Wait for all pages, so that no task changes the tree after an exception was raised
+        for future in futures:
+            future.exception()
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+def map_pages(function, *iterables, page_pool: PagePool = None) -> list:
+    """
+    Applies function to the arguments of each page, in page_pool if it is given and sequentially otherwise
+    """
+    if page_pool is None:
+        return [function(*args) for args in zip(*iterables)]
+    return page_pool.map(function, *iterables)
+
+
+def map_page_elements(function, pages, *iterables, page_pool: PagePool = None) -> list:
+    """
+    Applies function(page, *args) to each ocr_page element and the arguments of the page, see map_pages. In a pool,
+    every page is moved into a document of its own before the tasks start and moved back to its position after all
+    tasks finished, so that the tasks can change their pages without sharing a document
+    :param function: function of one page, which may change the page
+    :param pages: ocr_page elements, e.g., of one hOCR document
+    :param iterables: further arguments per page
+    :param page_pool: If given, the pages are processed in this pool
+    :return: the results in page order
+    """
+    if page_pool is None or page_pool.max_workers <= 1:
+        return map_pages(function, pages, *iterables)
+    placeholders = [detach_page_element(page) for page in pages]
+    try:
+        return page_pool.map(function, pages, *iterables)
+    finally:
+        for page, placeholder in zip(pages, placeholders):
+            if placeholder is not None:
+                placeholder.getparent().replace(placeholder, page)
+
+
+def detach_page_element(page):
+    """
+    Moves page into a new document whose root has the namespaces of its parent and leaves a placeholder at its position
+    :return: the placeholder, None if page is the root of its document already
+    """
+    parent = page.getparent()
+    if parent is None:
+        return None
+    placeholder = etree.Element('page_placeholder')
+    page.addprevious(placeholder)
+    etree.Element(parent.tag, nsmap=parent.nsmap).append(page)
+    return placeholder
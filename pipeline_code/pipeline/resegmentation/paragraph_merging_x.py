@@ -1,9 +1,11 @@
 from lxml import etree
+import heapq
+from typing import List
 import numpy as np
 from ..hocr_tools.hocr_properties import carea_contins_only_empty_words
 from ..constants import NAMESPACES
-from pipeline.hocr_tools.hocr_helpers import ocr_elements_overlap_horizontally, get_element_bbox, \
-    remove_element_from_hocr_tree
+from pipeline.hocr_tools.hocr_helpers import get_element_bboxes, remove_element_from_hocr_tree
+from pipeline.page_pool import PagePool, map_page_elements
 
 
 # I will check for horizontally overlapping careas.
@@ -12,43 +14,94 @@ from pipeline.hocr_tools.hocr_helpers import ocr_elements_overlap_horizontally,
 # After all elements have been expanded, all left elements that were involved, are removed
 
 
-def merge_careas_on_x_axis_in_document_tree(hocr_tree: etree.ElementTree, max_area_dist: float = 50):
+def merge_careas_on_x_axis_in_document_tree(hocr_tree: etree.ElementTree, max_area_dist: float = 50,
+                                            page_pool: PagePool = None):
     """
     For each page all careas witihn the same height that are at most max_area_dist apart are merged
     :param hocr_tree: ElementTree in which the careas are merged
     :param max_area_dist: maximum distance between two carea at the same height
+    :param page_pool: If given, the careas of the pages are merged in this pool
     :return:
     """
     # TODO Funktion, um max_area_dist dynamisch zu berechnen
     pages = hocr_tree.xpath("///x:div[@class='ocr_page']", namespaces=NAMESPACES)
     merged_in_careas = []
-    for page_idx in range(len(pages)):
-        page = pages[page_idx]
-        careas = page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
-        careas.sort(key=lambda x: get_element_bbox(x)[0])
-        for area in careas:
-            for other_area in careas[careas.index(area) + 1:]:
-                if ocr_elements_overlap_horizontally(area, other_area) and \
-                        not carea_contins_only_empty_words(area) and \
-                        not carea_contins_only_empty_words(other_area):
-                    a_x1, a_y1, a_x2, a_y2 = get_element_bbox(area)
-                    b_x1, b_y1, b_x2, b_y2 = get_element_bbox(other_area)
-                    if a_x2 <= b_x2:
-                        left_area = area
-                        right_area = other_area
-                    else:
-                        left_area = other_area
-                        right_area = area
-                    area_distance = min([np.abs(a_x1 - b_x2), np.abs(a_x2 - b_x1)])
-                    if area_distance < max_area_dist or a_x1 <= b_x1 <= a_x2 or b_x1 <= a_x1 <= b_x2 or \
-                            a_x1 <= b_x2 <= a_x2 or b_x1 <= a_x2 <= b_x2:
-                        left_bbox = get_element_bbox(left_area)
-                        right_bbox = get_element_bbox(right_area)
-                        x1 = min([a_x1, b_x1])
-                        y1 = right_bbox[1]  # min([a_y1, b_y1])  # right_bbox[1]
-                        x2 = max([a_x2, b_x2])
-                        y2 = right_bbox[3]  # max([a_y2, b_y2])  # right_bbox[3]
-                        right_area.set("title", f"bbox {x1} {y1} {x2} {y2}")
-                        merged_in_careas.append(left_area)
+    for page_merged_in_careas in map_page_elements(
+            lambda page: merge_careas_on_x_axis(page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES),
+                                                max_area_dist=max_area_dist), pages, page_pool=page_pool):
+        merged_in_careas.extend(page_merged_in_careas)
     for area in merged_in_careas:
         remove_element_from_hocr_tree(area)
+
+
+def merge_careas_on_x_axis(careas: List[etree.ElementTree], max_area_dist: float = 50) -> List[etree.ElementTree]:
+    """
+    Compares all pairs of careas on one page that overlap on the y-axis in the order of their x1 values. If two careas
+    are close enough on the x-axis, the right one is expanded over both.
+    Only the x coordinates change while merging, so the pairs that overlap on the y-axis are found once with a sweep
+    over the y-ranges. The bboxes and the emptiness of each carea are computed once as well.
+    :param careas: careas of one page
+    :param max_area_dist: maximum distance between two carea at the same height
+    :return: the left careas that were merged into other careas and still need to be removed from the tree
+    """
+    if len(careas) < 2:
+        return []
+    bboxes = get_element_bboxes(careas)
+    # Stable like sorted, so that careas with the same x1 keep their order
+    x1_order = np.argsort(bboxes[:, 0], kind='stable')
+    careas = [careas[carea_idx] for carea_idx in x1_order]
+    bboxes = bboxes[x1_order]
+    x1s, y1s, x2s, y2s = [bboxes[:, i].tolist() for i in range(4)]
+    is_empty = [carea_contins_only_empty_words(carea) for carea in careas]
+
+    merged_in_careas = []
+    for area_idx, other_area_indices in enumerate(get_y_overlapping_pairs(y1s, y2s)):
+        if is_empty[area_idx]:
+            continue
+        for other_area_idx in other_area_indices:
+            a_y1, a_y2 = y1s[area_idx], y2s[area_idx]
+            b_y1, b_y2 = y1s[other_area_idx], y2s[other_area_idx]
+            # Same check as in ocr_elements_overlap_horizontally
+            if not (a_y1 <= b_y1 <= a_y2 or a_y1 <= b_y2 <= a_y2 or b_y1 <= a_y1 <= b_y2 or b_y1 <= a_y2 <= b_y2) or \
+                    is_empty[other_area_idx]:
+                continue
+            a_x1, a_x2 = x1s[area_idx], x2s[area_idx]
+            b_x1, b_x2 = x1s[other_area_idx], x2s[other_area_idx]
+            if a_x2 <= b_x2:
+                left_idx = area_idx
+                right_idx = other_area_idx
+            else:
+                left_idx = other_area_idx
+                right_idx = area_idx
+            area_distance = min([np.abs(a_x1 - b_x2), np.abs(a_x2 - b_x1)])
+            if area_distance < max_area_dist or a_x1 <= b_x1 <= a_x2 or b_x1 <= a_x1 <= b_x2 or \
+                    a_x1 <= b_x2 <= a_x2 or b_x1 <= a_x2 <= b_x2:
+                x1 = min([a_x1, b_x1])
+                x2 = max([a_x2, b_x2])
+                x1s[right_idx] = x1
+                x2s[right_idx] = x2
+                careas[right_idx].set("title", f"bbox {x1} {y1s[right_idx]} {x2} {y2s[right_idx]}")
+                merged_in_careas.append(careas[left_idx])
+    return merged_in_careas
+
+
+def get_y_overlapping_pairs(y1s: List[int], y2s: List[int]) -> List[List[int]]:
+    """
+    Sweeps over the y-ranges and finds all pairs of ranges that overlap (including touching ranges)
+    :param y1s: lower bounds of the ranges
+    :param y2s: upper bounds of the ranges
+    :return: for each range i, the sorted indices j > i of all ranges that overlap with range i
+    """
+    lower_bounds = [min(y1, y2) for y1, y2 in zip(y1s, y2s)]
+    upper_bounds = [max(y1, y2) for y1, y2 in zip(y1s, y2s)]
+    overlapping = [[] for _ in range(len(y1s))]
+    active = []  # Heap of (upper bound, index) of all ranges that started before the current one
+    for idx in sorted(range(len(y1s)), key=lambda i: lower_bounds[i]):
+        while active and active[0][0] < lower_bounds[idx]:
+            heapq.heappop(active)
+        for _, other_idx in active:
+            overlapping[min(idx, other_idx)].append(max(idx, other_idx))
+        heapq.heappush(active, (upper_bounds[idx], idx))
+    for other_indices in overlapping:
+        other_indices.sort()
+    return overlapping
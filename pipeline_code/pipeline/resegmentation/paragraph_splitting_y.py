@@ -1,86 +1,107 @@
 from lxml import etree
-import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.cluster import KMeans
-from ..constants import NAMESPACES
+from typing import List
+from pipeline.hocr_tools.hocr_selectors import BODY_PAGES, BODY_PAGE_CAREAS, CAREAS, CHILD_TEXT_LINES, PARS, \
+    TEXT_AND_HEADER_LINES, TEXT_LINES
 from pipeline.hocr_tools.hocr_helpers import get_element_bbox, get_surrounding_bbox
-from ..hocr_tools.hocr_properties import carea_contins_only_empty_words
+from ..hocr_tools.hocr_properties import carea_contins_only_empty_words, line_distances_per_ocr_carea, DocumentStats
+from pipeline.page_pool import PagePool, map_page_elements
 
 """
 This is the main part responsible for splitting the paragraphs
 """
 
 
-def split_ocr_careas_horizontally(hocr_tree: etree.ElementTree, max_line_space: int = None):
+def split_ocr_careas_horizontally(hocr_tree: etree.ElementTree, max_line_space: int = None,
+                                  document_stats: DocumentStats = None, page_pool: PagePool = None,
+                                  pages: List[etree.ElementTree] = None):
     """
     Takes an hOCR tree and splits all ocr_careas into multiple new ones depending on the distances between lines
     with ocr_careas
     :param hocr_tree: parsed hOCR tree that will be split in place
     :param max_line_space:  maximum space before areas are split
-    :return:
+    :param document_stats: statistics of hocr_tree that are used to compute the maximum line space and invalidated after
+    the split
+    :param page_pool: If given, the pages are split in this pool
+    :param pages: If given, only the careas of these pages of hocr_tree are split and re-merged
+    :return: the maximum line space that was used, < 0 if the careas were not split
     """
     if max_line_space is None:
-        max_line_dist = compute_maximum_linespace(hocr_tree)
+        max_line_dist = compute_maximum_linespace(hocr_tree, document_stats=document_stats)
         if max_line_dist < 0:
-            return
+            return max_line_dist
     else:
         max_line_dist = max_line_space
-    ocr_pages = hocr_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
-    for page in ocr_pages:
-        careas = page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
-        for carea in careas:
-            carea_parent = carea.getparent()
-            pars = carea.xpath(".//x:p[@class='ocr_par']", namespaces=NAMESPACES)
-            changed = False
-            for par in pars:
-                lines = par.xpath("./x:span[@class='ocr_line' or @class='ocr_textfloat']", namespaces=NAMESPACES)
-                if lines:
-                    changed = True
-                    new_carea = etree.Element("{http://www.w3.org/1999/xhtml}div")
-                    new_carea.set("class", "ocr_carea")
-                    new_p = etree.Element("{http://www.w3.org/1999/xhtml}p")
-                    new_p.set("class", "ocr_par")
-                    # The first new paragraph starts with the first line
-                    new_p.append(lines[0])
-                    for i in range(1, len(lines)):
-                        _, _, _, y2_prev = get_element_bbox(lines[i-1])
-                        _, y1, _, _ = get_element_bbox(lines[i])
-                        # Compute the line distance
-                        if abs(y1 - y2_prev) <= max_line_dist:
-                            # If the lines are close enough to each other, combine them into the same paragraph
-                            new_p.append(lines[i])
-                        else:
-                            # Otherwise, create the next paragraph
-                            # Append the new par to the new carea
-                            new_carea.append(new_p)
-                            # Set the title attribute
-                            x1, y1, x2, y2 = get_surrounding_bbox(new_p.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat']", namespaces=NAMESPACES))
-                            new_p.set("title", f"bbox {x1} {y1} {x2} {y2}")
-                            new_carea.set("title", f"bbox {x1} {y1} {x2} {y2}")
+    if pages is None:
+        pages = BODY_PAGES(hocr_tree)
+    # The careas of each page are split independently, only the re-merging below runs across pages
+    map_page_elements(lambda page: split_page_careas(page, max_line_dist), pages, page_pool=page_pool)
+    # This will re-combine areas that were split but should be in one area
+    remerge_oversplit_careas(hocr_tree, max_line_dist=max_line_dist, pages=pages)
+    if document_stats is not None:
+        document_stats.invalidate()
+    return max_line_dist
 
-                            # Add elements in front of the current area to keep the ordering
-                            carea.addprevious(new_carea)
 
-                            # Create the next new carea and paragraph
-                            new_carea = etree.Element("{http://www.w3.org/1999/xhtml}div")
-                            new_carea.set("class", "ocr_carea")
-                            new_p = etree.Element("{http://www.w3.org/1999/xhtml}p")
-                            new_p.set("class", "ocr_par")
+def split_page_careas(page: etree.ElementTree, max_line_dist):
+    """
+    Splits the ocr_careas of one page where the distance between two lines is larger than max_line_dist
+    :param page: ocr_page element that is split in place
+    :param max_line_dist: maximum space between the lines of one carea
+    :return:
+    """
+    careas = CAREAS(page)
+    for carea in careas:
+        carea_parent = carea.getparent()
+        pars = PARS(carea)
+        changed = False
+        for par in pars:
+            lines = CHILD_TEXT_LINES(par)
+            if lines:
+                changed = True
+                new_carea = etree.Element("{http://www.w3.org/1999/xhtml}div")
+                new_carea.set("class", "ocr_carea")
+                new_p = etree.Element("{http://www.w3.org/1999/xhtml}p")
+                new_p.set("class", "ocr_par")
+                # The first new paragraph starts with the first line
+                new_p.append(lines[0])
+                for i in range(1, len(lines)):
+                    _, _, _, y2_prev = get_element_bbox(lines[i-1])
+                    _, y1, _, _ = get_element_bbox(lines[i])
+                    # Compute the line distance
+                    if abs(y1 - y2_prev) <= max_line_dist:
+                        # If the lines are close enough to each other, combine them into the same paragraph
+                        new_p.append(lines[i])
+                    else:
+                        # Otherwise, create the next paragraph
+                        # Append the new par to the new carea
+                        new_carea.append(new_p)
+                        # Set the title attribute
+                        x1, y1, x2, y2 = get_surrounding_bbox(TEXT_LINES(new_p))
+                        new_p.set("title", f"bbox {x1} {y1} {x2} {y2}")
+                        new_carea.set("title", f"bbox {x1} {y1} {x2} {y2}")
 
-                            new_p.append(lines[i])
-                    # After the for loop, the paragraph still needs to be added to the tree
-                    new_carea.append(new_p)
-                    x1, y1, x2, y2 = get_surrounding_bbox(new_p.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat']", namespaces=NAMESPACES))
-                    new_p.set("title", f"bbox {x1} {y1} {x2} {y2}")
-                    new_carea.set("title", f"bbox {x1} {y1} {x2} {y2}")
-                    # After that, the original par needs to be removed
-                    par_parent = par.getparent()
-                    par_parent.remove(par)
-                    carea.addprevious(new_carea)
-            if changed:
-                carea_parent.remove(carea)  # If an ocr_carea was split, the parent is removed
-    # This will re-combine areas that were split but should be in one area
-    remerge_oversplit_careas(hocr_tree, max_line_dist=max_line_dist)
+                        # Add elements in front of the current area to keep the ordering
+                        carea.addprevious(new_carea)
+
+                        # Create the next new carea and paragraph
+                        new_carea = etree.Element("{http://www.w3.org/1999/xhtml}div")
+                        new_carea.set("class", "ocr_carea")
+                        new_p = etree.Element("{http://www.w3.org/1999/xhtml}p")
+                        new_p.set("class", "ocr_par")
+
+                        new_p.append(lines[i])
+                # After the for loop, the paragraph still needs to be added to the tree
+                new_carea.append(new_p)
+                x1, y1, x2, y2 = get_surrounding_bbox(TEXT_LINES(new_p))
+                new_p.set("title", f"bbox {x1} {y1} {x2} {y2}")
+                new_carea.set("title", f"bbox {x1} {y1} {x2} {y2}")
+                # After that, the original par needs to be removed
+                par_parent = par.getparent()
+                par_parent.remove(par)
+                carea.addprevious(new_carea)
+        if changed:
+            carea_parent.remove(carea)  # If an ocr_carea was split, the parent is removed
 
 
 def combine_careas(carea_1, carea_2):
@@ -92,15 +113,15 @@ def combine_careas(carea_1, carea_2):
     :return:
     """
     # Move lines from carea_2 to carea_1
-    pars = carea_1.xpath(".//x:p[@class='ocr_par']", namespaces=NAMESPACES)
+    pars = PARS(carea_1)
     if len(pars) > 0:
         elem_to_append_on = pars[0]
     else:
         elem_to_append_on = carea_1
-    for line in carea_2.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']", namespaces=NAMESPACES):
+    for line in TEXT_AND_HEADER_LINES(carea_2):
         elem_to_append_on.append(line)
     # Build the new bbox
-    new_lines = carea_1.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']", namespaces=NAMESPACES)
+    new_lines = TEXT_AND_HEADER_LINES(carea_1)
     try:
         x1, y1, x2, y2 = get_surrounding_bbox(new_lines)
         carea_1.set("title", f"bbox {x1} {y1} {x2} {y2}")
@@ -113,19 +134,20 @@ def combine_careas(carea_1, carea_2):
         parent.remove(carea_2)
 
 
-def remerge_oversplit_careas(hocr_tree: etree.ElementTree, max_line_dist):
+def remerge_oversplit_careas(hocr_tree: etree.ElementTree, max_line_dist, pages: List[etree.ElementTree] = None):
     """
     Merges ocr_careas that should not have been split but was by the OCR engine.
     If an ocr_carea in the hocr_tree ends with an "-", it will be merged with the upcoming carea
     :param hocr_tree: hOCR tree that will be remerged in place
     :param max_line_dist: The maximum line distance where careas will be combined if they are that close to each other
+    :param pages: If given, only the careas of these pages are merged, all pages of the body if None
     :return:
     """
     # Verursacht z.T. Fehler: bbbox über gesamte Seite...
     #  1. Sicherstellen, dass die careas untereinander und nicht übereinander sind (Das später abfangen im
     #  fertigen Dokument
     #  2. Die line split distance nutzen und dann alles, was näher beisammen ist, mergen
-    careas = hocr_tree.xpath("///x:body/x:div[@class='ocr_page']//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+    careas = BODY_PAGE_CAREAS(hocr_tree) if pages is None else [carea for page in pages for carea in CAREAS(page)]
     carea_idx = 0
     while carea_idx < len(careas) - 1:
         upper_carea = get_element_bbox(careas[carea_idx])
@@ -171,39 +193,78 @@ def get_line_distances_per_ocr_carea(hocr_tree: etree.ElementTree) -> np.array:
     :param hocr_tree:
     :return:
     """
-    ocr_careas = hocr_tree.xpath("///x:body/x:div[@class='ocr_page']//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
-    line_distances = []
-    for ocr_carea in ocr_careas:
-        lines = ocr_carea.xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat']", namespaces=NAMESPACES)
-        for i in range(1, len(lines)):
-            _, _, _, prev_y2 = get_element_bbox(lines[i-1])
-            _, y1, _, _ = get_element_bbox(lines[i])
-            if y1 > prev_y2:
-                line_distances.append(y1 - prev_y2)
-    return np.array(line_distances).reshape(-1, 1)
+    return line_distances_per_ocr_carea(hocr_tree)
 
 
-def compute_maximum_linespace(hocr_tree: etree.ElementTree, plot_clusters: bool = False) -> float:
+def two_means_labels_1d(data: np.ndarray) -> np.ndarray:
+    """
+    Computes the optimal split of scalar data into two clusters with the minimal sum of squared distances to the
+    cluster means. In 1-D the clusters of an optimal split are intervals of the sorted data, so all splits between two
+    distinct values are evaluated at once with prefix sums.
+    :param data: scalar data, e.g., with shape (n, 1)
+    :return: label per data point, 0 for the lower and 1 for the upper cluster. All labels are 0 if there are less than
+    two distinct values
+    """
+    values = np.asarray(data, dtype=np.float64).reshape(-1)
+    labels = np.zeros(len(values), dtype=np.int64)
+    sorted_values = np.sort(values)
+    # Splits are only possible between distinct values, split_idx is the number of values in the lower cluster
+    split_indices = np.flatnonzero(sorted_values[1:] != sorted_values[:-1]) + 1
+    if len(split_indices) == 0:
+        return labels
+    prefix_sums = np.cumsum(sorted_values)
+    total_sum = prefix_sums[-1]
+    lower_sums = prefix_sums[split_indices - 1]
+    lower_counts = split_indices.astype(np.float64)
+    upper_counts = len(values) - lower_counts
+    # The sum of squared distances is minimal where the weighted squared means are maximal
+    scores = lower_sums ** 2 / lower_counts + (total_sum - lower_sums) ** 2 / upper_counts
+    split_idx = split_indices[np.argmax(scores)]
+    labels[values > sorted_values[split_idx - 1]] = 1
+    return labels
+
+
+def compute_maximum_linespace(hocr_tree: etree.ElementTree, plot_clusters: bool = False,
+                              clustering_method: str = 'exact', document_stats: DocumentStats = None) -> float:
     """
     Takes line distances to find the maximum distance two lines can have within the same paragraph.
-    The procedure uses k-Means with k=2 and then takes the highest point of the lower cluster as maximum line width.
+    The procedure uses 2-Means and then takes the highest point of the lower cluster as maximum line width.
     This was chosen due to the observation that there are often two centers of mass
     :param hocr_tree: Parsed hOCR ElementTree which the maximum line distance of a cluster is computed
     :param plot_clusters: boolean that tests if the labels should be plotted
-    :return: maximum distance two lines can have within the same paragraph
+    :param clustering_method: 'exact' for the optimal split computed by two_means_labels_1d or 'kmeans' for the
+    k-Means of scikit-learn as reference
+    :param document_stats: If not None, the line distances are taken from these statistics of hocr_tree
+    :return: maximum distance two lines can have within the same paragraph, -1 if there are fewer than two line
+    distances (before or after the outlier filtering) instead of raising an error. If all line distances are equal,
+    they form one cluster and their value is returned
     """
     # Setup line distances and filter outliers
-    line_distances = filter_iqr(get_line_distances_per_ocr_carea(hocr_tree))
+    if document_stats is not None:
+        line_distances = document_stats.line_distances
+    else:
+        line_distances = get_line_distances_per_ocr_carea(hocr_tree)
+    # The percentiles of filter_iqr are not defined without line distances
+    if len(line_distances) < 2:
+        return -1
+    line_distances = filter_iqr(line_distances)
     if len(line_distances) < 2:
         return -1
     # Specify the number of labels
     num_clusters = 2  # Two labels because the observation was that there are 2 centers of mass
-    kmeans = KMeans(n_clusters=num_clusters, n_init='auto')
-    cluster_labels = kmeans.fit_predict(line_distances)
+    if clustering_method == 'exact':
+        cluster_labels = two_means_labels_1d(line_distances)
+    elif clustering_method == 'kmeans':
+        from sklearn.cluster import KMeans
+        kmeans = KMeans(n_clusters=num_clusters, n_init='auto')
+        cluster_labels = kmeans.fit_predict(line_distances)
+    else:
+        raise ValueError(f"Unknown clustering method {clustering_method}")
     # Initialize a list to store filtered data for each cluster
     filtered_data_per_cluster = []
     # Filter smaller outliers from the labels to improve results
-    for i in range(num_clusters):
+    # If all line distances are equal, there is only one cluster
+    for i in np.unique(cluster_labels):
         # Get data points belonging to the current cluster
         cluster_data = line_distances[cluster_labels == i]
         # Calculate the first and third quartiles
@@ -230,6 +291,8 @@ def compute_maximum_linespace(hocr_tree: etree.ElementTree, plot_clusters: bool
     max_line_dist = max_lower_cluster_value  # max_lower_cluster_value + ((min_upper_cluster_value - max_lower_cluster_value) / 2)
 
     if plot_clusters:
+        # Plotting backends are only imported when needed to keep the pipeline import light
+        import matplotlib.pyplot as plt
         # Creating a figure with subplots
         fig, (ax1, ax2) = plt.subplots(nrows=2, ncols=1, figsize=(10, 10))
 
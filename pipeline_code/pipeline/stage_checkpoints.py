@@ -0,0 +1,135 @@
+"""
+Checkpoints of the intermediate artefacts of the encoding stages. After a stage has run, the artefacts it produced are
+written to its own directory in the checkpoint directory, so that a later run can resume from any stage without
+recomputing (and re-OCRing) the stages before it.
+Artefacts are serialised by their type:
+- hOCR trees as .hocr files
+- single elements (e.g., the teiHeader or the encoded body) as .xml files
+- lists of element lists (e.g., the headers of each page) as one .xml file with one <list> per page
+- page images as one PNG per page in a directory
+- plain values and lists of plain values as JSON in the manifest, NumPy scalars as the equal Python values
+The manifest is written last, so a stage directory without a manifest is an incomplete checkpoint and is ignored.
+Values of any other type raise a TypeError instead of being written in a form that cannot be read back.
+"""
+import json
+import os
+import shutil
+import numpy as np
+from lxml import etree
+from PIL import Image
+from pipeline.tei_encoding.page_images import MappedPageImage, PageImageProvider, as_pil_image
+
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class StageCheckpoints:
+    """
+    Stores the artefacts of each stage in checkpoint_dir/<stage index>_<stage name>
+    """
+    def __init__(self, checkpoint_dir: str):
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def stage_dir(self, stage_idx: int, stage_name: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{stage_idx:02d}_{stage_name}")
+
+    def has_stage(self, stage_idx: int, stage_name: str) -> bool:
+        return os.path.exists(os.path.join(self.stage_dir(stage_idx, stage_name), MANIFEST_FILE))
+
+    def save(self, stage_idx: int, stage_name: str, artefacts: dict):
+        """
+        Writes the artefacts of a stage and replaces an older checkpoint of the same stage
+        :param stage_idx: position of the stage in the pipeline
+        :param stage_name: name of the stage
+        :param artefacts: name and value of each artefact
+        """
+        stage_dir = self.stage_dir(stage_idx, stage_name)
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        os.makedirs(stage_dir)
+        manifest = {}
+        for name, value in artefacts.items():
+            manifest[name] = save_artefact(os.path.join(stage_dir, name), value)
+        with open(os.path.join(stage_dir, MANIFEST_FILE), 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    def load(self, stage_idx: int, stage_name: str, names=None) -> dict:
+        """
+        Reads the artefacts of a stage
+        :param stage_idx: position of the stage in the pipeline
+        :param stage_name: name of the stage
+        :param names: names of the artefacts to read, all if None
+        :return: name and value of each artefact
+        """
+        if not self.has_stage(stage_idx, stage_name):
+            raise ValueError(f"No checkpoint of stage '{stage_name}' in '{self.checkpoint_dir}'")
+        stage_dir = self.stage_dir(stage_idx, stage_name)
+        with open(os.path.join(stage_dir, MANIFEST_FILE), encoding='utf-8') as manifest_file:
+            manifest = json.load(manifest_file)
+        return {name: load_artefact(os.path.join(stage_dir, name), manifest[name])
+                for name in manifest if names is None or name in names}
+
+
+def save_artefact(path: str, value) -> dict:
+    """
+    Writes value to path (plus a file extension) and returns its manifest entry
+    """
+    if isinstance(value, etree._ElementTree):
+        value.write(path + '.hocr', encoding='utf-8', xml_declaration=True)
+        return {'kind': 'hocr_tree'}
+    if isinstance(value, etree._Element):
+        with open(path + '.xml', 'wb') as xml_file:
+            xml_file.write(etree.tostring(value, encoding='utf-8'))
+        return {'kind': 'element'}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {'kind': 'value', 'value': value}
+    # Sequences of plain values (e.g., statistics) are stored as JSON lists
+    if isinstance(value, (list, tuple)) and \
+            all(isinstance(item, (bool, int, float, str, np.generic)) for item in value):
+        return {'kind': 'value', 'value': [item.item() if isinstance(item, np.generic) else item for item in value]}
+    if isinstance(value, list) and all(isinstance(element_list, list) for element_list in value):
+        with open(path + '.xml', 'wb') as xml_file:
+            xml_file.write(b"<lists>")
+            for element_list in value:
+                xml_file.write(b"<list>")
+                for element in element_list:
+                    xml_file.write(etree.tostring(element, encoding='utf-8', with_tail=False))
+                xml_file.write(b"</list>")
+            xml_file.write(b"</lists>")
+        return {'kind': 'element_lists'}
+    if isinstance(value, PageImageProvider) or \
+            (isinstance(value, (list, tuple)) and all(isinstance(image, (Image.Image, MappedPageImage))
+                                                      for image in value)):
+        os.makedirs(path)
+        for page_idx in range(len(value)):
+            as_pil_image(value[page_idx]).save(os.path.join(path, f"page_{page_idx:05d}.png"))
+        return {'kind': 'images', 'pages': len(value)}
+    raise TypeError(f"Cannot save artefact '{os.path.basename(path)}' of type {type(value).__name__}")
+
+
+def load_artefact(path: str, manifest_entry: dict):
+    """
+    Reads an artefact that was written with save_artefact
+    """
+    kind = manifest_entry['kind']
+    if kind == 'value':
+        return manifest_entry['value']
+    if kind == 'hocr_tree':
+        return etree.parse(path + '.hocr')
+    if kind == 'element':
+        return etree.parse(path + '.xml').getroot()
+    if kind == 'element_lists':
+        element_lists = []
+        for list_element in etree.parse(path + '.xml').getroot():
+            elements = list(list_element)
+            # The elements are detached from the wrapper to be in the same state as when they were saved
+            for element in elements:
+                list_element.remove(element)
+            element_lists.append(elements)
+        return element_lists
+    if kind == 'images':
+        return PageImageProvider([os.path.join(path, f"page_{page_idx:05d}.png")
+                                  for page_idx in range(manifest_entry['pages'])])
+    raise ValueError(f"Unknown checkpoint artefact kind '{kind}'")
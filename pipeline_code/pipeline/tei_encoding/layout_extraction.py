@@ -1,22 +1,27 @@
 from lxml import etree
-from PIL import Image
+from pipeline.tei_encoding.page_images import mask_page_regions
 import os
 from typing import List, Tuple
 from copy import deepcopy
 import numpy as np
 import re
 
-from pipeline.constants import NAMESPACES
+from pipeline.hocr_tools.hocr_selectors import BODY_PAGES, CAREAS, DESCENDANT_PAGES, PARS, SEPARATORS, \
+    TEXT_AND_HEADER_LINES, WORDS
 from pipeline.hocr_tools.hocr_helpers import get_element_bbox, combine_hocr_pages, ocr_elements_overlap_horizontally, \
     get_surrounding_bbox, build_ocr_carea_text, remove_element_from_hocr_tree
 from pipeline.hocr_tools.hocr_properties import carea_contains_only_header, ocr_element_is_centered, \
-    ocr_word_is_empty, average_line_height_and_std, carea_has_average_line_height
+    ocr_word_is_empty, average_line_height_and_std, carea_has_average_line_height, DocumentStats
 from pipeline.pipeline_logger import file_logger
+from pipeline.page_pool import PagePool, map_pages, map_page_elements
+from pipeline.tei_encoding.ocr_engine import get_engine_pool
 
 
 # DOCUMENT LEVEL
 def remove_pre_text_elements(hocr_tree: etree.ElementTree,
-                             logger=None):
+                             logger=None,
+                             document_stats: DocumentStats = None,
+                             line_height_mean_and_std: Tuple[float, float] = None):
     """
     Takes an hOCR ElementTree as input and removes any element before the title. The title is defined by these
     properties:
@@ -25,16 +30,25 @@ def remove_pre_text_elements(hocr_tree: etree.ElementTree,
     - It has close to average line height
     :param logger:
     :param hocr_tree:
+    :param document_stats: statistics of hocr_tree that provide the line heights and are invalidated if elements are
+    removed
+    :param line_height_mean_and_std: If given, these line heights are used instead of the ones of hocr_tree, e.g., from
+    the first pass over the document
     :return:
     """
     if logger is None:
         logger = file_logger()
-    avg_l_h, std_l_h = average_line_height_and_std(hocr_tree)
+    if line_height_mean_and_std is not None:
+        avg_l_h, std_l_h = line_height_mean_and_std
+    elif document_stats is not None:
+        avg_l_h, std_l_h = document_stats.line_height_mean_and_std
+    else:
+        avg_l_h, std_l_h = average_line_height_and_std(hocr_tree)
     page_idx = 0
     removed_elements = 0
-    for page in hocr_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES):
+    for page in BODY_PAGES(hocr_tree):
         page_idx += 1
-        careas = hocr_tree.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+        careas = CAREAS(hocr_tree)
         for carea in careas:
             carea_lines = build_ocr_carea_text(carea)
             if len(carea_lines) >= 1 and carea_lines[0] == 'Verordnung' or \
@@ -42,49 +56,78 @@ def remove_pre_text_elements(hocr_tree: etree.ElementTree,
                      and carea_has_average_line_height(carea, avg_l_h, std_l_h)):  #  and carea_lines[1].split(" ")[0] == 'über')
                 logger.info(f"Stopped removing elements at page {page_idx} and removed {removed_elements} elements")
                 logger.info(f"First lines of the document are now: {carea_lines}")
+                if removed_elements > 0 and document_stats is not None:
+                    document_stats.invalidate()
                 return
             else:
                 carea.getparent().remove(carea)
                 removed_elements += 1
+    if removed_elements > 0 and document_stats is not None:
+        document_stats.invalidate()
 
 
 def remove_empty_careas(hocr_tree: etree.ElementTree,
-                        images) -> etree.ElementTree:
+                        images, page_pool: PagePool = None) -> List[int]:
     """
     Removes all careas that contain only the empty word from an hOCR tree.
     The area of the bounding box is whitened in the image
     :param hocr_tree: hOCR tree
     :param images: list of images of the pages
-    :return:
+    :param page_pool: If given, the pages are processed in this pool
+    :return: indices of the pages whose image was changed
     """
-    pages = hocr_tree.xpath(".//x:div[@class='ocr_page']", namespaces=NAMESPACES)
-    for page_idx in range(len(pages)):
-        page = pages[page_idx]
-        for carea in page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-            if all([ocr_word_is_empty(w) for w in carea.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)]):
-                # Set all pixels in the image to white
-                x1, y1, x2, y2 = get_element_bbox(carea)
-                # Create a white image with the same size as the region to be blanked out
-                width, height = x2 - x1, y2 - y1
-                white_image = Image.new('RGB', (width, height), color='white')
-                # Paste the white image onto the original image at the specified region
-                images[page_idx].paste(white_image, (x1, y1, x2, y2))
-
-                parent = carea.getparent()
-                if parent is not None:
-                    parent.remove(carea)
-
-        for separator in page.xpath(".//x:div[@class='ocr_separator']", namespaces=NAMESPACES):
-            x1, y1, x2, y2 = get_element_bbox(separator)
-            # Create a white image with the same size as the region to be blanked out
-            width, height = x2 - x1, y2 - y1
-            white_image = Image.new('RGB', (width, height), color='white')
-            # Paste the white image onto the original image at the specified region
-            images[page_idx].paste(white_image, (x1, y1, x2, y2))
-            # print(f"White Image to {(x1, y1, x2, y2)}")
-            parent = separator.getparent()
+    pages = DESCENDANT_PAGES(hocr_tree)
+    page_masked = map_page_elements(remove_empty_careas_from_page, pages,
+                                    [images[page_idx] for page_idx in range(len(pages))], page_pool=page_pool)
+    return [page_idx for page_idx in range(len(pages)) if page_masked[page_idx]]
+
+
+def remove_empty_careas_from_page(page: etree.ElementTree, page_image) -> bool:
+    """
+    Removes the careas that contain only the empty word and the separators from one page and whitens their areas in
+    page_image
+    :param page: ocr_page element
+    :param page_image: image of the page
+    :return: True if an area of page_image was whitened
+    """
+    # The areas of all removed elements are whitened together after the page was processed
+    masked_boxes = []
+    for carea in CAREAS(page):
+        if all([ocr_word_is_empty(w) for w in WORDS(carea)]):
+            masked_boxes.append(get_element_bbox(carea))
+            parent = carea.getparent()
             if parent is not None:
-                parent.remove(separator)
+                parent.remove(carea)
+
+    for separator in SEPARATORS(page):
+        masked_boxes.append(get_element_bbox(separator))
+        parent = separator.getparent()
+        if parent is not None:
+            parent.remove(separator)
+    mask_page_regions(page_image, masked_boxes)
+    return len(masked_boxes) > 0
+
+
+def relayout_pages(hocr_tree: etree.ElementTree, images, page_idxs: List[int],
+                   page_pool: PagePool = None) -> List[etree.ElementTree]:
+    """
+    Runs the layout analysis of Tesseract (psm 3) again on the images of some pages, e.g., after their lines were
+    whitened, and replaces these pages in hocr_tree with the new results. The other pages are not changed
+    :param hocr_tree: hOCR tree whose pages are in the same order as images
+    :param images: images of the pages
+    :param page_idxs: indices of the pages to analyze again
+    :param page_pool: If given, the pages are analyzed in this pool
+    :return: the new pages in the order of page_idxs
+    """
+    page_ocr_engine_pool = get_engine_pool(lang='deu', psm=3, dpi=300)
+
+    def analyze_page_layout(page_idx):
+        return DESCENDANT_PAGES(etree.fromstring(bytes(page_ocr_engine_pool.image_to_hocr(images[page_idx]), 'utf-8')))[0]
+    new_pages = map_pages(analyze_page_layout, page_idxs, page_pool=page_pool)
+    pages = DESCENDANT_PAGES(hocr_tree)
+    for page_idx, new_page in zip(page_idxs, new_pages):
+        pages[page_idx].getparent().replace(pages[page_idx], new_page)
+    return new_pages
 
 
 def get_body_and_appendix_tree(hocr_tree: etree.ElementTree) -> Tuple[etree.ElementTree, etree.ElementTree]:
@@ -93,36 +136,82 @@ def get_body_and_appendix_tree(hocr_tree: etree.ElementTree) -> Tuple[etree.Elem
     - The main document
     - The appendix
     in the hOCR format
+    The pages are moved from hocr_tree into the new trees without copying, so hocr_tree does not contain any pages
+    afterward
     :param hocr_tree: hOCR tree with all pages of a document
     :return: Body and Appendix hOCR trees
     """
-    is_body = True
+    pages = BODY_PAGES(hocr_tree)
+    appendix_page_start_idx = get_appendix_page_start_idx(pages)
+    return split_hocr_tree_at_page(hocr_tree, pages, appendix_page_start_idx)
 
-    hocr_tree_copy = deepcopy(hocr_tree)
-    body_tree = deepcopy(hocr_tree)
-    appendix_tree = deepcopy(hocr_tree)
 
-    hocr_tree_copy_pages = hocr_tree_copy.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
-    body_pages = body_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
-    appendix_pages = appendix_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
+def get_appendix_page_start_idx(pages: List[etree.ElementTree]) -> int:
+    """
+    Finds the first page after the page that is signed by the author
+    :param pages: pages of the document
+    :return: index of the first appendix page, len(pages) if the document has no appendix
+    """
+    for page_idx in range(len(pages)):
+        if is_signature_page(pages[page_idx]):
+            return page_idx + 1
+    return len(pages)
 
-    split_author_pattern = re.compile(r'Der Bundesminis(f|t|l)er (.*?)')
-    split_authorin_pattern = re.compile(r'Die Bundesminis(f|t|l)erin (.*?)')
 
-    is_body = True
-    for page_idx in range(len(hocr_tree_copy_pages)):
-        page = hocr_tree_copy_pages[page_idx]
-        ocr_careas = page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
-        if is_body:
-            remove_element_from_hocr_tree(appendix_pages[page_idx])
-        else:
-            remove_element_from_hocr_tree(body_pages[page_idx])
-        for carea in ocr_careas:
-            carea_lines = " ".join(build_ocr_carea_text(carea))
-            if split_author_pattern.match(carea_lines) or split_authorin_pattern.match(carea_lines):
-                is_body = False
+SPLIT_AUTHOR_PATTERN = re.compile(r'Der Bundesminis(f|t|l)er (.*?)')
+SPLIT_AUTHORIN_PATTERN = re.compile(r'Die Bundesminis(f|t|l)erin (.*?)')
+
+
+def is_signature_page(page: etree.ElementTree) -> bool:
+    """
+    Checks if a carea of page starts with the signature of the ministry, after which the appendix begins
+    """
+    for carea in CAREAS(page):
+        carea_lines = " ".join(build_ocr_carea_text(carea))
+        if SPLIT_AUTHOR_PATTERN.match(carea_lines) or SPLIT_AUTHORIN_PATTERN.match(carea_lines):
+            return True
+    return False
+
+
+def split_hocr_tree_at_page(hocr_tree: etree.ElementTree, pages: List[etree.ElementTree],
+                            split_page_idx: int) -> Tuple[etree.ElementTree, etree.ElementTree]:
+    """
+    Moves pages[:split_page_idx] into a first and the remaining pages into a second new tree. Everything else in the
+    document (e.g., the head) is copied into both trees
+    :param hocr_tree: hOCR tree or element that contains the pages
+    :param pages: pages of hocr_tree in document order
+    :param split_page_idx: index of the first page of the second tree
+    :return: both trees
+    """
+    root = hocr_tree.getroot() if isinstance(hocr_tree, etree._ElementTree) else hocr_tree
+    second_tree_pages = set(pages[split_page_idx:])
+    page_set = set(pages)
+    page_ancestors = set(ancestor for page in pages for ancestor in page.iterancestors())
+    first_root = copy_element_without_children(root)
+    second_root = copy_element_without_children(root)
+    parents = [(root, first_root, second_root)]
+    while parents:
+        element, first_parent, second_parent = parents.pop()
+        for child in list(element):
+            if child in page_set:
+                (second_parent if child in second_tree_pages else first_parent).append(child)
+            elif child in page_ancestors:
+                first_child = copy_element_without_children(child)
+                second_child = copy_element_without_children(child)
+                first_parent.append(first_child)
+                second_parent.append(second_child)
+                parents.append((child, first_child, second_child))
+            else:
+                first_parent.append(deepcopy(child))
+                second_parent.append(deepcopy(child))
+    return etree.ElementTree(first_root), etree.ElementTree(second_root)
+
 
-    return body_tree, appendix_tree
+def copy_element_without_children(element: etree.ElementTree) -> etree.ElementTree:
+    element_copy = etree.Element(element.tag, attrib=dict(element.attrib), nsmap=element.nsmap)
+    element_copy.text = element.text
+    element_copy.tail = element.tail
+    return element_copy
 
 
 # PAGE LEVEL
@@ -132,7 +221,7 @@ def get_header_elements(hocr_page: etree.ElementTree) -> List[etree.ElementTree]
     :param hocr_page: page element from which headers will be removed and returned
     :return: list of found headers on this page
     """
-    ocr_careas = hocr_page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+    ocr_careas = CAREAS(hocr_page)
     sorted_ocr_careas = sorted(ocr_careas, key=lambda x: get_element_bbox(x)[1])
     headers = [sorted_ocr_careas[0]]
     sorted_ocr_careas[0].getparent().remove(sorted_ocr_careas[0])
@@ -142,7 +231,7 @@ def get_header_elements(hocr_page: etree.ElementTree) -> List[etree.ElementTree]
         headers.append(carea)
         carea.getparent().remove(carea)
     for header in headers:
-        if all([ocr_word_is_empty(word) for word in header.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)]):
+        if all([ocr_word_is_empty(word) for word in WORDS(header)]):
             headers.remove(header)
 
     headers.sort(key=lambda x: get_element_bbox(x)[0])
@@ -166,13 +255,11 @@ def combine_headers(sorted_headers: List[etree.ElementTree], max_line_dist: int
         reight_x1 = right_bbox[0]
         # Check if the bboxes overlap or are close enough to each other
         if np.abs(reight_x1 - left_x2) < max_line_dist or left_bbox[0] <= right_bbox[0] <= left_bbox[2] or right_bbox[0] <= left_bbox[0] <= right_bbox[2]:
-            left_line = sorted_headers[header_idx-1].xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']",
-                                                           namespaces=NAMESPACES)[-1]
-            for word in sorted_headers[header_idx].xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES):
+            left_line = TEXT_AND_HEADER_LINES(sorted_headers[header_idx-1])[-1]
+            for word in WORDS(sorted_headers[header_idx]):
                 left_line.append(word)
             left_line[:] = sorted(left_line, key=lambda x: get_element_bbox(x)[0])
-            x1, y1, x2, y2 = get_surrounding_bbox(left_line.xpath(".//x:span[@class='ocrx_word']",
-                                                                  namespaces=NAMESPACES))
+            x1, y1, x2, y2 = get_surrounding_bbox(WORDS(left_line))
             left_line.set("title", f"bbox {x1} {y1} {x2} {y2}")
             sorted_headers[header_idx-1].set("title", f"bbox {x1} {y1} {x2} {y2}")
             sorted_headers.remove(sorted_headers[header_idx])
@@ -189,12 +276,12 @@ def split_headers(sorted_headers: List[etree.ElementTree], max_word_dist: int =
     """
     header_idx = 0
     while header_idx < len(sorted_headers):
-        for word in sorted_headers[header_idx].xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES):
+        for word in WORDS(sorted_headers[header_idx]):
             if word.text is None:
                 parent = word.getparent()
                 if parent is not None:
                     parent.remove(word)
-        header_words = sorted_headers[header_idx].xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
+        header_words = WORDS(sorted_headers[header_idx])
         word_idx = 1
         while word_idx < len(header_words):
             left_bbox = get_element_bbox(header_words[word_idx-1])
@@ -222,10 +309,8 @@ def split_headers(sorted_headers: List[etree.ElementTree], max_word_dist: int =
 
                 x1, y1, x2, y2 = get_surrounding_bbox(old_words)
                 sorted_headers[header_idx].set("title", f"bbox {x1} {y1} {x2} {y2}")
-                sorted_headers[header_idx].xpath(".//x:p[@class='ocr_par']",
-                                                 namespaces=NAMESPACES)[-1].set("title", f"bbox {x1} {y1} {x2} {y2}")
-                sorted_headers[header_idx].xpath(".//x:span[@class='ocr_line' or @class='ocr_textfloat' or @class='ocr_header']",
-                                                 namespaces=NAMESPACES)[-1].set("title", f"bbox {x1} {y1} {x2} {y2}")
+                PARS(sorted_headers[header_idx])[-1].set("title", f"bbox {x1} {y1} {x2} {y2}")
+                TEXT_AND_HEADER_LINES(sorted_headers[header_idx])[-1].set("title", f"bbox {x1} {y1} {x2} {y2}")
 
                 sorted_headers.append(new_carea)
                 sorted_headers.sort(key=lambda x: get_element_bbox(x)[0])
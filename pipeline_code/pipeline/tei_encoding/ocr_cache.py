@@ -0,0 +1,126 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+"""
+Caches re-OCR results so that identical crops are only recognized once. Entries are content addressed: the key
+contains a digest of the cropped pixels together with the expanded bbox, the page segmentation mode and the language.
+Pages are whitened in place during the pipeline (e.g., by remove_empty_careas), so the digest is computed from the
+crop that is actually recognized and can never refer to an outdated version of the page.
+The cache has an in-memory LRU tier and an optional SQLite tier that survives reruns.
+"""
+
+
+def image_digest(image: Image) -> str:
+    """
+    Computes a digest of the pixels, size and mode of an image
+    :param image: PIL image
+    :return: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.mode};{image.size[0]};{image.size[1]};".encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class OcrResultCache:
+    """
+    Two-tier cache for OCR results: an in-memory LRU and an optional SQLite database at cache_path
+    """
+    def __init__(self, max_entries: int = 4096, cache_path: str = None):
+        self.max_entries = max_entries
+        self.cache_path = cache_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        if cache_path is not None:
+            self._connection = sqlite3.connect(cache_path, timeout=60, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS ocr_results (key TEXT PRIMARY KEY, text TEXT)")
+            self._connection.commit()
+
+    @staticmethod
+    def build_key(crop: Image, bbox, psm: int, lang: str) -> str:
+        x1, y1, x2, y2 = bbox
+        return f"{image_digest(crop)}:{x1},{y1},{x2},{y2}:{psm}:{lang}"
+
+    def get(self, key: str):
+        """
+        Looks up a key in memory first and on disk second
+        :param key: key built with build_key
+        :return: the cached text or None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            if self._connection is not None:
+                row = self._connection.execute("SELECT text FROM ocr_results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    self._store_in_memory(key, row[0])
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._store_in_memory(key, text)
+            if self._connection is not None:
+                self._connection.execute("INSERT OR REPLACE INTO ocr_results (key, text) VALUES (?, ?)", (key, text))
+                self._connection.commit()
+
+    def _store_in_memory(self, key: str, text: str):
+        self._entries[key] = text
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of this cache
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# One cache per process; configure_ocr_cache replaces it, e.g., to add the on-disk tier
+_OCR_CACHE = OcrResultCache()
+
+
+def configure_ocr_cache(max_entries: int = 4096, cache_path: str = None) -> OcrResultCache:
+    """
+    Replaces the process-wide OCR result cache
+    :param max_entries: maximum number of entries in the in-memory tier
+    :param cache_path: path to an SQLite file for the on-disk tier, None to keep results only in memory
+    :return: the new cache
+    """
+    global _OCR_CACHE
+    _OCR_CACHE.close()
+    _OCR_CACHE = OcrResultCache(max_entries=max_entries, cache_path=cache_path)
+    return _OCR_CACHE
+
+
+def get_ocr_cache() -> OcrResultCache:
+    return _OCR_CACHE
@@ -0,0 +1,237 @@
+"""
+This module keeps long-lived Tesseract engines so that re-OCR does not start a new tesseract process and reload the
+traineddata for every cropped area. If tesserocr is installed, each engine is an in-process PyTessBaseAPI that is
+initialized once with its language and page segmentation mode. Otherwise, pytesseract is used as fallback.
+
+Every engine runs with the page segmentation mode (and DPI) of its pool. The pytesseract calls that the pools replaced
+for the OCR of table cells (--psm 6) and the relayout of body pages (--psm 3) passed the PSM in the nice argument of
+pytesseract.run_and_get_output. On Windows, nice is ignored and tesseract ran with its default PSM 3; on other systems
+the command became "nice -n '--psm 6' tesseract ..." which nice rejects. The table cells are therefore recognized with
+PSM 6 now, which changes their output compared to the default PSM. The relayout runs with PSM 3 like tesseract's
+default, so its output does not change.
+"""
+import inspect
+import queue
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from PIL import Image
+from pipeline.tei_encoding.page_images import as_pil_image
+from pipeline.instrumentation import record_ocr_call
+
+
+# hOCR produced by the in-process API only contains the ocr_page div and needs the same document around it as the
+# output of the tesseract command line tool
+HOCR_DOCUMENT_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+  <meta name='ocr-system' content='tesseract'/>
+  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word ocrp_wconf'/>
+ </head>
+ <body>
+{}
+ </body>
+</html>
+"""
+
+
+class OcrEngine(ABC):
+    """
+    An OCR engine that is initialized once with a language, a page segmentation mode and optionally a DPI. Subclasses
+    implement image_to_string and image_to_hocr
+    """
+    def __init__(self, lang: str = 'deu', psm: int = 6, dpi: int = None):
+        self.lang = lang
+        self.psm = psm
+        self.dpi = dpi
+
+    @abstractmethod
+    def image_to_string(self, image: Image) -> str:
+        pass
+
+    @abstractmethod
+    def image_to_hocr(self, image: Image) -> str:
+        pass
+
+    def close(self):
+        pass
+
+
+class PytesseractEngine(OcrEngine):
+    """
+    Fallback engine that calls the tesseract command line tool through pytesseract
+    """
+    def __init__(self, lang: str = 'deu', psm: int = 6, dpi: int = None):
+        super().__init__(lang=lang, psm=psm, dpi=dpi)
+        from pytesseract import pytesseract
+        self._pytesseract = pytesseract
+        self._config = f'--dpi {dpi} --psm {psm}' if dpi is not None else f'--psm {psm}'
+
+    def image_to_string(self, image: Image) -> str:
+        return self._pytesseract.image_to_string(image, lang=self.lang, config=self._config)
+
+    def image_to_hocr(self, image: Image) -> str:
+        return self._pytesseract.image_to_pdf_or_hocr(image, lang=self.lang, config=self._config,
+                                                      extension='hocr').decode('utf-8')
+
+
+class TesserocrEngine(OcrEngine):
+    """
+    In-process engine that keeps one initialized PyTessBaseAPI with the traineddata loaded
+    """
+    def __init__(self, lang: str = 'deu', psm: int = 6, dpi: int = None):
+        super().__init__(lang=lang, psm=psm, dpi=dpi)
+        import tesserocr
+        self._api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+
+    def _set_image(self, image: Image):
+        self._api.SetImage(image)
+        if self.dpi is not None:
+            self._api.SetSourceResolution(self.dpi)
+
+    def image_to_string(self, image: Image) -> str:
+        self._set_image(image)
+        return self._api.GetUTF8Text()
+
+    def image_to_hocr(self, image: Image) -> str:
+        self._set_image(image)
+        return HOCR_DOCUMENT_TEMPLATE.format(self._api.GetHOCRText(0))
+
+    def close(self):
+        self._api.End()
+
+
+def default_engine_class():
+    """
+    Returns TesserocrEngine if tesserocr can be imported and PytesseractEngine otherwise
+    :return: class that is used to create new engines
+    """
+    try:
+        import tesserocr  # noqa: F401
+        return TesserocrEngine
+    except ImportError:
+        return PytesseractEngine
+
+
+def check_engine_class(engine_class):
+    """
+    Raises a TypeError if engine_class cannot be instantiated, so that an incomplete engine fails where it is
+    configured and not on the first OCR call in a worker thread
+    :param engine_class: class that is used to create new engines, None for default_engine_class()
+    """
+    if engine_class is not None and (not issubclass(engine_class, OcrEngine) or inspect.isabstract(engine_class)):
+        raise TypeError(f"{engine_class.__name__} is not a concrete subclass of OcrEngine")
+
+
+class OcrEnginePool:
+    """
+    A pool of engines that share language, page segmentation mode and DPI. Engines are created lazily up to max_size
+    and are reused afterward. Each engine is used by at most one thread at a time.
+    """
+    def __init__(self, lang: str = 'deu', psm: int = 6, dpi: int = None, max_size: int = 1, engine_class=None):
+        self.lang = lang
+        self.psm = psm
+        self.dpi = dpi
+        self.max_size = max_size
+        check_engine_class(engine_class)
+        self.engine_class = engine_class if engine_class is not None else default_engine_class()
+        self._idle_engines = queue.LifoQueue()
+        self._engines = []
+        self._lock = threading.Lock()
+
+    def _create_engine_if_possible(self):
+        with self._lock:
+            if len(self._engines) >= self.max_size:
+                return None
+            engine = self.engine_class(lang=self.lang, psm=self.psm, dpi=self.dpi)
+            self._engines.append(engine)
+            return engine
+
+    @contextmanager
+    def acquire(self):
+        """
+        Borrows an idle engine, creates a new one if none is idle and the pool is not full, or waits for one
+        """
+        try:
+            engine = self._idle_engines.get_nowait()
+        except queue.Empty:
+            engine = self._create_engine_if_possible()
+            if engine is None:
+                engine = self._idle_engines.get()
+        try:
+            yield engine
+        finally:
+            self._idle_engines.put(engine)
+
+    def image_to_string(self, image: Image) -> str:
+        image = as_pil_image(image)
+        record_ocr_call(image)
+        with self.acquire() as engine:
+            return engine.image_to_string(image)
+
+    def image_to_hocr(self, image: Image) -> str:
+        image = as_pil_image(image)
+        record_ocr_call(image)
+        with self.acquire() as engine:
+            return engine.image_to_hocr(image)
+
+    def close(self):
+        with self._lock:
+            for engine in self._engines:
+                engine.close()
+            self._engines = []
+            self._idle_engines = queue.LifoQueue()
+
+
+# Pools are kept per process so that every worker initializes its engines exactly once
+_ENGINE_POOLS = {}
+_ENGINE_POOLS_LOCK = threading.Lock()
+# Class of the engines of new pools, None for default_engine_class()
+_ENGINE_CLASS = None
+
+
+def configure_engine_class(engine_class=None):
+    """
+    Sets the class of the engines of this process, e.g., an OCR stub for benchmarks. Existing pools close their engines
+    and create engines of the new class from then on
+    :param engine_class: subclass of OcrEngine, None for default_engine_class()
+    """
+    global _ENGINE_CLASS
+    check_engine_class(engine_class)
+    with _ENGINE_POOLS_LOCK:
+        _ENGINE_CLASS = engine_class
+        for pool in _ENGINE_POOLS.values():
+            pool.close()
+            pool.engine_class = engine_class if engine_class is not None else default_engine_class()
+
+
+def get_engine_pool(lang: str = 'deu', psm: int = 6, dpi: int = None, max_size: int = None) -> OcrEnginePool:
+    """
+    Returns the process-wide engine pool for lang, psm and dpi and creates it if it does not exist yet
+    :param lang: language of the traineddata
+    :param psm: page segmentation mode
+    :param dpi: DPI that is passed to tesseract, None if tesseract should estimate it
+    :param max_size: If not None, the pool may hold at least this many engines
+    :return: pool of engines
+    """
+    with _ENGINE_POOLS_LOCK:
+        pool = _ENGINE_POOLS.get((lang, psm, dpi))
+        if pool is None:
+            pool = OcrEnginePool(lang=lang, psm=psm, dpi=dpi, engine_class=_ENGINE_CLASS)
+            _ENGINE_POOLS[(lang, psm, dpi)] = pool
+        if max_size is not None and max_size > pool.max_size:
+            pool.max_size = max_size
+    return pool
+
+
+def close_engine_pools():
+    """
+    Closes all engines of this process
+    :return:
+    """
+    with _ENGINE_POOLS_LOCK:
+        for pool in _ENGINE_POOLS.values():
+            pool.close()
+        _ENGINE_POOLS.clear()
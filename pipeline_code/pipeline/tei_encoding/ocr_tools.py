@@ -1,13 +1,31 @@
-from pytesseract import pytesseract
 from xml.sax.saxutils import escape
 from lxml import etree
 from typing import List
+from concurrent.futures import ThreadPoolExecutor
 from pipeline.hocr_tools.hocr_helpers import get_element_bbox
+from pipeline.tei_encoding.ocr_engine import get_engine_pool
+from pipeline.tei_encoding.ocr_cache import get_ocr_cache, OcrResultCache
+from pipeline.instrumentation import count, bind_current_stages
 
 
-def re_ocr_carea(page_bbox, page_image, carea, bbox_margins, remove_empty_lines: bool = True, psm: int = 6):
-    x1, y1, x2, y2 = get_element_bbox(carea)
+def re_ocr_carea(page_bbox, page_image, carea, bbox_margins, remove_empty_lines: bool = True, psm: int = 6,
+                 lang: str = 'deu', use_cache: bool = True):
     # Re-OCR the carea with the page segmentation mode that detects a uniform block of text
+    bounding_box = get_re_ocr_bbox(page_bbox, carea, bbox_margins)
+    # Get all lines in the current carea
+    text = ocr_image_crop(page_image, bounding_box, psm=psm, lang=lang, use_cache=use_cache)
+    return split_re_ocr_text(text, remove_empty_lines=remove_empty_lines)
+
+
+def get_re_ocr_bbox(page_bbox, carea, bbox_margins):
+    """
+    Expands the bbox of the carea by the bbox_margins without leaving the page
+    :param page_bbox: x1, y1, x2, y2 of the page
+    :param carea: ocr_carea element
+    :param bbox_margins: margins that are added to x1, y1, x2, y2
+    :return: the expanded bbox
+    """
+    x1, y1, x2, y2 = get_element_bbox(carea)
     page_x1, page_y1, page_x2, page_y2 = page_bbox
     # Die bbox leicht zu erweitern verbessert die Ergebnisse deutlich;
     # Von x1 kann man ca. den x-merge-threshold abziehen
@@ -16,9 +34,11 @@ def re_ocr_carea(page_bbox, page_image, carea, bbox_margins, remove_empty_lines:
     y1_modifier = min(bbox_margins[1], y1 - page_y1)
     x2_modifier = min(bbox_margins[2], page_x2 - x2)
     y2_modifier = min(bbox_margins[3], page_y2 - y2)
-    bounding_box = (x1 - x1_modifier, y1 - y1_modifier, x2 + x2_modifier, y2 + y2_modifier)
-    # Get all lines in the current carea
-    text = escape(pytesseract.image_to_string(page_image.crop(bounding_box), lang='deu', config=f'--psm {psm}'))
+    return x1 - x1_modifier, y1 - y1_modifier, x2 + x2_modifier, y2 + y2_modifier
+
+
+def split_re_ocr_text(text: str, remove_empty_lines: bool = True) -> List[str]:
+    text = escape(text)
     if remove_empty_lines:
         carea_lines = [line for line in text.split("\n") if len(line) > 0]
     else:
@@ -26,7 +46,147 @@ def re_ocr_carea(page_bbox, page_image, carea, bbox_margins, remove_empty_lines:
     return carea_lines
 
 
+def ocr_image_crop(page_image, bounding_box, psm: int = 6, lang: str = 'deu', use_cache: bool = True) -> str:
+    """
+    Recognizes the text in the bounding_box of the page_image. Results are looked up in and stored to the OCR result
+    cache so that the same crop is only recognized once
+    :param page_image: image of the page
+    :param bounding_box: x1, y1, x2, y2 of the area to recognize
+    :param psm: page segmentation mode
+    :param lang: language of the traineddata
+    :param use_cache: If False, the cache is bypassed
+    :return: recognized text
+    """
+    return ocr_crop(page_image.crop(bounding_box), bounding_box, psm=psm, lang=lang, use_cache=use_cache)
+
+
+def ocr_crop(crop, bounding_box, psm: int = 6, lang: str = 'deu', use_cache: bool = True) -> str:
+    """
+    Recognizes the text of a crop that was cut from the bounding_box of a page image, see ocr_image_crop
+    """
+    if not use_cache:
+        return get_engine_pool(lang=lang, psm=psm).image_to_string(crop)
+    cache = get_ocr_cache()
+    key = OcrResultCache.build_key(crop, bounding_box, psm, lang)
+    text = cache.get(key)
+    if text is None:
+        text = get_engine_pool(lang=lang, psm=psm).image_to_string(crop)
+        cache.put(key, text)
+    else:
+        count("ocr_cache_hits")
+    return text
+
+
 def encode_carea_lines_as_p(carea_lines: List[str]) -> str:
     xml_lines = '<lb />'.join([escape(line) for line in carea_lines])
     new_text_element = etree.fromstring(f'<p>{xml_lines.strip()}</p>')
     return new_text_element
+
+
+class ReOcrPrefetcher:
+    """
+    Recognizes careas speculatively in a thread pool so that the OCR of upcoming careas overlaps with the encoding of
+    the current one. The careas are cropped when they are submitted, the workers only recognize the crops: a page image
+    that was opened lazily with Image.open decodes its file on the first crop, which is not thread-safe.
+    Calls to re_ocr_carea that match a submitted crop wait for its result, all other calls are recognized directly.
+    Since the results are the same as with re_ocr_carea, the encoding does not change.
+    """
+    def __init__(self, max_workers: int = 4, psm: int = 6, lang: str = 'deu', use_cache: bool = True):
+        self.psm = psm
+        self.lang = lang
+        self.use_cache = use_cache
+        # Every worker needs its own engine
+        get_engine_pool(lang=lang, psm=psm, max_size=max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+
+    def prefetch_careas(self, page_key, page_bbox, page_image, careas, bbox_margins):
+        """
+        Submits the re-OCR of all careas of a page
+        :param page_key: key of the page that is used to discard its results later
+        :param page_bbox: x1, y1, x2, y2 of the page
+        :param page_image: image of the page
+        :param careas: careas to recognize in the order they will be requested
+        :param bbox_margins: margins that are added to the bbox of each carea
+        :return:
+        """
+        for carea in careas:
+            bounding_box = get_re_ocr_bbox(page_bbox, carea, bbox_margins)
+            key = (id(page_image), bounding_box)
+            if key not in self._futures:
+                # The OCR calls are counted for the stage that requested the prefetch
+                future = self._executor.submit(bind_current_stages(ocr_crop), page_image.crop(bounding_box),
+                                               bounding_box, psm=self.psm, lang=self.lang, use_cache=self.use_cache)
+                # The image is kept to make sure its id is not reused while the future is stored
+                self._futures[key] = (page_key, page_image, future)
+
+    def discard_page(self, page_key):
+        """
+        Drops the results of a page that will not be requested anymore
+        """
+        for key in [key for key, (key_page, _, _) in self._futures.items() if key_page == page_key]:
+            del self._futures[key]
+
+    def re_ocr_carea(self, page_bbox, page_image, carea, bbox_margins, remove_empty_lines: bool = True,
+                     psm: int = 6):
+        bounding_box = get_re_ocr_bbox(page_bbox, carea, bbox_margins)
+        prefetched = self._futures.get((id(page_image), bounding_box))
+        if psm == self.psm and prefetched is not None and prefetched[1] is page_image:
+            return split_re_ocr_text(prefetched[2].result(), remove_empty_lines=remove_empty_lines)
+        return re_ocr_carea(page_bbox, page_image, carea, bbox_margins, remove_empty_lines=remove_empty_lines,
+                            psm=psm, lang=self.lang, use_cache=self.use_cache)
+
+    def shutdown(self):
+        for _, _, future in self._futures.values():
+            future.cancel()
+        self._futures = {}
+        self._executor.shutdown(wait=True)
+
+
+def ocr_crops(crops, bounding_boxes, psm: int = 6, lang: str = 'deu', use_cache: bool = True) -> List[str]:
+    """
+    Recognizes the text of each crop, which was cut from the corresponding bounding box of a page image, one after
+    another
+    """
+    return [ocr_crop(crop, bounding_box, psm=psm, lang=lang, use_cache=use_cache)
+            for crop, bounding_box in zip(crops, bounding_boxes)]
+
+
+class PageReOcr:
+    """
+    Re-OCRs the careas of whole pages with one task per page in a PagePool, so that the sequential encoding of the body
+    only waits for the page it is at while the following pages are recognized. re_ocr_carea can be used like the one of
+    ReOcrPrefetcher: crops that were not submitted are recognized directly and the results are the same as with
+    re_ocr_carea. Like in ReOcrPrefetcher, the careas are cropped when a page is submitted
+    """
+    def __init__(self, page_pool, psm: int = 6, lang: str = 'deu', use_cache: bool = True):
+        self.page_pool = page_pool
+        self.psm = psm
+        self.lang = lang
+        self.use_cache = use_cache
+        # id of the page image -> page image, index of each bounding box in the results, future of the results
+        self._pages = {}
+
+    def submit_page(self, page_bbox, page_image, careas, bbox_margins):
+        """
+        Submits the re-OCR of all careas of a page as one task
+        :param page_bbox: x1, y1, x2, y2 of the page
+        :param page_image: image of the page
+        :param careas: careas of the page
+        :param bbox_margins: margins that are added to the bbox of each carea
+        """
+        bounding_boxes = list(dict.fromkeys(get_re_ocr_bbox(page_bbox, carea, bbox_margins) for carea in careas))
+        crops = [page_image.crop(bounding_box) for bounding_box in bounding_boxes]
+        future = self.page_pool.submit(ocr_crops, crops, bounding_boxes, psm=self.psm, lang=self.lang,
+                                       use_cache=self.use_cache)
+        # The image is kept to make sure its id is not reused while the results are stored
+        self._pages[id(page_image)] = (page_image, {box: box_idx for box_idx, box in enumerate(bounding_boxes)}, future)
+
+    def re_ocr_carea(self, page_bbox, page_image, carea, bbox_margins, remove_empty_lines: bool = True,
+                     psm: int = 6):
+        bounding_box = get_re_ocr_bbox(page_bbox, carea, bbox_margins)
+        page = self._pages.get(id(page_image))
+        if psm == self.psm and page is not None and page[0] is page_image and bounding_box in page[1]:
+            return split_re_ocr_text(page[2].result()[page[1][bounding_box]], remove_empty_lines=remove_empty_lines)
+        return re_ocr_carea(page_bbox, page_image, carea, bbox_margins, remove_empty_lines=remove_empty_lines,
+                            psm=psm, lang=self.lang, use_cache=self.use_cache)
@@ -0,0 +1,261 @@
+"""
+Page images that are opened on demand and whose decoded pixels are kept in memory-mapped cache files instead of
+in-memory bitmaps. PageImageProvider can be used like the list of PIL images that the pipeline expects: it supports
+len, indexing and slicing, and each page supports the crop, paste, size, width and height of a PIL image.
+A page is decoded once into an uncompressed .npy file. As long as a page is referenced, the same MappedPageImage is
+returned; once no one references it anymore, it is dropped and mapped again from its cache file on the next access.
+Changes through paste are written to the cache file, so whitened areas are kept after a page was dropped.
+"""
+import copy
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from typing import List
+import numpy as np
+from PIL import Image
+
+
+# Modes whose pixels NumPy can represent directly. Other modes are converted to RGB when a page is decoded
+SUPPORTED_MODES = ('1', 'L', 'RGB', 'RGBA')
+
+
+class MappedPageImage:
+    """
+    A page image backed by a (memory-mapped) NumPy array with shape (height, width) or (height, width, bands)
+    """
+    def __init__(self, pixels: np.ndarray):
+        self.pixels = pixels
+        self.mode = array_mode(pixels)
+
+    @property
+    def size(self):
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.pixels, dtype=dtype)
+
+    def crop_array(self, box) -> np.ndarray:
+        """
+        Returns the pixels in box as a view without copying. Parts of the box outside the image are cut off
+        :param box: x1, y1, x2, y2
+        :return: view on the pixels
+        """
+        x1, y1, x2, y2 = _round_box(box)
+        return self.pixels[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)]
+
+    def crop(self, box) -> Image.Image:
+        """
+        Same as PIL.Image.crop: returns the area in box as a new PIL image where pixels outside the page are black
+        :param box: x1, y1, x2, y2
+        :return: PIL image of the area
+        """
+        if box[2] < box[0]:
+            raise ValueError("Coordinate 'right' is less than 'left'")
+        if box[3] < box[1]:
+            raise ValueError("Coordinate 'lower' is less than 'upper'")
+        x1, y1, x2, y2 = _round_box(box)
+        if x1 >= 0 and y1 >= 0 and x2 <= self.width and y2 <= self.height:
+            return Image.fromarray(np.ascontiguousarray(self.pixels[y1:y2, x1:x2]))
+        crop = np.zeros((y2 - y1, x2 - x1) + self.pixels.shape[2:], dtype=self.pixels.dtype)
+        source = self.crop_array((x1, y1, x2, y2))
+        target_x1, target_y1 = max(0, -x1), max(0, -y1)
+        crop[target_y1:target_y1 + source.shape[0], target_x1:target_x1 + source.shape[1]] = source
+        return Image.fromarray(crop)
+
+    def paste(self, image, box=None):
+        """
+        Same as PIL.Image.paste without mask: writes image into the page at box. Parts outside the page are cut off
+        :param image: PIL image or color (a value per band)
+        :param box: x1, y1 or x1, y1, x2, y2. If image is a color, box needs four coordinates
+        """
+        if box is None:
+            box = (0, 0)
+        if isinstance(image, Image.Image):
+            pixels = np.asarray(image.convert(self.mode))
+            x1, y1 = box[0], box[1]
+            x2, y2 = x1 + pixels.shape[1], y1 + pixels.shape[0]
+            if len(box) == 4 and (box[2], box[3]) != (x2, y2):
+                raise ValueError("images do not match")
+        else:
+            x1, y1, x2, y2 = box
+            color = np.asarray(Image.new(self.mode, (1, 1), image))[0, 0]
+            pixels = np.broadcast_to(color, (max(y2 - y1, 0), max(x2 - x1, 0)) + self.pixels.shape[2:])
+        target = self.crop_array((x1, y1, x2, y2))
+        source_x1, source_y1 = max(0, -x1), max(0, -y1)
+        target[...] = pixels[source_y1:source_y1 + target.shape[0], source_x1:source_x1 + target.shape[1]]
+
+    def to_pil(self) -> Image.Image:
+        """
+        Copies the whole page into a PIL image
+        """
+        return Image.fromarray(np.ascontiguousarray(self.pixels))
+
+    def flush(self):
+        if isinstance(self.pixels, np.memmap):
+            self.pixels.flush()
+
+
+def array_mode(pixels: np.ndarray) -> str:
+    """
+    Returns the PIL mode of a pixel array, i.e., the mode Image.fromarray creates for it
+    """
+    if pixels.dtype == bool:
+        return '1'
+    if pixels.ndim == 2:
+        return 'L'
+    return 'RGB' if pixels.shape[2] == 3 else 'RGBA'
+
+
+def mask_page_regions(image, boxes, color='white'):
+    """
+    Fills all boxes of a page with color, e.g., to whiten separators and empty careas before the page is OCRed again.
+    The boxes are rounded and clipped to the page together. For a MappedPageImage, each box is then one slice
+    assignment into the pixel buffer, so that the masked buffer can be cropped by the OCR directly. A PIL image is
+    filled with the color per box without creating a new image for every box
+    :param image: MappedPageImage or PIL image, changed in place
+    :param boxes: x1, y1, x2, y2 per region
+    :param color: fill color
+    """
+    boxes = np.rint(np.asarray(boxes, dtype=np.float64).reshape(-1, 4)).astype(np.int64)
+    if image.mode not in SUPPORTED_MODES:
+        # Other modes, e.g., palette images, need the conversion of an RGB image to get the color right
+        for x1, y1, x2, y2 in boxes.tolist():
+            width, height = max(x2 - x1, 0), max(y2 - y1, 0)
+            image.paste(Image.new('RGB', (width, height), color=color), (x1, y1, x1 + width, y1 + height))
+        return
+    width, height = image.size
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height)
+    boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+    # The color is converted like the white RGB images that were pasted before
+    fill_image = Image.new('RGB', (1, 1), color=color).convert(image.mode)
+    if isinstance(image, MappedPageImage):
+        fill_value = np.asarray(fill_image)[0, 0]
+        # Assigning a scalar is much faster than broadcasting a color over the bands
+        if fill_value.ndim > 0 and np.all(fill_value == fill_value.flat[0]):
+            fill_value = fill_value.flat[0]
+        pixels = image.pixels
+        for x1, y1, x2, y2 in boxes.tolist():
+            pixels[y1:y2, x1:x2] = fill_value
+    else:
+        fill_color = fill_image.getpixel((0, 0))
+        for x1, y1, x2, y2 in boxes.tolist():
+            image.paste(fill_color, (x1, y1, x2, y2))
+
+
+def _round_box(box):
+    # PIL rounds the coordinates of a crop box as well
+    return tuple(int(round(coordinate)) for coordinate in box)
+
+
+def as_pil_image(image) -> Image.Image:
+    """
+    Returns a PIL image for a MappedPageImage and image itself otherwise, e.g., before passing a page to tesseract
+    """
+    if isinstance(image, MappedPageImage):
+        return image.to_pil()
+    return image
+
+
+def decode_page_image(image_path: str, cache_path: str, grayscale: bool = False) -> MappedPageImage:
+    """
+    Decodes an image file into an uncompressed .npy file and maps it
+    :param image_path: path to the image, e.g., a TIFF
+    :param cache_path: path of the .npy file
+    :param grayscale: If true, color pages are stored in mode L with a third of the size of an RGB buffer
+    :return: the mapped page
+    """
+    with Image.open(image_path) as image:
+        if grayscale and image.mode != '1':
+            image = image.convert('L')
+        elif image.mode not in SUPPORTED_MODES:
+            image = image.convert('RGB')
+        pixels = np.asarray(image)
+    # The file only gets its final name once it is complete, so an interrupted run never leaves a broken cache file
+    temporary_path = cache_path + '.part'
+    mapped_pixels = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=pixels.dtype, shape=pixels.shape)
+    mapped_pixels[...] = pixels
+    mapped_pixels.flush()
+    os.replace(temporary_path, cache_path)
+    return MappedPageImage(mapped_pixels)
+
+
+def map_page_image(cache_path: str) -> MappedPageImage:
+    """
+    Maps a page that was decoded with decode_page_image before
+    """
+    return MappedPageImage(np.load(cache_path, mmap_mode='r+'))
+
+
+class PageImageProvider:
+    """
+    Sequence of page images that are decoded on first access into cache files in cache_dir and memory-mapped from
+    there. Slicing returns a provider for the selected pages that shares the pages and cache files with this one
+    """
+    def __init__(self, image_paths: List[str], cache_dir: str = None, grayscale: bool = False):
+        """
+        :param image_paths: paths to the page images in page order
+        :param cache_dir: directory for the cache files. If None, a temporary directory is created and removed by close
+        :param grayscale: If true, color pages are converted to grayscale when they are decoded
+        """
+        self.image_paths = list(image_paths)
+        self.grayscale = grayscale
+        self._owns_cache_dir = cache_dir is None
+        self.cache_dir = tempfile.mkdtemp(prefix='page_images_') if cache_dir is None else cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._indices = range(len(self.image_paths))
+        self._pages = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            view = copy.copy(self)
+            view._indices = self._indices[idx]
+            return view
+        return self._get_page(self._indices[idx])
+
+    def cache_path(self, page_idx: int) -> str:
+        return os.path.join(self.cache_dir, f"page_{page_idx:05d}{'_gray' if self.grayscale else ''}.npy")
+
+    def _get_page(self, page_idx: int) -> MappedPageImage:
+        with self._lock:
+            page = self._pages.get(page_idx)
+            if page is None:
+                cache_path = self.cache_path(page_idx)
+                if os.path.exists(cache_path):
+                    page = map_page_image(cache_path)
+                else:
+                    page = decode_page_image(self.image_paths[page_idx], cache_path, grayscale=self.grayscale)
+                self._pages[page_idx] = page
+            return page
+
+    def close(self):
+        """
+        Removes the cache files if the cache directory was created by this provider
+        """
+        self._pages = weakref.WeakValueDictionary()
+        if self._owns_cache_dir:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,49 +1,148 @@
 from lxml import etree
-from pytesseract import pytesseract
 from pipeline.hocr_tools.hocr_helpers import build_ocr_carea_text
 from xml.sax.saxutils import escape
-from pipeline.constants import NAMESPACES, EMPTY_HOCR_TREE
+from pipeline.constants import EMPTY_HOCR_TREE
+from pipeline.tei_encoding.ocr_engine import get_engine_pool
+from pipeline.instrumentation import instrumented, count
+from pipeline.hocr_tools.hocr_helpers import get_element_bbox
+from pipeline.hocr_tools.hocr_properties import ocr_word_is_empty
+from pipeline.hocr_tools.hocr_selectors import CAREAS, WORDS
+from pipeline.hocr_tools.spatial_index import BboxGrid
 
 # from table_extraction import extract_page_table_boxes
 
 """
-This module utilizes table_extraction to set up a table structure that is then encoded to TEI XML
+This module utilizes table_extraction to set up a table structure that is then encoded to TEI XML.
+The text of the cells is recognized in one of two modes:
+- 'cell': every cell is cropped and recognized on its own
+- 'region': the whole table area is recognized once and the words are assigned to the cells by their position. Only the
+  cells with words that are not clearly in one cell are recognized on their own
 """
 
 
 from pipeline.tei_encoding.table_processing import table_extraction
 from PIL import Image
 import re
+from typing import List
 
 
 FIRST_LEVEL_ENUMERATION_PATTERN = re.compile(r"^[a-z][\]\)\}]*\s")  # a)
 SECOND_LEVEL_ENUMERATION_PATTERN = re.compile(r"^[a-z][a-z][\]\)\}]*\s")  # a)
 
+# Share of the area of a word that must lie in a cell, so that the word is assigned to the cell in the 'region' mode
+WORD_IN_CELL_SHARE = 0.9
+# Share of the area of a word from which a cell is considered to contain a part of the word
+WORD_PART_IN_CELL_SHARE = 0.1
 
-def encode_table(ocr_page_element, ocr_page_image):
+
+@instrumented()
+def encode_table(ocr_page_element, ocr_page_image, table_ocr_mode: str = 'cell', line_detection: str = 'hocr'):
+    """
+    Detects the table on an appendix page and encodes it
+    :param ocr_page_element: ocr_page of the appendix
+    :param ocr_page_image: image of the page
+    :param table_ocr_mode: 'cell' to recognize every cell on its own, 'region' to recognize the table area once
+    :param line_detection: 'hocr' to take the table lines from the hOCR, 'image' to find them in the page image, see
+    table_extraction.detect_table_lines
+    :return: the table element and the area of the table, whose coordinates are None if no table was detected
+    """
     # Initialize an empty table
     table = etree.Element("table")
     # Get the table_data_boxes
-    td_boxes = table_extraction.extract_page_table_boxes(ocr_page_element=ocr_page_element, ocr_page_image=ocr_page_image)
+    td_boxes = table_extraction.extract_page_table_boxes(ocr_page_element=ocr_page_element, ocr_page_image=ocr_page_image,
+                                                         line_detection=line_detection)
+    cell_careas_lines = None
+    if table_ocr_mode == 'region' and len(td_boxes) > 0:
+        cell_careas_lines = recognize_table_region(ocr_page_image, td_boxes)
     # Encode line_wise
-    for td_box_line in td_boxes:
-        tr_element = encode_table_row(ocr_page_image, td_box_line)
+    for row_idx, td_box_line in enumerate(td_boxes):
+        tr_element = encode_table_row(ocr_page_image, td_box_line,
+                                      row_careas_lines=cell_careas_lines[row_idx] if cell_careas_lines else None)
         table.append(tr_element)
     table_area = table_extraction.get_table_area_from_td_boxes(td_boxes)
     # Return the encoded table and the area that contains the table
     return table, table_area
 
 
-def encode_table_row(ocr_page_image, table_row_areas):
+def encode_table_row(ocr_page_image, table_row_areas, row_careas_lines=None):
     # Create the table row element
     tr_element = etree.Element("row")
     # Encode and append the table cells one by one and append them to the table row
-    for table_cell_area in table_row_areas:
-        td = encode_table_cell(ocr_page_image, table_cell_area)
+    for cell_idx, table_cell_area in enumerate(table_row_areas):
+        td = encode_table_cell(ocr_page_image, table_cell_area,
+                               careas_lines=row_careas_lines[cell_idx] if row_careas_lines is not None else None)
         tr_element.append(td)
     return tr_element
 
 
+def recognize_table_region(ocr_page_image: Image, td_boxes):
+    """
+    Recognizes the table area of the page once and assigns the words to the cells. A word belongs to a cell if at
+    least WORD_IN_CELL_SHARE of its area lies in this cell and no other cell contains a part of it. The cells that
+    contain a part of any other word are marked as ambiguous
+    :param ocr_page_image: image of the page with the table lines removed
+    :param td_boxes: rows of cell boxes, see table_extraction.build_table_data_boxes
+    :return: for every cell like in td_boxes, the lines of the cell as list of careas, i.e., [] for an empty cell and
+    [lines] otherwise, or None if the cell is ambiguous and has to be recognized on its own
+    """
+    table_x1, table_y1, table_x2, table_y2 = table_extraction.get_table_area_from_td_boxes(td_boxes)
+    # PIL rounds the crop box, so the word positions in the crop are shifted by the rounded corner
+    offset_x, offset_y = round(table_x1), round(table_y1)
+    cell_positions = [(row_idx, col_idx) for row_idx in range(len(td_boxes)) for col_idx in range(len(td_boxes[row_idx]))]
+    cell_boxes = [td_boxes[row_idx][col_idx] for row_idx, col_idx in cell_positions]
+    region_hocr = EMPTY_HOCR_TREE
+    if (table_x2 - table_x1) * (table_y2 - table_y1) > 0:
+        region_image = ocr_page_image.crop((table_x1, table_y1, table_x2, table_y2))
+        region_hocr = get_engine_pool(lang='deu', psm=3, dpi=300).image_to_hocr(region_image)
+    region_tree = etree.fromstring(bytes(region_hocr, 'utf-8'))
+
+    cell_grid = BboxGrid(cell_boxes)
+    cell_words = [[] for _ in cell_boxes]
+    ambiguous_cells = set()
+    for word in WORDS(region_tree):
+        if ocr_word_is_empty(word):
+            continue
+        x1, y1, x2, y2 = get_element_bbox(word)
+        word_bbox = (x1 + offset_x, y1 + offset_y, x2 + offset_x, y2 + offset_y)
+        word_area = max((x2 - x1) * (y2 - y1), 1)
+        cell_shares = {}
+        for cell_id in cell_grid.query(word_bbox):
+            share = table_extraction.calculate_horizontal_overlap(word_bbox, cell_boxes[cell_id]) * \
+                table_extraction.calculate_vertical_overlap(word_bbox, cell_boxes[cell_id]) / word_area
+            if share > WORD_PART_IN_CELL_SHARE:
+                cell_shares[cell_id] = share
+        if len(cell_shares) == 1 and max(cell_shares.values()) >= WORD_IN_CELL_SHARE:
+            cell_words[next(iter(cell_shares))].append((word_bbox, word))
+        else:
+            ambiguous_cells.update(cell_shares)
+
+    cell_careas_lines = [[None] * len(td_box_line) for td_box_line in td_boxes]
+    for cell_id, (row_idx, col_idx) in enumerate(cell_positions):
+        if cell_id in ambiguous_cells:
+            continue
+        cell_careas_lines[row_idx][col_idx] = [group_words_to_lines(cell_words[cell_id])] if cell_words[cell_id] else []
+    count("table_cells_assigned", len(cell_positions) - len(ambiguous_cells))
+    count("table_cells_ambiguous", len(ambiguous_cells))
+    return cell_careas_lines
+
+
+def group_words_to_lines(bboxes_and_words) -> List[str]:
+    """
+    Builds the text lines of a cell from its words. Words of the same ocr_line stay together in their order, the lines
+    are sorted from top to bottom
+    :param bboxes_and_words: (bbox, ocrx_word) of the words of the cell in document order
+    :return: lines of the cell
+    """
+    lines = {}
+    for word_bbox, word in bboxes_and_words:
+        line = word.getparent()
+        if line not in lines:
+            lines[line] = [word_bbox[1], word_bbox[0], []]
+        lines[line][2].append(word.text)
+    sorted_lines = sorted(lines.values(), key=lambda line: (line[0], line[1]))
+    return [" ".join(word_texts) for _, _, word_texts in sorted_lines]
+
+
 def sanitize_line(line: str):
     """
     Takes a line and removes all special characters that are not * or . up to the first character
@@ -55,20 +154,30 @@ def sanitize_line(line: str):
     return modified_string.strip()
 
 
-def encode_table_cell(ocr_page_image: Image, table_cell_area):
+def encode_table_cell(ocr_page_image: Image, table_cell_area, careas_lines: List[List[str]] = None):
+    """
+    Encodes a table cell
+    :param ocr_page_image: image of the page
+    :param table_cell_area: box of the cell
+    :param careas_lines: lines of the careas in the cell if they were already recognized, e.g., by
+    recognize_table_region. If None, the cell is cropped and recognized
+    :return: cell element
+    """
     x1, y1, x2, y2 = table_cell_area
     td_element = etree.Element("cell")
     # print(table_cell_area)
-    text_area_image = ocr_page_image.crop((x1, y1, x2, y2))
-    new_ocr_string = pytesseract.run_and_get_output(text_area_image, 'hocr', 'deu', '--dpi 300', '--psm 6') if (y2-y1) * (x2-x1) > 0 else EMPTY_HOCR_TREE
-    td_hocr_tree = etree.fromstring(bytes(new_ocr_string, 'utf-8'))
+    if careas_lines is None:
+        text_area_image = ocr_page_image.crop((x1, y1, x2, y2))
+        new_ocr_string = get_engine_pool(lang='deu', psm=6, dpi=300).image_to_hocr(text_area_image) if (y2-y1) * (x2-x1) > 0 else EMPTY_HOCR_TREE
+        td_hocr_tree = etree.fromstring(bytes(new_ocr_string, 'utf-8'))
+        careas_lines = [build_ocr_carea_text(ocr_carea) for ocr_carea in CAREAS(td_hocr_tree)]
 
     enumeration_list = None
     current_element_lines = []
 
     first_level_enumeration_number = 1
-    for ocr_carea in td_hocr_tree.xpath("//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-        carea_lines = [sanitize_line(line) for line in build_ocr_carea_text(ocr_carea)]
+    for ocr_carea_lines in careas_lines:
+        carea_lines = [sanitize_line(line) for line in ocr_carea_lines]
         if len(carea_lines) == 0:
             td_text = etree.fromstring("<p/>")
             td_element.append(td_text)
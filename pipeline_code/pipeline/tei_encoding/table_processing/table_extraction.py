@@ -1,13 +1,14 @@
+import heapq
 import string
 from lxml import etree
 import numpy as np
 from pipeline.hocr_tools.hocr_helpers import get_element_bbox, remove_element_from_hocr_tree, \
-    get_surrounding_bbox
-from pipeline.constants import NAMESPACES
-from PIL import Image
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+    get_surrounding_bbox, get_surrounding_bbox_of_bboxes, bboxes_overlap
+from pipeline.hocr_tools.spatial_index import BboxGrid, PageWordIndex
+from pipeline.hocr_tools.hocr_selectors import CAREAS, LINES, WORDS
+from pipeline.tei_encoding.page_images import mask_page_regions, as_pil_image, SUPPORTED_MODES
 from pipeline.hocr_tools.hocr_properties import carea_contins_only_empty_words
+from pipeline.instrumentation import instrumented, count
 
 # Die Tabelle geht von links nach rechts, dabei kann sich die Zeile an manchen Stellen aufteilen.
 #  Die gefundenen Linien (Linien als leere ocr_par erkannt) können als Trennungen genutzt werden, um dann zu gucken,
@@ -21,17 +22,26 @@ information that was detected from an image
 """
 
 
-def extract_page_table_boxes(ocr_page_element, ocr_page_image, plot_td_boxes: bool = False):
+def extract_page_table_boxes(ocr_page_element, ocr_page_image, plot_td_boxes: bool = False,
+                             line_detection: str = 'hocr'):
     # TODO Das hier in das appendix encoding integrieren
     # Detect table lines
-    vlines, hlines = detect_table_lines(ocr_page_element, ocr_page_image)
+    vlines, hlines = detect_table_lines(ocr_page_element, ocr_page_image, line_detection=line_detection)
     # Form the lines to boxes
-    td_boxes = build_table_data_boxes(vlines, hlines)
+    table_grid = TableGrid.from_lines(vlines, hlines)
+    td_boxes = table_grid.td_boxes()
+    # The words are indexed once for the expansion and the removal
+    word_index = PageWordIndex(ocr_page_element)
     # Make the boxes fit around the content
-    expand_td_boxes(ocr_page_element, td_boxes)
+    expand_td_boxes(ocr_page_element, td_boxes, word_index=word_index)
+    # Cells whose content crosses the rules, e.g., merged cells, are not encoded as such yet but counted
+    count("td_box_cells_over_rules", int(cells_over_rules(table_grid, td_boxes).sum()))
     # Remove the OCR elements that lie in the table as they are re-ocred anyways
-    remove_ocr_elements_on_table(ocr_page_element, td_boxes)  # TODO Testen
+    remove_ocr_elements_on_table(ocr_page_element, td_boxes, word_index=word_index)  # TODO Testen
     if plot_td_boxes:
+        # Plotting backends are only imported when needed to keep the pipeline import light
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
         fig, ax = plt.subplots()
         fig.set_size_inches(ocr_page_image.width / 300, ocr_page_image.height / 300)
         ax.axis('off')
@@ -54,25 +64,23 @@ def extract_page_table_boxes(ocr_page_element, ocr_page_image, plot_td_boxes: bo
 
 
 def get_table_area_from_td_boxes(td_boxes):
-    table_x1, table_y1, table_x2, table_y2 = (None, None, None, None)
-    for table_line in td_boxes:
-        for table_cell in table_line:
-            if table_x1 is None or table_x1 > table_cell[0]:
-                table_x1 = table_cell[0]
-            if table_y1 is None or table_y1 > table_cell[1]:
-                table_y1 = table_cell[1]
-            if table_x2 is None or table_x2 < table_cell[2]:
-                table_x2 = table_cell[2]
-            if table_y2 is None or table_y2 < table_cell[3]:
-                table_y2 = table_cell[3]
-    return [table_x1, table_y1, table_x2, table_y2]
-
-
-def remove_ocr_elements_on_table(ocr_page_element, td_boxes):
+    """
+    Returns the area x1, y1, x2, y2 that surrounds all td_boxes, or four None if there are no boxes. The boxes are not
+    necessarily on a grid anymore after expand_td_boxes, so the area is taken from the boxes
+    """
+    cell_boxes = np.array([table_cell for table_line in td_boxes for table_cell in table_line],
+                          dtype=np.float64).reshape(-1, 4)
+    if len(cell_boxes) == 0:
+        return [None, None, None, None]
+    return np.concatenate([cell_boxes[:, :2].min(axis=0), cell_boxes[:, 2:].max(axis=0)]).tolist()
+
+
+def remove_ocr_elements_on_table(ocr_page_element, td_boxes, word_index: PageWordIndex = None):
     """
     Removes all ocr elements of the ocr_page element that overlap with the td_boxes
     :param ocr_page_element:
     :param td_boxes:
+    :param word_index: index of the words on the ocr_page_element, built if None
     :return:
     """
     # TODO Testen
@@ -82,21 +90,21 @@ def remove_ocr_elements_on_table(ocr_page_element, td_boxes):
         return
     # TODO Zur Not einfach alle careas entfernen, die mit der table_area überlappen
     # Remove any word in the table
-    for word in ocr_page_element.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES):
-        word_bbox = get_element_bbox(word)
-        if rectangles_overlap(word_bbox, table_area):
-            remove_element_from_hocr_tree(word)
+    if word_index is None:
+        word_index = PageWordIndex(ocr_page_element)
+    for word in word_index.overlapping_words(table_area):
+        word_index.hocr_index.remove(word)
     # Remove any line with no word
-    for line in ocr_page_element.xpath(".//x:span[@class='ocr_line']", namespaces=NAMESPACES):
-        if len(line.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)) == 0:
+    for line in LINES(ocr_page_element):
+        if len(WORDS(line)) == 0:
             remove_element_from_hocr_tree(line)
     # Remove any ocr_carea without lines
-    for carea in ocr_page_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-        if len(carea.xpath(".//x:span[@class='ocr_line']", namespaces=NAMESPACES)) == 0:
+    for carea in CAREAS(ocr_page_element):
+        if len(LINES(carea)) == 0:
             remove_element_from_hocr_tree(carea)
     # Split the careas if the lines are far apart
-    for carea in ocr_page_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-        lines = carea.xpath(".//x:span[@class='ocr_line']", namespaces=NAMESPACES)
+    for carea in CAREAS(ocr_page_element):
+        lines = LINES(carea)
         line_idx = 1
         while line_idx < len(lines):
             prev_line_bbox = get_element_bbox(lines[line_idx-1])
@@ -111,66 +119,130 @@ def remove_ocr_elements_on_table(ocr_page_element, td_boxes):
                 carea.addprevious(new_carea)
             line_idx += 1
     # Reshape the ocr_careas
-    for carea in ocr_page_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-        x1, y1, x2, y2 = get_surrounding_bbox(carea.xpath(".//x:span[@class='ocr_line']", namespaces=NAMESPACES))
+    for carea in CAREAS(ocr_page_element):
+        x1, y1, x2, y2 = get_surrounding_bbox(LINES(carea))
         carea.set("title", f"bbox {x1} {y1} {x2} {y2}")
 
 
-def expand_td_boxes(ocr_page_element, initial_td_boxes):
+@instrumented()
+def expand_td_boxes(ocr_page_element, initial_td_boxes, word_index: PageWordIndex = None):
     """
     Takes the td_boxes that were detected on the ocr_page_element and expands them until they do not overlap with any
     ocrx_word of the ocr_page_element
+    The cells are processed row by row. A cell whose words all lie inside of it does not change, which is decided for all
+    cells at once from the incidence of the words and the cells. Only the cells that have a word crossing their bounds
+    or whose upper bound was moved by the cell above are put on the worklist and expanded to their fixed point
     :param ocr_page_element:
     :param initial_td_boxes:
+    :param word_index: index of the words on the ocr_page_element, built if None
     :return:
     """
     page_bbox = list(map(int, ocr_page_element.attrib.get('title').split(";")[1].strip().split(" ")[1:]))
-    for table_line_idx in range(len(initial_td_boxes)):
-        for table_cell_idx in range(len(initial_td_boxes[table_line_idx])):
+    # The words do not change while the boxes are expanded, so their bboxes are parsed and indexed only once
+    if word_index is None:
+        word_index = PageWordIndex(ocr_page_element)
+    cell_positions = [(table_line_idx, table_cell_idx) for table_line_idx in range(len(initial_td_boxes))
+                      for table_cell_idx in range(len(initial_td_boxes[table_line_idx]))]
+    if len(cell_positions) == 0:
+        return
+    worklist = [cell_position for cell_position, crossed in
+                zip(cell_positions, cells_with_crossing_words(initial_td_boxes, word_index)) if crossed]
+    heapq.heapify(worklist)
+    queued = set(worklist)
+    iterations = 0
+    while worklist:
+        table_line_idx, table_cell_idx = heapq.heappop(worklist)
+        has_cell_below = table_line_idx < len(initial_td_boxes) - 1
+        if has_cell_below:
+            below_td_box = list(initial_td_boxes[table_line_idx + 1][table_cell_idx])
+        iterations += expand_td_box(initial_td_boxes, table_line_idx, table_cell_idx, page_bbox, word_index)
+        # The cell below comes later in the row order, so it is still expanded if its bounds were moved
+        if has_cell_below and initial_td_boxes[table_line_idx + 1][table_cell_idx] != below_td_box and \
+                (table_line_idx + 1, table_cell_idx) not in queued:
+            heapq.heappush(worklist, (table_line_idx + 1, table_cell_idx))
+            queued.add((table_line_idx + 1, table_cell_idx))
+    count("td_box_cells", len(cell_positions))
+    count("td_box_cells_expanded", len(queued))
+    count("td_box_expansion_iterations", iterations)
+
+
+def cells_with_crossing_words(td_boxes, word_index: PageWordIndex) -> np.ndarray:
+    """
+    Checks for every cell of td_boxes in row order if a word that overlaps the cell is not inside of it, i.e., if
+    expand_td_box would change the cell. The overlap of all words with all cells is computed at once with the semantics
+    of word_index.overlapping_word_ids
+    :return: boolean array with one entry per cell
+    """
+    cell_boxes = np.array([td_box for td_box_line in td_boxes for td_box in td_box_line],
+                          dtype=np.float64).reshape(-1, 4)
+    word_bboxes = word_index.word_bboxes[word_index.hocr_index.alive[word_index.word_rows]]
+    if len(word_bboxes) == 0:
+        # E.g., a page with only the rules of a table
+        return np.zeros(len(cell_boxes), dtype=bool)
+    # Words x cells
+    incidence = bboxes_overlap(word_bboxes[:, :, np.newaxis], cell_boxes.T)
+    # The bbox around the words of each cell, truncated like get_surrounding_bbox_of_bboxes
+    words_x1 = np.trunc(np.where(incidence, word_bboxes[:, 0:1], np.inf).min(axis=0))
+    words_y1 = np.trunc(np.where(incidence, word_bboxes[:, 1:2], np.inf).min(axis=0))
+    words_x2 = np.trunc(np.where(incidence, word_bboxes[:, 2:3], -np.inf).max(axis=0))
+    words_y2 = np.trunc(np.where(incidence, word_bboxes[:, 3:4], -np.inf).max(axis=0))
+    return incidence.any(axis=0) & ((words_x1 < cell_boxes[:, 0]) | (words_y1 < cell_boxes[:, 1]) |
+                                    (words_x2 > cell_boxes[:, 2]) | (words_y2 > cell_boxes[:, 3]))
+
+
+def expand_td_box(td_boxes, table_line_idx: int, table_cell_idx: int, page_bbox, word_index: PageWordIndex) -> int:
+    """
+    Expands the cell table_line_idx, table_cell_idx of td_boxes until all words that overlap it are inside of it. Every
+    expansion adds a margin and moves the upper bound of the cell below to the lower bound of the cell
+    :return: the number of iterations
+    """
+    iterations = 0
+    changed = True
+    while changed:
+        iterations += 1
+        overlapping_word_bboxes = word_index.word_bboxes[word_index.overlapping_word_ids(td_boxes[table_line_idx][table_cell_idx])]
+
+        new_td_box = list(get_surrounding_bbox_of_bboxes(overlapping_word_bboxes)) if len(overlapping_word_bboxes) > 0 else td_boxes[table_line_idx][table_cell_idx]
+
+        x1 = min([new_td_box[0], td_boxes[table_line_idx][table_cell_idx][0]])
+        y1 = min([new_td_box[1], td_boxes[table_line_idx][table_cell_idx][1]])
+        x2 = max([new_td_box[2], td_boxes[table_line_idx][table_cell_idx][2]])
+        y2 = max([new_td_box[3], td_boxes[table_line_idx][table_cell_idx][3]])
+
+        new_td_box = [x1, y1, x2, y2]
+
+        if new_td_box != td_boxes[table_line_idx][table_cell_idx]:
+
+            new_x1, new_y1, new_x2, new_y2 = new_td_box
+
+            window_expansion = 5
+            new_x1 = max([new_x1-window_expansion, page_bbox[0]])
+            new_y1 = max([new_y1-window_expansion, page_bbox[1]])
+            new_x2 = min([new_x2+window_expansion, page_bbox[2]])
+            new_y2 = min([new_y2+window_expansion, page_bbox[3]])
+
+            new_td_box = [new_x1, new_y1, new_x2, new_y2]
+
+            td_boxes[table_line_idx][table_cell_idx] = new_td_box
+            # Move the upper line of the table cell under this one to the lower line of this one to avoid
+            # duplicates in the table
+            # TODO Oder doch eher nicht?
+            if table_line_idx < len(td_boxes) - 1:
+                td_boxes[table_line_idx+1][table_cell_idx][1] = new_y2
+                # Make sure y2 >= y1 for the cell below
+                if new_y2 > td_boxes[table_line_idx+1][table_cell_idx][3]:
+                    td_boxes[table_line_idx + 1][table_cell_idx][3] = new_y2
+                    # TODO Tabellenzellen nochmal plotten?
             changed = True
-            while changed:
-                overlapping_words = get_td_box_overlapping_words(ocr_page_element, initial_td_boxes[table_line_idx][table_cell_idx])
-
-                new_td_box = list(get_surrounding_bbox(overlapping_words)) if overlapping_words else initial_td_boxes[table_line_idx][table_cell_idx]
-
-                x1 = min([new_td_box[0], initial_td_boxes[table_line_idx][table_cell_idx][0]])
-                y1 = min([new_td_box[1], initial_td_boxes[table_line_idx][table_cell_idx][1]])
-                x2 = max([new_td_box[2], initial_td_boxes[table_line_idx][table_cell_idx][2]])
-                y2 = max([new_td_box[3], initial_td_boxes[table_line_idx][table_cell_idx][3]])
-
-                new_td_box = [x1, y1, x2, y2]
-
-                if new_td_box != initial_td_boxes[table_line_idx][table_cell_idx]:
+        else:
+            changed = False
+    return iterations
 
-                    new_x1, new_y1, new_x2, new_y2 = new_td_box
 
-                    window_expansion = 5
-                    new_x1 = max([new_x1-window_expansion, page_bbox[0]])
-                    new_y1 = max([new_y1-window_expansion, page_bbox[1]])
-                    new_x2 = min([new_x2+window_expansion, page_bbox[2]])
-                    new_y2 = min([new_y2+window_expansion, page_bbox[3]])
-
-                    new_td_box = [new_x1, new_y1, new_x2, new_y2]
-
-                    initial_td_boxes[table_line_idx][table_cell_idx] = new_td_box
-                    # Move the upper line of the table cell under this one to the lower line of this one to avoid
-                    # duplicates in the table
-                    # TODO Oder doch eher nicht?
-                    if table_line_idx < len(initial_td_boxes) - 1:
-                        initial_td_boxes[table_line_idx+1][table_cell_idx][1] = new_y2
-                        # Make sure y2 >= y1 for the cell below
-                        if new_y2 > initial_td_boxes[table_line_idx+1][table_cell_idx][3]:
-                            initial_td_boxes[table_line_idx + 1][table_cell_idx][3] = new_y2
-                            # TODO Tabellenzellen nochmal plotten?
-                    changed = True
-                else:
-                    changed = False
-
-
-def get_td_box_overlapping_words(ocr_page_element, td_box):
-    word_bboxes = [word for word in ocr_page_element.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
-                   if rectangles_overlap(get_element_bbox(word), td_box)]
-    return word_bboxes
+def get_td_box_overlapping_words(ocr_page_element, td_box, word_index: PageWordIndex = None):
+    if word_index is None:
+        word_index = PageWordIndex(ocr_page_element)
+    return word_index.overlapping_words(td_box)
 
 
 def rectangles_overlap_horizontally(rect_1, rect_2):
@@ -194,13 +266,16 @@ def rectangles_overlap(rect_1, rect_2):
         rect_1, rect_2)
 
 
-def detect_table_lines(ocr_page_element, ocr_page_image, plot_table_lines: bool = False):
+def detect_table_lines(ocr_page_element, ocr_page_image, plot_table_lines: bool = False, line_detection: str = 'hocr'):
     """
     Finds all elements that represent table lines in the ocr_page_element and fills the corresponding areas in the
     ocr_page_image with white pixels to remove them
     :param ocr_page_element:
     :param ocr_page_image:
     :param plot_table_lines: If true, the detected lines are plotted onto the image
+    :param line_detection: 'hocr' to take the lines from the careas that only contain empty words, 'image' to find them
+    in the pixels of ocr_page_image (see detect_table_lines_in_image). The careas with only empty words are removed in
+    both cases
     :return: vlines and hlines where each line is determined from its start to end and the center of the other dimension
     """
     # TODO Was, wenn keine Zeilen erkannt wurden? -> Leere Liste
@@ -208,24 +283,28 @@ def detect_table_lines(ocr_page_element, ocr_page_image, plot_table_lines: bool
     #  or div elements that are ocr_separators
     vlines = []
     hlines = []
+    line_boxes = []
     # print(ocr_page_element.attrib)
     # print(ocr_page_element.attrib.get('title').split(";")[1].strip().split(" "))
     page_bbox = list(map(int, ocr_page_element.attrib.get('title').split(";")[1].strip().split(" ")[1:]))
-    for ocr_carea in ocr_page_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
+    if line_detection == 'image':
+        # The pixels are read before any area is whitened
+        vlines, hlines, line_boxes = detect_table_lines_in_image(ocr_page_image)
+    for ocr_carea in CAREAS(ocr_page_element):
         if carea_contins_only_empty_words(ocr_carea):
             # Get the element's bbox
             x1, y1, x2, y2 = get_element_bbox(ocr_carea)
-            # Add the element to the line elements
-            if x2-x1 > y2-y1:
-                hlines.append([x1, y1 + (y2-y1)/2, x2, y1 + (y2-y1)/2])
-            else:
-                vlines.append([x1 + (x2-x1)/2, y1, x1 + (x2-x1)/2, y2])
-            # Set all pixels in the image to white
-            width, height = x2 - x1, y2 - y1
-            white_image = Image.new('RGB', (width, height), color='white')
-            ocr_page_image.paste(white_image, (x1, y1, x2, y2))
+            # Add the element to the line elements, unless the lines were found in the image
+            if line_detection != 'image':
+                if x2-x1 > y2-y1:
+                    hlines.append([x1, y1 + (y2-y1)/2, x2, y1 + (y2-y1)/2])
+                else:
+                    vlines.append([x1 + (x2-x1)/2, y1, x1 + (x2-x1)/2, y2])
+            # The area is whitened in the image together with all other lines below
+            line_boxes.append((x1, y1, x2, y2))
             # Remove the element from the hOCR tree
             remove_element_from_hocr_tree(ocr_carea)
+    mask_page_regions(ocr_page_image, line_boxes)
     if len(vlines) == 0 or len(hlines) == 0:
         return [], []
     # TODO Separators
@@ -261,19 +340,16 @@ def detect_table_lines(ocr_page_element, ocr_page_image, plot_table_lines: bool
     # Remove falsely detected / too small careas
     remove_small_bboxes(ocr_page_element)  # TODO Still in Testing
 
-    # Remove duplicate lines
-    for line_set in [hlines, vlines]:
-        line_counter = 0
-        while line_counter < len(line_set):
-            inner_counter = line_counter+1
-            while inner_counter < len(line_set):
-                if box_equivalence(line_set[line_counter], line_set[inner_counter]):
-                    del line_set[inner_counter]
-                    continue
-                inner_counter += 1
-            line_counter += 1
+    # Remove duplicate lines. All lines go through the entire table now, so two lines are equivalent (see
+    # box_equivalence) if their positions differ by less than the threshold, and the sorted lines are compared with the
+    # last line that was kept
+    hlines[:] = remove_duplicate_sorted_lines(hlines, position_idx=1)
+    vlines[:] = remove_duplicate_sorted_lines(vlines, position_idx=0)
 
     if plot_table_lines:
+        # Plotting backends are only imported when needed to keep the pipeline import light
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
         fig, ax = plt.subplots()
         # Assuming 300 DPI
         fig.set_size_inches(ocr_page_image.width / 300, ocr_page_image.height / 300)
@@ -284,12 +360,12 @@ def detect_table_lines(ocr_page_element, ocr_page_image, plot_table_lines: bool
                 [(x_lower, y_lower), (x_lower, y_upper), (x_upper, y_upper), (x_upper, y_lower)],
                 closed=True, edgecolor='red', linewidth=1, fill=False)
             fig.gca().add_patch(rectangle)
-        for (x_lower, y_lower, x_upper, y_upper) in [get_element_bbox(carea) for carea in ocr_page_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)]:
+        for (x_lower, y_lower, x_upper, y_upper) in [get_element_bbox(carea) for carea in CAREAS(ocr_page_element)]:
             rectangle = patches.Polygon(
                 [(x_lower, y_lower), (x_lower, y_upper), (x_upper, y_upper), (x_upper, y_lower)],
                 closed=True, edgecolor='blue', linewidth=1, fill=False)
             fig.gca().add_patch(rectangle)
-        for (x_lower, y_lower, x_upper, y_upper) in [get_element_bbox(carea) for carea in ocr_page_element.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)]:
+        for (x_lower, y_lower, x_upper, y_upper) in [get_element_bbox(carea) for carea in WORDS(ocr_page_element)]:
             rectangle = patches.Polygon(
                 [(x_lower, y_lower), (x_lower, y_upper), (x_upper, y_upper), (x_upper, y_lower)],
                 closed=True, edgecolor='green', linewidth=1, fill=False)
@@ -299,6 +375,168 @@ def detect_table_lines(ocr_page_element, ocr_page_image, plot_table_lines: bool
     return vlines, hlines
 
 
+def remove_duplicate_sorted_lines(lines, position_idx: int, pixel_threshold=10):
+    """
+    Removes every line whose position is closer than pixel_threshold to the position of the previous line that is kept
+    :param lines: lines that are sorted by their position and only differ in their position
+    :param position_idx: index of the position in a line, 1 for horizontal and 0 for vertical lines
+    :param pixel_threshold: The minimum difference between the positions of two lines
+    :return: the kept lines
+    """
+    kept_idxs = select_rule_positions([line[position_idx] for line in lines], pixel_threshold=pixel_threshold)
+    return [lines[line_idx] for line_idx in kept_idxs]
+
+
+def select_rule_positions(positions, pixel_threshold=10) -> np.ndarray:
+    """
+    Clusters sorted rule positions in one pass: a position starts a new cluster if it differs by at least
+    pixel_threshold from the first position of the current cluster, which is kept
+    :param positions: sorted positions
+    :param pixel_threshold: The minimum difference between two kept positions
+    :return: indices of the kept positions
+    """
+    kept_idxs = []
+    last_kept_position = None
+    for position_idx, position in enumerate(positions):
+        if last_kept_position is None or abs(position - last_kept_position) >= pixel_threshold:
+            kept_idxs.append(position_idx)
+            last_kept_position = position
+    return np.array(kept_idxs, dtype=np.int64)
+
+
+def detect_table_lines_in_image(page_image, min_line_length: int = 150, max_line_thickness: int = 15,
+                                crossing_tolerance: int = 20, mask_margin: int = 2):
+    """
+    Finds the ruling lines of a table in the pixels of a page image. A dark run of at least min_line_length pixels in
+    a pixel row (column) is a part of a horizontal (vertical) line, which is what an erosion with a line kernel of that
+    length keeps. The runs of neighbouring rows (columns) form one line. Only lines that cross a line of the other
+    direction are kept, so that, e.g., the rule below the page header or an underline beside the table does not become a
+    part of the table
+    :param page_image: PIL image or MappedPageImage of the page
+    :param min_line_length: minimum length of a line in pixels. Characters are much shorter
+    :param max_line_thickness: thicker dark areas (e.g., images) are no lines
+    :param crossing_tolerance: distance in pixels that a line may end before the line it crosses
+    :param mask_margin: pixels around a line that are included in its box
+    :return: vlines and hlines like detect_table_lines and the boxes of the lines to whiten them
+    """
+    dark = dark_pixel_mask(page_image)
+    hlines = find_lines(dark, min_line_length, max_line_thickness, axis=1)
+    vlines = find_lines(dark, min_line_length, max_line_thickness, axis=0)
+    crossings = lines_cross(hlines, vlines, crossing_tolerance)
+    hline_kept = crossings.any(axis=1)
+    vline_kept = crossings[hline_kept].any(axis=0)
+    hlines = [hline for hline, kept in zip(hlines, hline_kept) if kept]
+    vlines = [vline for vline, kept in zip(vlines, vline_kept) if kept]
+    height, width = dark.shape
+    line_boxes = [(max(x1 - mask_margin, 0), max(y1 - mask_margin, 0), min(x2 + mask_margin, width),
+                   min(y2 + mask_margin, height)) for x1, y1, x2, y2 in hlines + vlines]
+    # Like the lines from the careas, a line is described by its center in the other dimension
+    hlines = [[x1, (y1 + y2) / 2, x2, (y1 + y2) / 2] for x1, y1, x2, y2 in hlines]
+    vlines = [[(x1 + x2) / 2, y1, (x1 + x2) / 2, y2] for x1, y1, x2, y2 in vlines]
+    return vlines, hlines, line_boxes
+
+
+def lines_cross(hlines, vlines, tolerance: int) -> np.ndarray:
+    """
+    Checks for every pair of a horizontal and a vertical line if they cross, i.e., if the row of the horizontal line is
+    within the rows of the vertical line and the column of the vertical line is within the columns of the horizontal
+    line, both extended by tolerance
+    :param hlines: boxes x1, y1, x2, y2 of the horizontal lines
+    :param vlines: boxes x1, y1, x2, y2 of the vertical lines
+    :param tolerance: distance in pixels that a line may end before the line it crosses
+    :return: boolean array with shape (len(hlines), len(vlines))
+    """
+    hlines = np.asarray(hlines, dtype=np.float64).reshape(-1, 4)
+    vlines = np.asarray(vlines, dtype=np.float64).reshape(-1, 4)
+    hline_y = ((hlines[:, 1] + hlines[:, 3]) / 2)[:, np.newaxis]
+    vline_x = ((vlines[:, 0] + vlines[:, 2]) / 2)[np.newaxis, :]
+    return (vlines[np.newaxis, :, 1] - tolerance <= hline_y) & (hline_y <= vlines[np.newaxis, :, 3] + tolerance) & \
+        (hlines[:, np.newaxis, 0] - tolerance <= vline_x) & (vline_x <= hlines[:, np.newaxis, 2] + tolerance)
+
+
+def dark_pixel_mask(page_image, threshold: int = 128) -> np.ndarray:
+    """
+    Returns a boolean array with shape (height, width) that is True for the dark pixels of a page image
+    """
+    if page_image.mode not in SUPPORTED_MODES:
+        page_image = as_pil_image(page_image).convert('L')
+    pixels = np.asarray(page_image)
+    if pixels.dtype == bool:
+        # In mode '1', True is white
+        return ~pixels
+    if pixels.ndim == 3:
+        pixels = pixels[..., :3].min(axis=2)
+    return pixels < threshold
+
+
+def erode_with_line(dark: np.ndarray, length: int, axis: int) -> np.ndarray:
+    """
+    Erosion of a boolean pixel array with a line kernel of length pixels along axis. Instead of comparing all length
+    pixels, the eroded runs are doubled in each step, so that only about log2(length) shifted ANDs are needed
+    :param dark: True for the dark pixels
+    :param length: length of the kernel
+    :param axis: 1 for horizontal, 0 for vertical lines
+    :return: array that is shorter by length - 1 along axis and True where length dark pixels start
+    """
+    eroded = dark
+    run_length = 1
+    while run_length < length:
+        shift = min(run_length, length - run_length)
+        size = eroded.shape[axis] - shift
+        if size <= 0:
+            return np.zeros((dark.shape[0], 0) if axis == 1 else (0, dark.shape[1]), dtype=bool)
+        if axis == 1:
+            eroded = eroded[:, :size] & eroded[:, shift:]
+        else:
+            eroded = eroded[:size] & eroded[shift:]
+        run_length += shift
+    return eroded
+
+
+def find_lines(dark: np.ndarray, min_line_length: int, max_line_thickness: int, axis: int):
+    """
+    Finds the horizontal (axis=1) or vertical (axis=0) lines in a boolean pixel array
+    :param dark: True for the dark pixels, shape (height, width)
+    :param min_line_length: minimum number of consecutive dark pixels along axis
+    :param max_line_thickness: maximum number of neighbouring rows (columns) of one line
+    :param axis: direction of the lines
+    :return: boxes x1, y1, x2, y2 (exclusive) of the lines
+    """
+    eroded = erode_with_line(dark, min_line_length, axis)
+    # Work on rows of the lines' direction, i.e., the vertical lines are the rows of the transposed result
+    line_rows = np.flatnonzero(eroded.any(axis=axis))
+    if len(line_rows) == 0:
+        return []
+    eroded_rows = eroded[line_rows] if axis == 1 else eroded[:, line_rows].T
+    # Runs of the eroded rows, a run of starts from a1 to a2 - 1 is a dark run from a1 to a2 - 1 + min_line_length
+    edges = np.diff(np.pad(eroded_rows, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+    run_positions = line_rows[run_rows]
+    run_ends = run_ends - 1 + min_line_length
+    lines = []
+    for cluster in cluster_line_positions(run_positions, max_gap=1):
+        position_1, position_2 = int(run_positions[cluster[0]]), int(run_positions[cluster[-1]]) + 1
+        if position_2 - position_1 > max_line_thickness:
+            continue
+        start, end = int(run_starts[cluster].min()), int(run_ends[cluster].max())
+        lines.append([start, position_1, end, position_2] if axis == 1 else [position_1, start, position_2, end])
+    return lines
+
+
+def cluster_line_positions(positions: np.ndarray, max_gap: int):
+    """
+    Groups sorted positions into clusters in which neighbouring positions differ by at most max_gap
+    :param positions: sorted positions, e.g., the rows of line runs
+    :param max_gap: maximum difference between two neighbouring positions of a cluster
+    :return: index arrays of the clusters
+    """
+    if len(positions) == 0:
+        return []
+    split_idxs = np.flatnonzero(np.diff(positions) > max_gap) + 1
+    return np.split(np.arange(len(positions)), split_idxs)
+
+
 def remove_small_bboxes(ocr_page_element: etree.ElementTree, min_bbox_area: int = 3000):
     """
     Removes small ocr bboxes that are considered to be noise
@@ -306,35 +544,131 @@ def remove_small_bboxes(ocr_page_element: etree.ElementTree, min_bbox_area: int
     :param min_bbox_area:
     :return:
     """
-    for carea in ocr_page_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
+    for carea in CAREAS(ocr_page_element):
         x1, y1, x2, y2 = get_element_bbox(carea)
         if (x2-x1) * (y2-y1) < min_bbox_area:
             remove_element_from_hocr_tree(carea)
 
 
+class TableGrid:
+    """
+    Table structure as the sorted unique x positions of the vertical rules and y positions of the horizontal rules.
+    Cell i, j lies between the horizontal rules i and i+1 and the vertical rules j and j+1, so the cells, the table
+    area and the cells that a box covers are computed from the two position arrays instead of nested lists of boxes
+    """
+    def __init__(self, x_positions, y_positions):
+        self.x_positions = np.asarray(x_positions, dtype=np.float64)
+        self.y_positions = np.asarray(y_positions, dtype=np.float64)
+
+    @classmethod
+    def from_lines(cls, vertical_lines, horizontal_lines, pixel_threshold=10):
+        """
+        Builds the grid from the lines of detect_table_lines. Rules whose positions differ by less than pixel_threshold
+        are merged, see select_rule_positions
+        """
+        x_positions = np.sort(np.array([line[0] for line in vertical_lines], dtype=np.float64))
+        y_positions = np.sort(np.array([line[1] for line in horizontal_lines], dtype=np.float64))
+        return cls(x_positions[select_rule_positions(x_positions, pixel_threshold)],
+                   y_positions[select_rule_positions(y_positions, pixel_threshold)])
+
+    @property
+    def shape(self):
+        """
+        Number of rows and columns
+        """
+        return max(len(self.y_positions) - 1, 0), max(len(self.x_positions) - 1, 0)
+
+    def cell_boxes(self) -> np.ndarray:
+        """
+        :return: array of shape (rows, columns, 4) with the box x1, y1, x2, y2 of every cell
+        """
+        rows, columns = self.shape
+        cell_boxes = np.empty((rows, columns, 4), dtype=np.float64)
+        cell_boxes[:, :, 0] = self.x_positions[np.newaxis, :-1]
+        cell_boxes[:, :, 1] = self.y_positions[:-1, np.newaxis]
+        cell_boxes[:, :, 2] = self.x_positions[np.newaxis, 1:]
+        cell_boxes[:, :, 3] = self.y_positions[1:, np.newaxis]
+        return cell_boxes
+
+    def td_boxes(self):
+        """
+        Returns the cells in the pattern
+        [
+        [[x11], [x12], [x13]]
+        [[x21], [x22], [x33]]
+        [[x31], [x32], [x33]]
+        ] where xij = x1, y1, x2, y2, which expand_td_boxes changes in place
+        """
+        return self.cell_boxes().tolist()
+
+    def area(self):
+        """
+        :return: x1, y1, x2, y2 of the table or four None if the grid has no cells
+        """
+        if 0 in self.shape:
+            return [None, None, None, None]
+        return [float(self.x_positions[0]), float(self.y_positions[0]),
+                float(self.x_positions[-1]), float(self.y_positions[-1])]
+
+    def cell_spans(self, boxes, tolerance: float = 0) -> np.ndarray:
+        """
+        Finds the cells that each box overlaps, e.g., to recognize a cell that was expanded over a rule as merged cell.
+        Boxes overlap cells with the inclusive semantics of rectangles_overlap, so a box that ends on a rule also
+        overlaps the cell behind it
+        :param boxes: array-like of shape (n, 4) with x1, y1, x2, y2
+        :param tolerance: Each box is shrunk by tolerance on every side (at most to its center) first, so that a box that
+        reaches less than tolerance over a rule does not overlap the cell behind it
+        :return: array of shape (n, 4) with the first row, first column, last row and last column of the overlapped
+        cells. A box that overlaps no cell has a last row (column) smaller than its first row (column)
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if tolerance > 0:
+            centers = np.concatenate([boxes[:, :2] + boxes[:, 2:], boxes[:, :2] + boxes[:, 2:]], axis=1) / 2
+            boxes = np.concatenate([np.minimum(boxes[:, :2] + tolerance, centers[:, :2]),
+                                    np.maximum(boxes[:, 2:] - tolerance, centers[:, 2:])], axis=1)
+        rows, columns = self.shape
+        # Cell j overlaps [x1, x2] if x_j <= x2 and x1 <= x_j+1
+        first_columns = np.searchsorted(self.x_positions[1:columns + 1], boxes[:, 0], side='left')
+        last_columns = np.searchsorted(self.x_positions[:columns], boxes[:, 2], side='right') - 1
+        first_rows = np.searchsorted(self.y_positions[1:rows + 1], boxes[:, 1], side='left')
+        last_rows = np.searchsorted(self.y_positions[:rows], boxes[:, 3], side='right') - 1
+        return np.stack([first_rows, first_columns, last_rows, last_columns], axis=1)
+
+
+def cells_over_rules(grid: TableGrid, td_boxes, pixel_threshold=10) -> np.ndarray:
+    """
+    Finds the cells whose box in td_boxes reaches more than pixel_threshold over a rule of grid, i.e., into another
+    cell or out of the table area. After expand_td_boxes, these are the cells whose content crosses the rules, e.g.,
+    merged cells
+    :param grid: grid that td_boxes were built from
+    :param td_boxes: boxes of the cells of grid, see TableGrid.td_boxes
+    :param pixel_threshold: distance that a box may reach over a rule, like the distance of merged rules in from_lines
+    :return: boolean array of shape grid.shape
+    """
+    rows, columns = grid.shape
+    if rows == 0 or columns == 0:
+        return np.zeros((rows, columns), dtype=bool)
+    cell_boxes = np.array(td_boxes, dtype=np.float64).reshape(-1, 4)
+    first_rows, first_columns, last_rows, last_columns = grid.cell_spans(cell_boxes, tolerance=pixel_threshold).T
+    cell_rows, cell_columns = np.divmod(np.arange(rows * columns), columns)
+    over_inner_rules = (first_rows < cell_rows) | (last_rows > cell_rows) | (first_columns < cell_columns) | \
+        (last_columns > cell_columns)
+    # A box beyond the outer rules still only overlaps the outer cells
+    table_x1, table_y1, table_x2, table_y2 = grid.area()
+    over_outer_rules = (cell_boxes[:, 0] < table_x1 - pixel_threshold) | \
+        (cell_boxes[:, 1] < table_y1 - pixel_threshold) | (cell_boxes[:, 2] > table_x2 + pixel_threshold) | \
+        (cell_boxes[:, 3] > table_y2 + pixel_threshold)
+    return (over_inner_rules | over_outer_rules).reshape(rows, columns)
+
+
 def build_table_data_boxes(vertical_lines, horizontal_lines):
     """
-    Builds the table boxes from the sets of vertical and horizontal lines in the pattern:
-    [
-    [[x11], [x12], [x13]]
-    [[x21], [x22], [x33]]
-    [[x31], [x32], [x33]]
-    ] where xij = x1, y1, x2, y2
+    Builds the table boxes from the sets of vertical and horizontal lines, see TableGrid.td_boxes
     :param vertical_lines:
     :param horizontal_lines:
     :return:
     """
-    table_boxes = []
-    for i in range(1, len(horizontal_lines)):
-        table_line = []
-        prev_hor_y = horizontal_lines[i - 1][1]
-        hor_y = horizontal_lines[i][1]
-        for j in range(1, len(vertical_lines)):
-            prev_ver_x = vertical_lines[j - 1][0]
-            ver_x = vertical_lines[j][0]
-            table_line.append([prev_ver_x, prev_hor_y, ver_x, hor_y])
-        table_boxes.append(table_line)
-    return table_boxes
+    return TableGrid.from_lines(vertical_lines, horizontal_lines).td_boxes()
 
 
 def box_equivalence(box_1, box_2, pixel_threshold=10):
@@ -366,7 +700,7 @@ def remove_words_on_table_lines(hocr_table_carea_element: etree.ElementTree, hli
     the offset where the cropped image begins is necessary
     :return:
     """
-    ocr_careas = hocr_table_carea_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+    ocr_careas = CAREAS(hocr_table_carea_element)
     # TODO: In dem genutzten PSM sind alle Zeilen eine Textzeile -> Zu hohe Zeilen entfernen
     for carea in ocr_careas:
         carea_bbox = get_element_bbox(carea)
@@ -466,23 +800,31 @@ def extend_table_data_areas_to_content(hocr_table_re_ocred_tree: etree.ElementTr
     """
     # Für horizontale merges: Mindestlänge, die in rechtes / linkes Feld regen muss
     # Für vertikale merges: Prozentteil, der in unteres / oberes Feld ragen muss
-    carea_elements = hocr_table_re_ocred_tree.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)
+    carea_elements = CAREAS(hocr_table_re_ocred_tree)
     merge_clusters = []
+    # Only boxes that overlap a carea can be merged, so the candidates are looked up in a grid over the td_boxes.
+    #  The ids are in row-major order, which keeps the order of the cluster elements
+    td_box_positions = [(row_idx, col_idx) for row_idx in range(len(td_boxes)) for col_idx in range(len(td_boxes[row_idx]))]
+    td_box_grid = BboxGrid([(td_boxes[row_idx][col_idx][0] - coordinate_offset[0],
+                             td_boxes[row_idx][col_idx][1] - coordinate_offset[1],
+                             td_boxes[row_idx][col_idx][2] - coordinate_offset[0],
+                             td_boxes[row_idx][col_idx][3] - coordinate_offset[1])
+                            for row_idx, col_idx in td_box_positions])
     for carea_element in carea_elements:
         carea_bbox = get_element_bbox(carea_element)
         cluster_elements = []
-        for row_idx in range(len(td_boxes)):
-            for col_idx in range(len(td_boxes[row_idx])):
-                td_box_x1, td_box_y1, td_box_x2, td_box_y2 = td_boxes[row_idx][col_idx]
-                td_box_with_offset = (td_box_x1 - coordinate_offset[0], td_box_y1 - coordinate_offset[1],
-                                      td_box_x2 - coordinate_offset[0], td_box_y2 - coordinate_offset[1])
-                if np.abs(calculate_vertical_overlap(carea_bbox, td_box_with_offset)) > 5:  # A minimum opverlap before merging the boxes
-                    if calculate_overlap_percentage(carea_bbox, td_box_with_offset) > 30:  # TODO Parameterwahl begründen (10 war ganz gut?)
-                        # Percentage
-                        cluster_elements.append((row_idx, col_idx))
-                    if np.abs(calculate_horizontal_overlap(carea_bbox, td_box_with_offset)) > 30:
-                        # Pixels
-                        cluster_elements.append((row_idx, col_idx))
+        for td_box_id in td_box_grid.query(carea_bbox):
+            row_idx, col_idx = td_box_positions[td_box_id]
+            td_box_x1, td_box_y1, td_box_x2, td_box_y2 = td_boxes[row_idx][col_idx]
+            td_box_with_offset = (td_box_x1 - coordinate_offset[0], td_box_y1 - coordinate_offset[1],
+                                  td_box_x2 - coordinate_offset[0], td_box_y2 - coordinate_offset[1])
+            if np.abs(calculate_vertical_overlap(carea_bbox, td_box_with_offset)) > 5:  # A minimum opverlap before merging the boxes
+                if calculate_overlap_percentage(carea_bbox, td_box_with_offset) > 30:  # TODO Parameterwahl begründen (10 war ganz gut?)
+                    # Percentage
+                    cluster_elements.append((row_idx, col_idx))
+                if np.abs(calculate_horizontal_overlap(carea_bbox, td_box_with_offset)) > 30:
+                    # Pixels
+                    cluster_elements.append((row_idx, col_idx))
         if len(cluster_elements) > 1:
             merge_clusters.append(cluster_elements)
     for merge_cluster in merge_clusters:
@@ -503,7 +845,7 @@ def remove_false_words(hocr_table_carea_element: etree.ElementTree):
     :param hocr_table_carea_element:
     :return:
     """
-    words = hocr_table_carea_element.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
+    words = WORDS(hocr_table_carea_element)
     # Remove all words that consist only of punctuation and are larger than most of the rest of the text
     word_heights = [(y2 - y1) for _, y1, _, y2 in (get_element_bbox(word) for word in words)]
     word_height_mean = np.mean(word_heights)
@@ -519,8 +861,8 @@ def remove_false_words(hocr_table_carea_element: etree.ElementTree):
         if not word_height_mean - 3 * word_height_std <= word_height <= word_height_mean + 3 * word_height_std:
             if parent is not None:
                 parent.remove(word)
-    for carea in hocr_table_carea_element.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-        carea_words = carea.xpath(".//x:span[@class='ocrx_word']", namespaces=NAMESPACES)
+    for carea in CAREAS(hocr_table_carea_element):
+        carea_words = WORDS(carea)
         if not carea_words:
             parent = carea.getparent()
             parent.remove(carea)
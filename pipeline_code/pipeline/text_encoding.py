@@ -1,21 +1,28 @@
 from xml.sax.saxutils import escape
+import os
 import lxml.etree as etree
 import re
-from typing import Tuple
-from pytesseract import pytesseract
+from typing import List, Tuple
 from pipeline.resegmentation.paragraph_splitting_y import split_ocr_careas_horizontally
 from pipeline.resegmentation.paragraph_merging_x import merge_careas_on_x_axis_in_document_tree
 from pipeline.hocr_tools.hocr_helpers import get_element_bbox, build_ocr_carea_text, combine_hocr_pages
+from pipeline.hocr_tools.hocr_properties import DocumentStats
 from pipeline.tei_encoding.layout_extraction import get_header_elements, remove_pre_text_elements, \
-    remove_empty_careas, get_body_and_appendix_tree
+    remove_empty_careas, remove_empty_careas_from_page, relayout_pages, get_body_and_appendix_tree
 from pipeline.tei_encoding.metadata_extraction import build_tei_header
 from pipeline.constants import NAMESPACES, TEMP_WORKSPACE_ROOT_DIR, TEI_NAMESPACE, EMPTY_TEI_HEADER
 from pipeline.tei_encoding.table_processing.table_encoding import encode_table
+from pipeline.tei_encoding.ocr_engine import get_engine_pool
 from pipeline.pipeline_logger import file_logger
+from pipeline.stage_checkpoints import StageCheckpoints
+from pipeline.instrumentation import instrumented, instrumented_stage, start_instrumentation, stop_instrumentation, \
+    count
+from pipeline.tei_encoding.page_images import PageImageProvider
+from pipeline.page_pool import PagePool, map_pages, map_page_elements
 
 
 # These should be expandable to "FIRST_LEVEL_HEADLINE_PATTERN"
-from .tei_encoding.ocr_tools import encode_carea_lines_as_p, re_ocr_carea
+from .tei_encoding.ocr_tools import encode_carea_lines_as_p, re_ocr_carea, ReOcrPrefetcher, PageReOcr
 
 
 TEIL_PATTERN_1 = re.compile(r"^Teil\s*\d\s*$")  # Teil 1
@@ -45,120 +52,337 @@ TOC_ELEMENT_PATTERN = re.compile(r"^„*(§|5|8|S|s|&amp;|\$)+\s*\d+[a-z]+\s*\b"
 FOOTNOTE_PATTERN = re.compile(r"^\*+\)*\s*")
 
 
-def encode_hocr_tree_in_tei(hocr_tree: etree.ElementTree, images, max_area_dist: int = 50, logger=None):
+def encode_hocr_tree_in_tei(hocr_tree: etree.ElementTree, images, max_area_dist: int = 50, logger=None,
+                            ocr_prefetch_workers: int = 0, checkpoint_dir: str = None, resume_from: str = None,
+                            metrics_path: str = None, page_workers: int = 0, relayout_mode: str = 'selective',
+                            table_ocr_mode: str = 'cell', table_line_detection: str = 'hocr'):
+    """
+    Encodes an hOCR document in TEI by running the stages in PIPELINE_STAGES one after another
+    :param hocr_tree: hOCR tree of the whole document. It is not needed if the run resumes after the first stage
+    :param images: images of the pages
+    :param max_area_dist: maximum distance between two careas at the same height that are merged
+    :param logger: logger for the progress and errors
+    :param ocr_prefetch_workers: If > 0, the careas of the body are re-OCRed ahead of the encoding by so many threads
+    :param checkpoint_dir: If given, the artefacts of every stage are stored in this directory
+    :param resume_from: name of the stage to resume from with the checkpoints of the stages before it in checkpoint_dir
+    :param metrics_path: If given, the time and OCR calls of each stage are written as JSON to this path
+    :param page_workers: If > 1, the page-local work (resegmentation, headers, empty careas, x-merge, re-OCR of the
+    careas and tables) runs in so many threads with one task per page. The body structure is still built sequentially
+    :param relayout_mode: If empty careas (e.g., lines between columns) were removed from the body, the layout of the
+    body is analyzed again. 'selective' only analyzes the pages again whose images were masked and reuses the
+    statistics of the first pass, 'full' analyzes all body pages again and processes them like a new document
+    :param table_ocr_mode: 'cell' recognizes every table cell of the appendix on its own, 'region' recognizes the table
+    area of a page once and only recognizes the cells on their own whose words cannot be assigned clearly
+    :param table_line_detection: 'hocr' takes the table lines of the appendix from the careas of Tesseract that only
+    contain empty words, 'image' finds the ruling lines in the page images
+    :return: TEI ElementTree
+    """
     # Set up the logger if it was None
     if logger is None:
         logger = file_logger()
+    stage_names = [stage_name for stage_name, _, _ in PIPELINE_STAGES]
+    first_stage_idx = 0
+    if resume_from is not None:
+        if resume_from not in stage_names:
+            raise ValueError(f"Unknown stage '{resume_from}', the stages are {stage_names}")
+        if checkpoint_dir is None:
+            raise ValueError("A checkpoint_dir is needed to resume from a stage")
+        first_stage_idx = stage_names.index(resume_from)
+    # All options are checked before the page pool and the checkpoint images are created, which have to be released
+    if relayout_mode not in ('selective', 'full'):
+        raise ValueError(f"Unknown relayout_mode '{relayout_mode}', it must be 'selective' or 'full'")
+    if table_ocr_mode not in ('cell', 'region'):
+        raise ValueError(f"Unknown table_ocr_mode '{table_ocr_mode}', it must be 'cell' or 'region'")
+    if table_line_detection not in ('hocr', 'image'):
+        raise ValueError(f"Unknown table_line_detection '{table_line_detection}', it must be 'hocr' or 'image'")
+    checkpoints = StageCheckpoints(checkpoint_dir) if checkpoint_dir is not None else None
+
+    state = {"hocr_tree": hocr_tree, "images": images}
+    page_pool = None
+    instrumentation = None
+    try:
+        if first_stage_idx > 0:
+            state.update(load_stage_artefacts(checkpoints, first_stage_idx))
+            logger.info(f"Resuming from stage '{resume_from}'")
+        page_pool = create_page_pool(page_workers) if page_workers > 1 else None
+        options = {"max_area_dist": max_area_dist, "ocr_prefetch_workers": ocr_prefetch_workers,
+                   "page_pool": page_pool, "relayout_mode": relayout_mode, "table_ocr_mode": table_ocr_mode,
+                   "table_line_detection": table_line_detection}
+        if metrics_path is not None:
+            instrumentation = start_instrumentation(document=os.path.basename(metrics_path).split(".")[0])
+        with instrumented_stage("encode_hocr_tree_in_tei"):
+            for stage_idx in range(first_stage_idx, len(PIPELINE_STAGES)):
+                stage_name, run_stage, outputs = PIPELINE_STAGES[stage_idx]
+                with instrumented_stage(stage_name):
+                    run_stage(state, logger, options)
+                if checkpoints is not None:
+                    checkpoints.save(stage_idx, stage_name, {output: state[output] for output in outputs})
+        if state["images"] is not None:
+            count("pages", len(state["images"]))
+    finally:
+        if page_pool is not None:
+            page_pool.shutdown()
+        # Images that were loaded from a checkpoint are removed from the temporary cache again
+        if state["images"] is not images and isinstance(state["images"], PageImageProvider):
+            state["images"].close()
+        if instrumentation is not None:
+            stop_instrumentation()
+            instrumentation.write_json(metrics_path)
+
+    tei_elem = etree.Element("TEI", version="3.3.0", xmlns=TEI_NAMESPACE)
+    tei_elem.append(state["tei_header"])
+    text_elem = etree.Element("text")
+    text_elem.append(state["encoded_body"])
+    text_elem.append(state["encoded_appendix"])
+    tei_elem.append(text_elem)
+    tei_tree = etree.ElementTree(tei_elem)
+    return tei_tree
+
+
+def create_page_pool(page_workers: int) -> PagePool:
+    """
+    Creates the pool for the page-local work and makes sure that the OCR engine pools have an engine for every worker
+    """
+    if page_workers > 1:
+        # Every worker needs its own engine for the re-OCR, the table cells and the new layout analysis of pages
+        for psm, dpi in [(6, None), (6, 300), (3, 300)]:
+            get_engine_pool(lang='deu', psm=psm, dpi=dpi, max_size=page_workers)
+    return PagePool(max_workers=page_workers)
 
+
+def load_stage_artefacts(checkpoints: StageCheckpoints, first_stage_idx: int) -> dict:
+    """
+    Loads the latest version of every artefact that the stages before first_stage_idx produced
+    :param checkpoints: checkpoints of an earlier run
+    :param first_stage_idx: index of the stage the run resumes from
+    :return: name and value of each artefact
+    """
+    artefacts = {}
+    try:
+        for stage_idx in reversed(range(first_stage_idx)):
+            stage_name, _, outputs = PIPELINE_STAGES[stage_idx]
+            missing_outputs = [output for output in outputs if output not in artefacts]
+            if missing_outputs:
+                artefacts.update(checkpoints.load(stage_idx, stage_name, names=missing_outputs))
+    except Exception:
+        # Images that were already loaded are removed from the temporary cache if a later checkpoint is missing
+        for artefact in artefacts.values():
+            if isinstance(artefact, PageImageProvider):
+                artefact.close()
+        raise
+    return artefacts
+
+
+def split_careas_stage(state: dict, logger, options: dict):
     # Splitting muss vor den Headern passieren, weil manche Header mit der Zeile darunter erkannt wurden
 
+    # Document-level statistics are computed once per state of the tree and shared by the steps below
+    state["document_stats"] = DocumentStats(state["hocr_tree"])
+
     # Step 1: Split the ocr_carea elements
+    state["max_line_dist"] = -1
     try:
-        split_ocr_careas_horizontally(hocr_tree)
+        max_line_dist = split_ocr_careas_horizontally(state["hocr_tree"], document_stats=state["document_stats"],
+                                                      page_pool=options["page_pool"])
+        state["max_line_dist"] = float(max_line_dist)
         logger.info("Split careas horizontally")
     except Exception as e:
         logger.exception("Error splitting careas horizontally: %s", e, exc_info=True)
 
+
+def extract_headers_stage(state: dict, logger, options: dict):
+    hocr_tree = state["hocr_tree"]
     # Step 2: Extract the page headers
     try:
-        headers = [get_header_elements(page) for page in hocr_tree.xpath("//x:div[@class='ocr_page']",
-                                                                         namespaces=NAMESPACES)]
+        headers = map_page_elements(get_header_elements,
+                                    hocr_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES),
+                                    page_pool=options["page_pool"])
         logger.info("Extracted headers")
     except Exception as e:
         headers = [[] for _ in range(len(hocr_tree.xpath("//x:div[@class='ocr_page']",
                                                          namespaces=NAMESPACES)))]
         logger.exception("Error extracting header elements: %s", e, exc_info=True)
+    state["headers"] = headers
+    # The headers are no longer part of the tree
+    if "document_stats" in state:
+        state["document_stats"].invalidate()
+
 
+def remove_pre_text_stage(state: dict, logger, options: dict):
+    if "document_stats" not in state:
+        state["document_stats"] = DocumentStats(state["hocr_tree"])
     # Step 3: Remove any elements that do not belong to the regulation
+    state["line_height_mean_and_std"] = None
     try:
-        remove_pre_text_elements(hocr_tree, logger=logger)
+        # The line heights of the whole document are kept for pages whose layout is analyzed again later
+        state["line_height_mean_and_std"] = tuple(float(value) for value in
+                                                  state["document_stats"].line_height_mean_and_std)
+        remove_pre_text_elements(state["hocr_tree"], logger=logger, document_stats=state["document_stats"])
         logger.info("Removed pre-text elements")
     except Exception as e:
         logger.exception("Error removing pre-text elements: %s", e, exc_info=True)
 
+
+def split_body_appendix_stage(state: dict, logger, options: dict):
     # Step 4: Split body and appendix
     try:
-        body_tree, appendix_tree = get_body_and_appendix_tree(hocr_tree)
+        body_tree, appendix_tree = get_body_and_appendix_tree(state["hocr_tree"])
         logger.info("Split body from appendix")
     except Exception as e:
         logger.exception("Unable to split body from appendix: %s", e, exc_info=True)
         raise ValueError("The document does not have the required form to be encoded")
     appendix_page_start_idx = len(body_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES))
     # Storing at which page index the appendix starts
-    text_headers = headers[:appendix_page_start_idx]
-    appendix_headers = headers[appendix_page_start_idx:]
+    state["body_tree"] = body_tree
+    state["appendix_tree"] = appendix_tree
+    state["appendix_page_start_idx"] = appendix_page_start_idx
+    state["text_headers"] = state["headers"][:appendix_page_start_idx]
+    state["appendix_headers"] = state["headers"][appendix_page_start_idx:]
     logger.info("Separated headers")
 
+
+def remove_empty_careas_stage(state: dict, logger, options: dict):
+    body_tree = state["body_tree"]
+    images = state["images"]
+    page_pool = options["page_pool"]
     # Step 5: Prepare the body for encoding
     # 5.1: Remove the lines that are in the image (regulations from the 70s have a line between text columns)
     try:
         pre_empty_area_removal_carea_count = len(body_tree.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES))
-        remove_empty_careas(body_tree, images)
+        masked_page_idxs = remove_empty_careas(body_tree, images, page_pool=page_pool)
         post_empty_area_removal_carea_count = len(body_tree.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES))
         logger.info("Removed lines from image and hOCR")
         # Documents where a line was between the text columns often have worse results.
         # Therefore, some of the steps have to be applied again
-        if post_empty_area_removal_carea_count < pre_empty_area_removal_carea_count:
+        if post_empty_area_removal_carea_count < pre_empty_area_removal_carea_count and \
+                options["relayout_mode"] == 'selective':
+            logger.info(f"Pre-text elements had to be removed, analyzing the layout of pages {masked_page_idxs} again")
+            relayout_masked_pages(state, masked_page_idxs, logger, page_pool=page_pool)
+        elif post_empty_area_removal_carea_count < pre_empty_area_removal_carea_count:
             logger.info("Pre-text elements had to be removed")
-            body_tree = combine_hocr_pages([etree.fromstring(bytes(pytesseract.run_and_get_output(image, 'hocr', 'deu', '--dpi 300', '--psm 3'), 'utf-8')) for image in images[:appendix_page_start_idx]])
-            text_headers = [get_header_elements(page) for page in body_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES)]
-            split_ocr_careas_horizontally(body_tree)
-            remove_pre_text_elements(body_tree, logger=logger)
-            remove_empty_careas(body_tree, images)
+            page_ocr_engine_pool = get_engine_pool(lang='deu', psm=3, dpi=300)
+
+            def analyze_page_layout(page_idx):
+                return etree.fromstring(bytes(page_ocr_engine_pool.image_to_hocr(images[page_idx]), 'utf-8'))
+            body_tree = combine_hocr_pages(map_pages(analyze_page_layout, range(state["appendix_page_start_idx"]), page_pool=page_pool), move_pages=True)
+            state["text_headers"] = map_page_elements(get_header_elements, body_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES), page_pool=page_pool)
+            body_document_stats = DocumentStats(body_tree)
+            split_ocr_careas_horizontally(body_tree, document_stats=body_document_stats, page_pool=page_pool)
+            remove_pre_text_elements(body_tree, logger=logger, document_stats=body_document_stats)
+            remove_empty_careas(body_tree, images, page_pool=page_pool)
             # print(etree.tostring(body_tree, pretty_print=True, encoding='unicode'))
             # plot_hocr_bboxes(body_tree, hocr_input_image=images[0], page_idx=0, ocr_carea=True, ocr_line=True)
     except Exception as e:
         logger.exception("Error removing lines from the body tree: %s", e, exc_info=True)
+    state["body_tree"] = body_tree
+
+
+def relayout_masked_pages(state: dict, masked_page_idxs: List[int], logger, page_pool: PagePool = None):
+    """
+    Analyzes the layout of the body pages whose images were masked again and repeats the header extraction, the
+    splitting, the pre-text removal and the removal of empty careas on these pages only. The maximum line space and the
+    line heights of the first pass over the document are reused, so that the statistics are not computed from a mix of
+    old and new pages
+    :param state: state of the pipeline with the body_tree, the images, the text_headers and the statistics of the first
+    pass. If the line heights of the first pass are missing, they are computed from the body
+    :param masked_page_idxs: indices of the masked pages in the body
+    :param logger: logger for the progress
+    :param page_pool: If given, the pages are processed in this pool
+    """
+    body_tree = state["body_tree"]
+    images = state["images"]
+    new_pages = relayout_pages(body_tree, images, masked_page_idxs, page_pool=page_pool)
+    new_headers = map_page_elements(get_header_elements, new_pages, page_pool=page_pool)
+    for page_idx, headers in zip(masked_page_idxs, new_headers):
+        state["text_headers"][page_idx] = headers
+    if state["max_line_dist"] >= 0:
+        split_ocr_careas_horizontally(body_tree, max_line_space=state["max_line_dist"], page_pool=page_pool,
+                                      pages=new_pages)
+    remove_pre_text_elements(body_tree, logger=logger, line_height_mean_and_std=state["line_height_mean_and_std"])
+    map_page_elements(lambda page, page_idx: remove_empty_careas_from_page(page, images[page_idx]), new_pages,
+                      masked_page_idxs, page_pool=page_pool)
+
+
+def merge_careas_stage(state: dict, logger, options: dict):
     # 5.2: Re-merge the elements on the x-axis that were detected separately
     # Erweitern statt mergen in body (Dafür nur 2er-cluster machen)
     #  Dafür: minimales x1, maximales y1, maximales x2, minimales y2 aus den beiden clustern
     try:
-        merge_careas_on_x_axis_in_document_tree(body_tree, max_area_dist=max_area_dist)
+        merge_careas_on_x_axis_in_document_tree(state["body_tree"], max_area_dist=options["max_area_dist"],
+                                                page_pool=options["page_pool"])
         logger.info("Merged careas in body-tree")
     except Exception as e:
         logger.exception("Error merging careas in body tree: %s", e, exc_info=True)
     # plot_hocr_bboxes(appendix_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES)[0], hocr_input_image=images[appendix_page_start_idx], ocr_carea=True, ocr_line=True, ocr_word=True)
     try:
-        merge_careas_on_x_axis_in_document_tree(appendix_tree, max_area_dist=max_area_dist)
+        merge_careas_on_x_axis_in_document_tree(state["appendix_tree"], max_area_dist=options["max_area_dist"],
+                                                page_pool=options["page_pool"])
         logger.info("Merged careas in appendix-tree")
     except Exception as e:
         logger.exception("Error merging careas in appendix tree: %s", e, exc_info=True)
 
+
+def encode_tei_header_stage(state: dict, logger, options: dict):
     # Step 6: Encode the teiHeader
     try:
-        tei_header = build_tei_header(body_tree, logger=logger)  # The header is generated from information in the body
+        tei_header = build_tei_header(state["body_tree"], logger=logger)  # The header is generated from information in the body
         logger.info("Header encoded")
     except Exception as e:
         logger.exception("Error encoding teiHeader: %s", e, exc_info=True)
         tei_header = etree.fromstring(EMPTY_TEI_HEADER)
+    state["tei_header"] = tei_header
+
 
+def encode_body_stage(state: dict, logger, options: dict):
     # Step 7: Encode the body
+    # If workers are given, the careas of the current and the next page are re-OCRed ahead of the encoding
+    ocr_prefetch_workers = options["ocr_prefetch_workers"]
+    prefetcher = ReOcrPrefetcher(max_workers=ocr_prefetch_workers) if ocr_prefetch_workers > 0 else None
     try:
-        encoded_body = encode_body_tree(body_tree, images, body_header_elements=text_headers, logger=logger)
+        encoded_body = encode_body_tree(state["body_tree"], state["images"], body_header_elements=state["text_headers"],
+                                        logger=logger, prefetcher=prefetcher, page_pool=options["page_pool"])
         logger.info("Body encoded")
     except Exception as e:
         logger.exception("Error encoding body: %s", e, exc_info=True)
         encoded_body = etree.fromstring("<body/>")
+    finally:
+        if prefetcher is not None:
+            prefetcher.shutdown()
+    state["encoded_body"] = encoded_body
 
+
+def encode_appendix_stage(state: dict, logger, options: dict):
     # Step 8: Encode the appendix
+    appendix_page_start_idx = state["appendix_page_start_idx"]
     try:
-        encoded_appendix = encode_appendix_tree(appendix_tree, images[appendix_page_start_idx:],
+        encoded_appendix = encode_appendix_tree(state["appendix_tree"], state["images"][appendix_page_start_idx:],
                                                 num_body_pages=appendix_page_start_idx,
-                                                appendix_header_elements=appendix_headers,
-                                                logger=logger)
+                                                appendix_header_elements=state["appendix_headers"],
+                                                logger=logger, page_pool=options["page_pool"],
+                                                table_ocr_mode=options["table_ocr_mode"],
+                                                table_line_detection=options["table_line_detection"])
         logger.info("Appendix encoded")
     except Exception as e:
         logger.exception("Error encoding appendix: %s", e, exc_info=True)
         encoded_appendix = etree.fromstring("<back/>")
-
-    tei_elem = etree.Element("TEI", version="3.3.0", xmlns=TEI_NAMESPACE)
-    tei_elem.append(tei_header)
-    text_elem = etree.Element("text")
-    text_elem.append(encoded_body)
-    text_elem.append(encoded_appendix)
-    tei_elem.append(text_elem)
-    tei_tree = etree.ElementTree(tei_elem)
-    return tei_tree
+    state["encoded_appendix"] = encoded_appendix
+
+
+# Name, function and the artefacts of each stage that are stored in a checkpoint. A stage reads the artefacts of the
+# stages before it from the state and writes its own artefacts into it
+PIPELINE_STAGES = [
+    ("split_careas", split_careas_stage, ["hocr_tree", "max_line_dist"]),
+    ("extract_headers", extract_headers_stage, ["hocr_tree", "headers"]),
+    ("remove_pre_text", remove_pre_text_stage, ["hocr_tree", "line_height_mean_and_std"]),
+    ("split_body_appendix", split_body_appendix_stage,
+     ["body_tree", "appendix_tree", "appendix_page_start_idx", "text_headers", "appendix_headers"]),
+    ("remove_empty_careas", remove_empty_careas_stage, ["body_tree", "text_headers", "images"]),
+    ("merge_careas", merge_careas_stage, ["body_tree", "appendix_tree"]),
+    # The title and the other metadata are removed from the body while the teiHeader is built
+    ("encode_tei_header", encode_tei_header_stage, ["tei_header", "body_tree"]),
+    ("encode_body", encode_body_stage, ["encoded_body"]),
+    ("encode_appendix", encode_appendix_stage, ["encoded_appendix"]),
+]
 
 
 def sanitize_line(line: str):
@@ -172,12 +396,17 @@ def sanitize_line(line: str):
     return modified_string.strip()
 
 
+@instrumented()
 def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image],
                      bbox_margins: Tuple[int, int, int, int] = (20, 5, 5, 5),
                      body_header_elements=None,
-                     logger=None) -> etree.ElementTree:
+                     logger=None,
+                     prefetcher: ReOcrPrefetcher = None,
+                     page_pool: PagePool = None) -> etree.ElementTree:
     if logger is None:
         logger = file_logger(None)
+    # With a prefetcher, the re-OCR results of the careas are requested from its thread pool
+    carea_ocr = re_ocr_carea if prefetcher is None else prefetcher.re_ocr_carea
     body = etree.Element("body")
     current_teil = None
     current_abschnitt = None  # etree.SubElement(body, "div")  # Abschnitt 1
@@ -225,6 +454,16 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
 
     pages = hocr_body_tree.xpath("///x:body/x:div[@class='ocr_page']", namespaces=NAMESPACES)
 
+    if page_pool is not None and prefetcher is None:
+        # The careas of all pages are re-OCRed in the page pool with one task per page while the pages are encoded
+        page_re_ocr = PageReOcr(page_pool)
+        for page_idx in range(len(pages)):
+            page_bbox = tuple(map(int, pages[page_idx].attrib['title'].split(";")[1].strip().split(" ")[1:]))
+            page_re_ocr.submit_page(page_bbox, images[page_idx],
+                                    pages[page_idx].xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES),
+                                    bbox_margins)
+        carea_ocr = page_re_ocr.re_ocr_carea
+
     for page_idx in range(len(pages)):
         logger.info(f"Encoding body's page {page_idx}")
         page = pages[page_idx]
@@ -233,6 +472,16 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
 
         page_bbox = tuple(map(int, page.attrib['title'].split(";")[1].strip().split(" ")[1:]))
 
+        if prefetcher is not None:
+            # Submit the careas of this and the next page as soon as the page is entered
+            prefetcher.discard_page(page_idx - 1)
+            for prefetch_page_idx in range(page_idx, min(page_idx + 2, len(pages))):
+                prefetch_page = pages[prefetch_page_idx]
+                prefetch_page_bbox = tuple(map(int, prefetch_page.attrib['title'].split(";")[1].strip().split(" ")[1:]))
+                prefetcher.prefetch_careas(prefetch_page_idx, prefetch_page_bbox, images[prefetch_page_idx],
+                                           prefetch_page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES),
+                                           bbox_margins)
+
         # Initializing the first elements
         page_img = page.attrib['title'].split(";")[0].replace("\"", "\'").replace(TEMP_WORKSPACE_ROOT_DIR, '').replace('scantailor', 'images').replace('tif', 'png')  # TODO: Hier irgendwie den Server-Pfad berücksichtigen
         pb_string = f'<pb n="{page_idx + 1}" facs="{page_img}" ed="ausbildungsordnung" />'
@@ -260,7 +509,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
         while carea_idx < len(page_careas):
             carea = page_careas[carea_idx]
             # Re-OCR the carea with the page segmentation mode that detects a uniform block of text
-            carea_lines = [sanitize_line(line) for line in re_ocr_carea(page_bbox, page_image, carea, bbox_margins)]
+            carea_lines = [sanitize_line(line) for line in carea_ocr(page_bbox, page_image, carea, bbox_margins)]
             if len(carea_lines) == 0:
                 carea_idx += 1
                 continue
@@ -284,8 +533,8 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
 
                 elif FOOTNOTE_PATTERN.match(carea_lines[0]):
                     logger.info(f"Encoded a footnote on body page {page_idx}")
-                    footnote_text_lines = encode_carea_lines_as_p(re_ocr_carea(page_bbox, page_image,
-                                                                               page_careas[carea_idx], bbox_margins))
+                    footnote_text_lines = encode_carea_lines_as_p(carea_ocr(page_bbox, page_image,
+                                                                            page_careas[carea_idx], bbox_margins))
                     footnote_element = etree.fromstring('<note type="footnote"></note>')
                     footnote_element.append(footnote_text_lines)
                     page_beginning.addnext(footnote_element)
@@ -297,7 +546,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
 
                     next_carea = page_careas[carea_idx + 2] if carea_idx + 2 < len(page_careas) else pages[page_idx+1].xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES)[0]
                     next_carea_image = page_image if len(page_careas) >= carea_idx+2 else images[page_idx+1]
-                    next_text_lines = re_ocr_carea(page_bbox, next_carea_image, next_carea, bbox_margins)
+                    next_text_lines = carea_ocr(page_bbox, next_carea_image, next_carea, bbox_margins)
 
                     # Check if this carea still belongs to the table of contents
                     if (TEIL_PATTERN_1.match(carea_lines[0]) and PARAGRAPH_PATTERN.match(next_text_lines[0])) or \
@@ -316,7 +565,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
                     # These are the same criteria as for a new section in the text
                     if TEIL_PATTERN_1.match(carea_lines[0]) or TEIL_PATTERN_2.match(carea_lines[0]):
                         teil_number_str = '<lb />\n'.join(carea_lines)
-                        next_text_lines = re_ocr_carea(page_bbox, page_image, page_careas[carea_idx + 1], bbox_margins)
+                        next_text_lines = carea_ocr(page_bbox, page_image, page_careas[carea_idx + 1], bbox_margins)
                         teil_headline = '<lb />\n'.join(next_text_lines)
                         toc_teil = etree.fromstring(f'<item n="{toc_teil_element_number}"><p>{str(teil_number_str)}<lb />{teil_headline}</p></item>')
                         toc_teil_element_number += 1
@@ -328,7 +577,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
                         continue
                     elif ABSCHNITT_PATTERN_1.match(carea_lines[0]) or ABSCHNITT_PATTERN_2.match(carea_lines[0]):
                         abschnitt_number_str = '<lb />\n'.join(carea_lines)
-                        next_text_lines = re_ocr_carea(page_bbox, page_image, page_careas[carea_idx + 1], bbox_margins)
+                        next_text_lines = carea_ocr(page_bbox, page_image, page_careas[carea_idx + 1], bbox_margins)
                         abschnitt_headline = '<lb />\n'.join(next_text_lines)
                         toc_abschnitt = etree.fromstring(f'<item n="{toc_abschnitt_element_number}"><p>{str(abschnitt_number_str)}<lb />{abschnitt_headline}</p></item>')
                         toc_abschnitt_element_number += 1
@@ -372,7 +621,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
                     #  This will be used to build <head> - elements and update the counter variable.
                     #  The same thing happens when a paragraph was detected
                     teil_number_str = '<lb />\n'.join(carea_lines)
-                    next_text_lines = re_ocr_carea(page_bbox, page_image, page_careas[carea_idx + 1], bbox_margins)
+                    next_text_lines = carea_ocr(page_bbox, page_image, page_careas[carea_idx + 1], bbox_margins)
                     teil_headline = '<lb />\n'.join(next_text_lines)
                     head_element = etree.fromstring(f'<head>{str(teil_number_str)}<lb />{teil_headline}</head>')
                     current_second_level_list = None
@@ -401,7 +650,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
                     #  This will be used to build <head> - elements and update the counter variable.
                     #  The same thing happens when a paragraph was detected
                     abschnitt_number_str = '<lb />\n'.join(carea_lines)
-                    next_text_lines = re_ocr_carea(page_bbox, page_image, page_careas[carea_idx+1], bbox_margins)
+                    next_text_lines = carea_ocr(page_bbox, page_image, page_careas[carea_idx+1], bbox_margins)
                     abschnitt_headline = '<lb />\n'.join(next_text_lines)
                     head_element = etree.fromstring(f'<head>{str(abschnitt_number_str)}<lb />{abschnitt_headline}</head>')
                     current_second_level_list = None
@@ -440,7 +689,7 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
                     current_sixth_level_list = None  # This is a list / enumeration "aaaa)"
                     # Now the same thing as for <head> - elements in Abschnitte happens for paragraphs:
                     paragraph_number_str = '<lb />\n'.join(carea_lines)
-                    next_text_lines = re_ocr_carea(page_bbox, page_image, page_careas[carea_idx+1], bbox_margins) if carea_idx+1 < len(page_careas) else []
+                    next_text_lines = carea_ocr(page_bbox, page_image, page_careas[carea_idx+1], bbox_margins) if carea_idx+1 < len(page_careas) else []
                     paragraph_headline = '<lb />\n'.join([escape(line.strip()) for line in next_text_lines])
                     head_element = etree.fromstring(f'<head>{escape(paragraph_number_str.strip())}<lb />{paragraph_headline}</head>')
                     current_paragraph.append(head_element)
@@ -578,10 +827,14 @@ def encode_body_tree(hocr_body_tree: etree.ElementTree, images,  # : List[Image]
     return body  # tei_tree
 
 
+@instrumented()
 def encode_appendix_tree(hocr_appendix_tree: etree.ElementTree, images, num_body_pages: int = 0,
                          bbox_margins: Tuple[int, int, int, int] = (20, 5, 5, 5),
                          appendix_header_elements=None,
-                         logger=None) -> etree.ElementTree:
+                         logger=None,
+                         page_pool: PagePool = None,
+                         table_ocr_mode: str = 'cell',
+                         table_line_detection: str = 'hocr') -> etree.ElementTree:
     """
     Encodes the appendix
     Assumptions:
@@ -593,6 +846,9 @@ def encode_appendix_tree(hocr_appendix_tree: etree.ElementTree, images, num_body
     :param bbox_margins:
     :param appendix_header_elements:
     :param logger: Logger that is used to log
+    :param page_pool: If given, the tables and careas of the pages are encoded in this pool
+    :param table_ocr_mode: how the table cells are recognized, see table_encoding.encode_table
+    :param table_line_detection: where the table lines are found, see table_encoding.encode_table
     :return:
     """
     if logger is None:
@@ -600,11 +856,15 @@ def encode_appendix_tree(hocr_appendix_tree: etree.ElementTree, images, num_body
     # TODO: Anhang-Überschriften usw.
     back = etree.Element("back")
     pages = hocr_appendix_tree.xpath("//x:div[@class='ocr_page']", namespaces=NAMESPACES)
+    # The content of each page only depends on the page, so the pages are encoded first and joined in order afterward
+    page_contents = map_page_elements(lambda page, page_idx: encode_appendix_page(page, images[page_idx], page_idx,
+                                                                                  bbox_margins=bbox_margins,
+                                                                                  logger=logger,
+                                                                                  table_ocr_mode=table_ocr_mode,
+                                                                                  table_line_detection=table_line_detection),
+                                      pages, range(len(pages)), page_pool=page_pool)
 
     for page_idx in range(len(pages)):
-        logger.info(f"Encoding appendix page {page_idx}")
-        page = pages[page_idx]
-        page_image = images[page_idx]
         # plot_hocr_bboxes(page, page_image, page_idx=page_idx, ocr_carea=True, ocr_line=True, ocr_word=True)
 
         page_beginning = etree.fromstring(f'<pb n="{page_idx+num_body_pages+1}" />')
@@ -615,30 +875,52 @@ def encode_appendix_tree(hocr_appendix_tree: etree.ElementTree, images, num_body
                 header_lines = " ".join(build_ocr_carea_text(header))
                 page_header = etree.fromstring(f'<fw type="head" place="top">{escape(header_lines.strip())}</fw>')
                 back.append(page_header)
-
-        table, table_area = encode_table(ocr_page_element=page, ocr_page_image=page_image)
-        if any([coordinate is None for coordinate in table_area]):
-            table_was_appended = True
-            logger.info(f"No table detected on appendix page {page_idx}")
-        else:
-            logger.info(f"Table detected on appendix page {page_idx}")
-            table_was_appended = False
-        table_y1 = table_area[1]
-        table_y2 = table_area[3]
-        for carea in page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
-            try:
-                carea_bbox = get_element_bbox(carea)
-                if table_was_appended or carea_bbox[3] < table_y1 or carea_bbox[1] > table_y2:
-                    carea_lines = [sanitize_line(line) for line in re_ocr_carea(carea_bbox, page_image, carea, bbox_margins, psm=6)]
-                    new_p = encode_carea_lines_as_p(carea_lines)
-                    back.append(new_p)
-                else:
-                    back.append(table)
-                    logger.info(f"Appended table to appendix page {page_idx}")
-                    table_was_appended = True
-            except Exception as e:
-                logger.exception("Error encoding appendix, continuing with next element: %s", e, exc_info=True)
-        if not table_was_appended:
-            back.append(table)
-            logger.info(f"Appended table to appendix page {page_idx}")
+        for element in page_contents[page_idx]:
+            back.append(element)
     return back
+
+
+def encode_appendix_page(page: etree.ElementTree, page_image, page_idx: int,
+                         bbox_margins: Tuple[int, int, int, int] = (20, 5, 5, 5),
+                         logger=None, table_ocr_mode: str = 'cell',
+                         table_line_detection: str = 'hocr') -> List[etree.ElementTree]:
+    """
+    Encodes the table and the careas of one appendix page
+    :param page: ocr_page element
+    :param page_image: image of the page
+    :param page_idx: index of the page in the appendix
+    :param bbox_margins:
+    :param logger: Logger that is used to log
+    :param table_ocr_mode: how the table cells are recognized, see table_encoding.encode_table
+    :param table_line_detection: where the table lines are found, see table_encoding.encode_table
+    :return: the table and the paragraphs in the order of the page
+    """
+    logger.info(f"Encoding appendix page {page_idx}")
+    elements = []
+    table, table_area = encode_table(ocr_page_element=page, ocr_page_image=page_image, table_ocr_mode=table_ocr_mode,
+                                     line_detection=table_line_detection)
+    if any([coordinate is None for coordinate in table_area]):
+        table_was_appended = True
+        logger.info(f"No table detected on appendix page {page_idx}")
+    else:
+        logger.info(f"Table detected on appendix page {page_idx}")
+        table_was_appended = False
+    table_y1 = table_area[1]
+    table_y2 = table_area[3]
+    for carea in page.xpath(".//x:div[@class='ocr_carea']", namespaces=NAMESPACES):
+        try:
+            carea_bbox = get_element_bbox(carea)
+            if table_was_appended or carea_bbox[3] < table_y1 or carea_bbox[1] > table_y2:
+                carea_lines = [sanitize_line(line) for line in re_ocr_carea(carea_bbox, page_image, carea, bbox_margins, psm=6)]
+                new_p = encode_carea_lines_as_p(carea_lines)
+                elements.append(new_p)
+            else:
+                elements.append(table)
+                logger.info(f"Appended table to appendix page {page_idx}")
+                table_was_appended = True
+        except Exception as e:
+            logger.exception("Error encoding appendix, continuing with next element: %s", e, exc_info=True)
+    if not table_was_appended:
+        elements.append(table)
+        logger.info(f"Appended table to appendix page {page_idx}")
+    return elements
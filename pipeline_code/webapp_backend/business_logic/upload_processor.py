@@ -4,10 +4,10 @@ import asyncio
 import aiofiles
 import tempfile
 import shutil
-from PIL import Image
 from lxml import etree
-from pipeline.hocr_tools.hocr_helpers import combine_hocr_pages
+from pipeline.hocr_tools.hocr_loader import load_hocr_document
 from pipeline.text_encoding import encode_hocr_tree_in_tei
+from pipeline.tei_encoding.page_images import PageImageProvider
 import traceback
 from fastapi import UploadFile
 from webapp_backend.business_logic.xml_response_parser import query_and_parse_regulations
@@ -117,10 +117,9 @@ async def encode_upload(scantailor_file_dir, tesseract_file_dir):
     image_files = [file for file in os.listdir(scantailor_file_dir) if file.endswith(".tif")]
     hocr_files.sort()
     image_files.sort()
-    hocr_trees = [etree.parse(os.path.join(tesseract_file_dir, hocr_filename)) for hocr_filename in hocr_files]
-    imgs = [Image.open(os.path.join(scantailor_file_dir, img_filename)) for img_filename in image_files]
-    tree = combine_hocr_pages(hocr_trees)
-    regulation_tree = encode_hocr_tree_in_tei(hocr_tree=tree, images=imgs)
+    tree = load_hocr_document([os.path.join(tesseract_file_dir, hocr_filename) for hocr_filename in hocr_files])
+    with PageImageProvider([os.path.join(scantailor_file_dir, img_filename) for img_filename in image_files]) as imgs:
+        regulation_tree = encode_hocr_tree_in_tei(hocr_tree=tree, images=imgs)
     # TODO Define title
     title = hash(regulation_tree)
 